@@ -125,6 +125,39 @@ class AlbumYearStrategy(Enum):
             return cls.ignore
         raise Exception("Failed to parse AlbumYearStrategy from '%s'" % (string))
 
+class OutputMode(Enum):
+    """Enum representing where and how tracks are written."""
+    in_place = 0    # Write each track's tags to its own file
+    copy = 1        # Copy each track into a new directory structure
+    hardlink = 2    # As reflink, but hard link tracks with unchanged tags
+    reflink = 3     # As copy, but reflinking tracks where supported
+    move = 4        # Move each track into a new directory structure
+
+    @classmethod
+    def from_string(cls, string):
+        """Derives a OutputMode from a string.
+
+        Args:
+            string: a string representation of the OutputMode.
+
+        Returns:
+            OutputMode representation.
+
+        Raises:
+            Exception: if the string could not be parsed or was not valid.
+        """
+        if string == 'in-place':
+            return cls.in_place
+        if string == 'copy':
+            return cls.copy
+        if string == 'hardlink':
+            return cls.hardlink
+        if string == 'reflink':
+            return cls.reflink
+        if string == 'move':
+            return cls.move
+        raise Exception("Failed to parse OutputMode from '%s'" % (string))
+
 
 
 def _int_from_string(string, valid_values=None):
@@ -171,6 +204,27 @@ def _uint_from_string(string, str_mappings=None, valid_values=None):
         raise Exception('int value invalid')
     return i
 
+def _positive_int_arg(string):
+    """Derives a positive int from a command line argument string.
+
+    Args:
+        string: a string representation of a positive int.
+
+    Returns:
+        an int.
+
+    Raises:
+        argparse.ArgumentTypeError: if the string could not be parsed or was
+            not positive.
+    """
+    try:
+        i = int(string)
+    except ValueError:
+        raise argparse.ArgumentTypeError("'%s' is not an int" % (string))
+    if i < 1:
+        raise argparse.ArgumentTypeError("'%s' is not a positive int" % (string))
+    return i
+
 def _file_path_from_string(string):
     """Verifies a string is a valid file path (lacking invalid characters).
 
@@ -232,6 +286,39 @@ class Config(object):
         renumber_cd_tracks: GenericState from renumber-cd-tracks config.
         album_variant_strategy: AlbumVariantStrategy from album-variant-strategy config.
         album_year_strategy: AlbumYearStrategy from album-year-strategy config.
+        search_threads: int number of threads to search the directory with.
+        ordered_search: boolean whether or not to search the directory in a
+            deterministic order.
+        jobs: int number of threads to index tracks with.
+        processes: int number of processes to index tracks with.
+        async_io: boolean whether or not to index with the asynchronous read
+            engine.
+        max_in_flight: int maximum number of reads the asynchronous read engine
+            may have outstanding at once.
+        batch: int number of tracks to read and decode tags for at once, or 0
+            to index tracks one at a time.
+        incremental: boolean whether or not to reuse data indexed by previous
+            runs for unchanged files.
+        stream: boolean whether or not to stream each album through all stages
+            as soon as it is found rather than running each stage in turn.
+        watch: boolean whether or not to keep watching the directory for
+            changes once it has been processed.
+        settle_time: float number of seconds a changed directory must go
+            without further changes before it is processed in watch mode.
+        output_mode: OutputMode to write tracks with.
+        write_jobs: int number of tracks to write at once.
+        max_write_bytes: int maximum total byte size of the tracks being copied
+            (or rewritten) at once.
+        resume: boolean whether or not to skip the files already written by an
+            interrupted previous run.
+        export_plan: string path to write a plan of the changes a dry run
+            would make to, or None.
+        apply_plan: string path to a plan to write the changes of instead of
+            searching and indexing the directory, or None.
+        undo_log: string path to the undo log to record the original tags of
+            changed files in, or None for the default in the directory.
+        undo: string path to an undo log to restore files from instead of
+            processing the directory, or None.
     """
     def __init__(self):
         """Builds the program config from the command line and config file."""
@@ -249,6 +336,92 @@ class Config(object):
         self._argparser.add_argument('-d', '--directory-mode', action='store_true', help=\
             'force the directory structure to be the ground truth, using its '
             'structure (artist/album/song.mp3) for the tag')
+        self._argparser.add_argument('--search-threads', type=_positive_int_arg,
+            default=8, metavar='N', help=\
+            'number of threads to search the directory structure with. Default '
+            'is 8')
+        self._argparser.add_argument('--ordered-search', action='store_true', help=\
+            'search the directory structure in a deterministic (sorted) order')
+        self._argparser.add_argument('-j', '--jobs', type=_positive_int_arg,
+            default=1, metavar='N', help=\
+            'number of tracks to index at once. Values above 1 help most on '
+            'high-latency (e.g. network) storage. Default is 1')
+        self._argparser.add_argument('-p', '--processes', type=_positive_int_arg,
+            default=1, metavar='N', help=\
+            'number of processes to index tracks with, each indexing whole '
+            'folders at a time. Values above 1 help most when indexing is CPU '
+            'bound (e.g. the files are cached). Cannot be combined with --jobs '
+            'or --incremental. Default is 1')
+        self._argparser.add_argument('--async-io', action='store_true', help=\
+            'index using the asynchronous read engine, which schedules tag reads '
+            'for up to --max-in-flight files at once on as many I/O threads and '
+            'parses them as they complete. Suited to very high-latency (e.g. '
+            'object store backed) mounts. Cannot be combined with --jobs')
+        self._argparser.add_argument('--max-in-flight', type=_positive_int_arg,
+            default=64, metavar='N', help=\
+            'maximum number of reads the asynchronous read engine may have '
+            'outstanding at once. Default is 64')
+        self._argparser.add_argument('-b', '--batch', type=_positive_int_arg,
+            default=0, metavar='N', help=\
+            'index tracks in batches of N (e.g. 1024), reading the tags of a '
+            'whole batch together and decoding their fixed fields together, '
+            'vectorised with NumPy when it is installed. Cannot be combined '
+            'with --jobs, --processes or --async-io')
+        self._argparser.add_argument('-i', '--incremental', action='store_true', help=\
+            'only index files which have changed since the previous incremental '
+            'run, reusing the data stored for the rest in a manifest file in the '
+            'searched directory')
+        self._argparser.add_argument('-s', '--stream', action='store_true', help=\
+            'stream each album folder through searching, indexing and '
+            'standardising as soon as it is found, rather than completing each '
+            'stage over the whole directory before starting the next')
+        self._argparser.add_argument('-w', '--watch', action='store_true', help=\
+            'once processed, keep watching the directory and update the albums '
+            'in any folders whose files change')
+        self._argparser.add_argument('--settle-time', type=float, default=5.0,
+            metavar='SECONDS', help=\
+            'number of seconds a folder must go unchanged before its changes are '
+            'processed in watch mode. Default is 5')
+        self._argparser.add_argument('--output-mode', default='copy',
+            choices=['copy', 'hardlink', 'reflink', 'move', 'in-place'], help=\
+            'how tracks are written when writing changes. copy, hardlink and '
+            'reflink create a new music_tagger_output directory structure '
+            'beside the searched one, leaving the original files untouched, by '
+            'copying each file (copy), by reflinking each file where the '
+            'filesystem supports it (reflink), or additionally by hard linking '
+            'files whose tags are already correct (hardlink). move creates the '
+            'same structure by moving each file, only renaming files whose tags '
+            'are already correct, and in-place updates each file where it is. '
+            'Default is copy')
+        self._argparser.add_argument('--write-jobs', type=_positive_int_arg,
+            default=1, metavar='N', help=\
+            'number of tracks to write at once when writing changes, each '
+            'folder being written by one thread at a time. Default is 1')
+        self._argparser.add_argument('--max-write-mb', type=_positive_int_arg,
+            default=256, metavar='MB', help=\
+            'maximum total size in megabytes of the tracks being copied or '
+            'rewritten at once with --write-jobs (tracks whose tags are only '
+            'patched are not counted). Default is 256')
+        self._argparser.add_argument('--resume', action='store_true', help=\
+            'when writing changes, skip the files already written by a previous '
+            'run which was interrupted, as recorded in its journal file in the '
+            'searched directory. Requires --write')
+        self._argparser.add_argument('--export-plan', metavar='PLAN', help=\
+            'on a dry run, write a machine-readable (JSON lines) plan of the '
+            'changes writing would make to each file to PLAN, for later use '
+            'with --apply-plan')
+        self._argparser.add_argument('--apply-plan', metavar='PLAN', help=\
+            'write the changes in PLAN (made by --export-plan for the same '
+            'directory) rather than searching and indexing the directory again. '
+            'Files changed since the plan was made are skipped. Implies --write '
+            'and the output mode the plan was made for')
+        self._argparser.add_argument('--undo-log', metavar='LOG', help=\
+            'when writing changes in the in-place or move output modes, append '
+            'the original tags and path of each file to LOG before writing it. '
+            'Default is a log file in the searched directory')
+        self._argparser.add_argument('--undo', metavar='LOG', help=\
+            'restore the original tags and paths of every file recorded in LOG '
+            '(by --undo-log) rather than processing the directory')
         # Initialise config file parser
         self._cfg = ConfigParser.RawConfigParser()
 
@@ -258,6 +431,47 @@ class Config(object):
         self.directory = self._arg.directory
         self.verbose = True if self._arg.verbose else False
         self.dry_run = True if not self._arg.write else False
+        self.search_threads = self._arg.search_threads
+        self.ordered_search = True if self._arg.ordered_search else False
+        self.jobs = self._arg.jobs
+        self.processes = self._arg.processes
+        self.async_io = True if self._arg.async_io else False
+        self.max_in_flight = self._arg.max_in_flight
+        if self.processes > 1 and (self.jobs > 1 or self.async_io or \
+                                   self._arg.incremental):
+            self._argparser.error('--processes cannot be combined with --jobs, '
+                                  '--async-io or --incremental')
+        if self.async_io and self.jobs > 1:
+            self._argparser.error('--async-io cannot be combined with --jobs (use '
+                                  '--max-in-flight)')
+        self.batch = self._arg.batch
+        if self.batch and (self.jobs > 1 or self.processes > 1 or self.async_io):
+            self._argparser.error('--batch cannot be combined with --jobs, '
+                                  '--processes or --async-io')
+        self.incremental = True if self._arg.incremental else False
+        self.stream = True if self._arg.stream else False
+        self.watch = True if self._arg.watch else False
+        self.settle_time = self._arg.settle_time
+        self.output_mode = OutputMode.from_string(self._arg.output_mode)
+        self.write_jobs = self._arg.write_jobs
+        self.max_write_bytes = self._arg.max_write_mb << 20
+        self.export_plan = self._arg.export_plan
+        self.apply_plan = self._arg.apply_plan
+        if self.apply_plan:
+            self.dry_run = False
+        if self.export_plan and not self.dry_run:
+            self._argparser.error('--export-plan cannot be combined with --write '
+                                  'or --apply-plan')
+        if self.apply_plan and self._arg.watch:
+            self._argparser.error('--apply-plan cannot be combined with --watch')
+        self.undo_log = self._arg.undo_log
+        self.undo = self._arg.undo
+        if self.undo and (self.apply_plan or self.export_plan or self.watch):
+            self._argparser.error('--undo cannot be combined with --apply-plan, '
+                                  '--export-plan or --watch')
+        self.resume = True if self._arg.resume else False
+        if self.resume and self.dry_run:
+            self._argparser.error('--resume requires --write')
         if not self._arg.directory_mode:
             print 'Error: directory mode (-d) is not enabled (i.e. you are telling'
             print 'the program you have a mismatched folder structure), however the'
@@ -0,0 +1,193 @@
+"""Imports:
+    os: listing directories
+    threading: listing several directories concurrently
+    time: measuring the rate at which directories are listed
+    Queue: passing directories between the crawler and its worker threads
+    scandir: (optional) listing directories without stat-ing every entry. This
+        is os.scandir where available, otherwise the scandir backport package.
+        When neither is available listing falls back to os.listdir.
+"""
+import os
+import threading
+import time
+import Queue
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
+
+DEFAULT_THREAD_COUNT = 8
+
+
+def list_directory(dirname):
+    """Lists a single directory, splitting its entries into folders and files.
+
+    Symbolic links to directories are neither recursed into nor reported as
+    files (matching the behaviour of os.walk without followlinks). When
+    scandir is available the entry type is taken from the directory listing
+    itself (d_type) so no additional stat is issued per entry.
+
+    Args:
+        dirname: string path to the directory to list.
+
+    Returns:
+        A tuple of (subdirnames, filenames), each a list of string names
+        relative to dirname. Both will be empty if the directory could not be
+        listed.
+    """
+    subdirnames = []
+    filenames = []
+    try:
+        if _scandir is not None:
+            for entry in _scandir(dirname):
+                if entry.is_dir():
+                    if not entry.is_symlink():
+                        subdirnames.append(entry.name)
+                else:
+                    filenames.append(entry.name)
+        else:
+            for name in os.listdir(dirname):
+                path = os.path.join(dirname, name)
+                if os.path.isdir(path):
+                    if not os.path.islink(path):
+                        subdirnames.append(name)
+                else:
+                    filenames.append(name)
+    except OSError:
+        # Unreadable directories are skipped, as os.walk does by default.
+        return [], []
+    return subdirnames, filenames
+
+
+class Crawler(object):
+    """Recursively lists a directory tree, spreading listings over threads.
+
+    Iterating over a Crawler yields a (dirname, filenames) tuple for every
+    directory in the tree as soon as it has been listed, so files can be
+    processed while the rest of the tree is still being explored.
+
+    Attributes:
+        root: string path to the directory the crawl starts from.
+        thread_count: int number of threads used to list directories.
+        ordered: boolean, True to yield directories in a deterministic order
+            (sorted, depth-first, parents before children - as a sorted os.walk
+            would) or False to yield them in whatever order they are listed.
+        directory_count: int number of directories yielded so far.
+        elapsed_seconds: float number of seconds spent crawling so far.
+    """
+    def __init__(self, root, thread_count=DEFAULT_THREAD_COUNT, ordered=False,
+                 report_progress=None):
+        """Creates the Crawler object.
+
+        Args:
+            root: string path to the directory to crawl.
+            thread_count: Optional int number of threads to list directories
+                with. Must be at least 1.
+            ordered: Optional boolean, True to yield directories in a
+                deterministic order.
+            report_progress: Optional two argument function to report progress
+                where the first argument is the number of directories listed and
+                the second argument is the number of seconds elapsed.
+
+        Returns:
+            The initialised Crawler object.
+        """
+        if thread_count < 1:
+            raise Exception("Cannot create a Crawler with %d threads." % (thread_count))
+        self.root = root
+        self.thread_count = thread_count
+        self.ordered = ordered
+        self.report_progress = report_progress
+        self.directory_count = 0
+        self.elapsed_seconds = 0.0
+
+
+    def __iter__(self):
+        """Crawls the tree.
+
+        Yields:
+            A (dirname, filenames) tuple for each directory in the tree, where
+            dirname is the path to the directory and filenames is a list of the
+            names of the non-directory entries in it.
+        """
+        pending = Queue.Queue()
+        results = Queue.Queue()
+
+        def worker():
+            """Lists directories from the pending queue until told to stop"""
+            while True:
+                dirname = pending.get()
+                if dirname is None:
+                    return
+                try:
+                    subdirnames, filenames = list_directory(dirname)
+                    results.put((dirname, subdirnames, filenames, None))
+                except Exception as e: # pylint: disable=broad-except
+                    results.put((dirname, [], [], e))
+
+        threads = [threading.Thread(target=worker) for _ in range(self.thread_count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        start_time = time.time()
+        # Directories listed but not yet yielded (ordered mode only), and the
+        # stack of directories to yield next, top first.
+        completed = {}
+        order_stack = [self.root]
+        outstanding = 1
+        pending.put(self.root)
+        try:
+            while outstanding:
+                dirname, subdirnames, filenames, error = results.get()
+                outstanding -= 1
+                if error is not None:
+                    raise error
+                # Queue up the subdirectories immediately so the workers never
+                # wait on the order in which directories are yielded.
+                for subdirname in subdirnames:
+                    pending.put(os.path.join(dirname, subdirname))
+                outstanding += len(subdirnames)
+                if not self.ordered:
+                    self.__record_progress(start_time)
+                    yield dirname, filenames
+                    continue
+                subdirnames.sort()
+                filenames.sort()
+                completed[dirname] = (subdirnames, filenames)
+                while order_stack and order_stack[-1] in completed:
+                    next_dirname = order_stack.pop()
+                    subdirnames, filenames = completed.pop(next_dirname)
+                    order_stack.extend(os.path.join(next_dirname, s) \
+                                       for s in reversed(subdirnames))
+                    self.__record_progress(start_time)
+                    yield next_dirname, filenames
+        finally:
+            # Abandon any queued work, then wait for the threads to stop.
+            try:
+                while True:
+                    pending.get_nowait()
+            except Queue.Empty:
+                pass
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+
+    def __record_progress(self, start_time):
+        """Updates the crawl statistics and reports them
+
+        Args:
+            start_time: float time at which the crawl started.
+
+        Returns:
+            None
+        """
+        self.directory_count += 1
+        self.elapsed_seconds = time.time() - start_time
+        if self.report_progress:
+            self.report_progress(self.directory_count, self.elapsed_seconds)
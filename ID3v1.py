@@ -1,8 +1,18 @@
 """Imports:
+    os: finding the size of files
     TrackData: for containing the extracted information
 """
+import os
 import TrackData
 
+# Byte sizes of the standard and extended tags. The extended tag, when present,
+# immediately precedes the standard tag at the end of the file.
+TAG_SIZE = 128
+EXTENDED_TAG_SIZE = 227
+MAX_TAG_SIZE = TAG_SIZE + EXTENDED_TAG_SIZE
+# Byte size of the title, artist and album fields of a standard tag.
+FIELD_SIZE = 30
+
 
 def _strip_null_bytes(data):
     """Strips extraneous whitespace and null bytes from data to give a string.
@@ -98,6 +108,24 @@ class _Tag(object):
         return self.data
 
 
+def read_tag_size(tail_data):
+    """Calculates the size of an ID3v1 tag from the end of a file
+
+    Args:
+        tail_data: character array of bytes read from the end of the file. Must
+            be at least the last MAX_TAG_SIZE bytes of the file, or the whole
+            file if it is shorter than that.
+
+    Returns:
+        int number of bytes in the tag, or 0 if the file does not have one
+    """
+    if tail_data[-TAG_SIZE:-TAG_SIZE+3] != "TAG":
+        return 0
+    if tail_data[-MAX_TAG_SIZE:-MAX_TAG_SIZE+4] == "TAG+":
+        return MAX_TAG_SIZE
+    return TAG_SIZE
+
+
 def calculate_tag_size(file_handle):
     """Calculates the size of an ID3v1 tag
 
@@ -109,17 +137,44 @@ def calculate_tag_size(file_handle):
     """
     # Read the standard and extended tag headers
     cursor_pos = file_handle.tell()
-    file_handle.seek(-(128+227), 2)
-    tagx_header = file_handle.read(4)
-    file_handle.seek(-128, 2)
-    tag_header = file_handle.read(3)
+    file_size = os.fstat(file_handle.fileno()).st_size
+    file_handle.seek(-min(file_size, MAX_TAG_SIZE), 2)
+    tail_data = file_handle.read(MAX_TAG_SIZE)
     file_handle.seek(cursor_pos, 0)
     # Calculate tag size
-    if tag_header == "TAG":
-        if tagx_header == "TAG+":
-            return 128+227
-        return 128
-    return 0
+    return read_tag_size(tail_data)
+
+
+def parse_tag_data(tail_data, clean=True):
+    """Parses the ID3v1 tag data from the end of a file (if present).
+
+    ID3 v1.0 and v1.1 tags are supported along with extended tags.
+
+    Args:
+        tail_data: character array of bytes read from the end of the file. Must
+            be at least the last MAX_TAG_SIZE bytes of the file, or the whole
+            file if it is shorter than that.
+        clean: Optional boolean, whether to clean the strings read. Defaults
+            to True.
+
+    Returns:
+        A TrackData with the fields initialised to the data read from the tag.
+        Non-present fields will be initialised to None. If no valid tag exists
+        None will be returned.
+    """
+    tag_size = read_tag_size(tail_data)
+    # If we don't have a tag, drop out
+    if tag_size == 0:
+        return None
+    # Parse the tag
+    tag_data = tail_data[-TAG_SIZE:]
+    tagx_data = tail_data[-MAX_TAG_SIZE:-TAG_SIZE]
+    tag = _Tag(tag_data, tagx_data)
+    data = tag.get_data()
+    # clean the strings generated
+    if clean:
+        data.clean(False)
+    return data
 
 
 def read_tag_data(file_path):
@@ -136,30 +191,26 @@ def read_tag_data(file_path):
         None will be returned.
     """
     with open(file_path, "rb", 0) as f:
-        # Go to the (128+227)th byte before the end.
-        f.seek(-(128+227), 2)
-        # Read the 227 bytes that would make up the extended id3v1 tag.
-        tagx_data = f.read(227)
-        # Read the final 128 bytes that would make up the id3v1 tag.
-        tag_data = f.read(128)
-        has_tag = tag_data[:3] == "TAG"
-        # If we don't have a tag, drop out
-        if not has_tag:
-            return None
-        # Parse the tag
-        tag = _Tag(tag_data, tagx_data)
-        data = tag.get_data()
-        # clean the strings generated
-        data.clean(False)
-        return data
-    return None
+        # Read the (128+227) bytes that would make up the extended and standard
+        # id3v1 tags.
+        file_size = os.fstat(f.fileno()).st_size
+        f.seek(-min(file_size, MAX_TAG_SIZE), 2)
+        tail_data = f.read(MAX_TAG_SIZE)
+    return parse_tag_data(tail_data)
 
 
-def create_tag_string(data):
+def create_tag_string(data, tail_data=None):
     """ Converts the given TrackData into a ID3v1.1 tag.
 
+    TrackData holds neither a comment nor a genre, so these are kept from the
+    file's existing tag (with the comment shortened to fit alongside the track
+    number). Without an existing tag the comment is empty and the genre is
+    255, 'unknown'.
+
     Args:
         data: A TrackData object whose data will be put into the tag.
+        tail_data: Optional character array of bytes read from the end of the
+            file this TrackData is originally from (see parse_tag_data).
 
     Returns:
         A string of the correct byte length representing the ID3v1.1 tag.
@@ -168,6 +219,13 @@ def create_tag_string(data):
         year_string = str(data.year)
     else:
         year_string = '\00' * 4
+    if tail_data is not None and read_tag_size(tail_data):
+        tag_data = tail_data[-TAG_SIZE:]
+        comment_string = tag_data[97:125]
+        genre_string = tag_data[127]
+    else:
+        comment_string = '\00' * 28
+        genre_string = chr(255)
     # 3 B header, 30 B title, 30 B artist, 30 B album, 4 B year string,
     # 28 B comment, zero-byte (signifying v1.1), 1 B track, 1 B genre
     new_tag = "TAG"                             \
@@ -175,8 +233,8 @@ def create_tag_string(data):
             + _pack_null_bytes(data.artist, 30) \
             + _pack_null_bytes(data.album, 30)  \
             + year_string                       \
-            + '\00' * 28                        \
+            + comment_string                    \
             + '\00'                             \
             + chr(data.track)                   \
-            + chr(data.genre)
+            + genre_string
     return new_tag
@@ -1,8 +1,20 @@
 """Imports:
+    struct: unpacking the binary fields of tags
+    zlib: decompressing compressed frames
     TrackData: for containing the extracted information
 """
+import struct
+import zlib
 import TrackData
 
+# Byte size of the header at the start of every tag, and of the footer at the
+# end of ID3v2.4 tags which have one.
+TAG_HEADER_SIZE = 10
+FOOTER_SIZE = 10
+# Byte size of the first read from the start of a file. Most tags fit entirely
+# within this so can be read in a single call, larger ones are topped up.
+SPECULATIVE_READ_SIZE = 4096
+
 # Valid Frame IDs for each of the different versions
 _V22_FRAME_IDS = [\
     "BUF", "CNT", "COM", "CRA", "CRM", "ETC", "EQU", "GEO", "IPL", "LNK", "MCI",
@@ -53,6 +65,39 @@ _V23_V22_FRAME_ID_MAPPINGS = {\
     "USLT": "ULT", "WOAF": "WAF", "WOAR": "WAR", "WOAS": "WAS", "WCOM": "WCM",
     "WCOP": "WCP", "WPUB": "WPB", "WXXX": "WXX"}
 _EXPERIMENTAL_FRAME_ID_PREFIXS = ["X", "Y", "Z"]
+# ID3v2.4 frames with an ID3v2.3 equivalent: timestamps for which ID3v2.3 only
+# holds the year, and sort orders for which ID3v2.3 players use experimental
+# frames.
+_V24_V23_FRAME_ID_MAPPINGS = {\
+    "TDOR": "TORY", "TDRC": "TYER", "TSOA": "XSOA", "TSOP": "XSOP", "TSOT": "XSOT"}
+_V24_TIMESTAMP_FRAME_IDS = ["TDOR", "TDRC"]
+# ID3v2.2 frames whose bodies reference other frames by their three character
+# IDs, so cannot be copied to ID3v2.3 tags.
+_V22_UNCONVERTIBLE_FRAME_IDS = ["CRM", "LNK"]
+# Frames written from TrackData, so never copied from the previous tag.
+_REPLACED_FRAME_IDS = ["TALB", "TIT2", "TPE1", "TRCK", "TYER"]
+
+
+# Precompiled layouts of the big-endian integers used throughout tags.
+_UINT32 = struct.Struct('>I')
+_UINT16 = struct.Struct('>H')
+
+
+def _decode_syncsafe(value):
+    """Decodes a 32-bit syncsafe integer (28 bits with 4 sync bits zeroed out)
+
+    Args:
+        value: unsigned int read as a standard 32-bit integer
+
+    Returns:
+        unsigned int represented by the syncsafe integer
+    """
+    if value & 0x80808080:
+        raise Exception("Attempt to read an invalid 32-bit syncsafe integer")
+    return ((value & 0x7F000000) >> 3) \
+         | ((value & 0x007F0000) >> 2) \
+         | ((value & 0x00007F00) >> 1) \
+         | ((value & 0x0000007F))
 
 
 def _read_32bit_syncsafe(byte_data):
@@ -64,16 +109,7 @@ def _read_32bit_syncsafe(byte_data):
     Returns:
         unsigned int representation of the byte data
     """
-    int_bytes = [ord(b) for b in byte_data]
-    if (int_bytes[0] & 0x80) or \
-       (int_bytes[1] & 0x80) or \
-       (int_bytes[2] & 0x80) or \
-       (int_bytes[3] & 0x80):
-        raise Exception("Attempt to read an invalid 32-bit syncsafe integer")
-    return (int_bytes[0] << 21) \
-         + (int_bytes[1] << 14) \
-         + (int_bytes[2] <<  7) \
-         + (int_bytes[3])
+    return _decode_syncsafe(_UINT32.unpack_from(byte_data)[0])
 
 
 def _read_32bit_nonsyncsafe(byte_data):
@@ -85,40 +121,282 @@ def _read_32bit_nonsyncsafe(byte_data):
     Returns:
         unsigned int representation of the byte data
     """
-    int_bytes = [ord(b) for b in byte_data]
-    return (int_bytes[0] << 24) \
-         + (int_bytes[1] << 16) \
-         + (int_bytes[2] <<  8) \
-         + (int_bytes[3])
+    return _UINT32.unpack_from(byte_data)[0]
 
 
-def _read_24bit_nonsyncsafe(byte_data):
-    """Reads a standard 24-bit unsigned integer
+def _read_16bit_nonsyncsafe(byte_data):
+    """Reads a standard 16-bit unsigned integer
 
     Args:
-        byte_data: character array of bytes. Must be 3 bytes long
+        byte_data: character array of bytes. Must be 2 bytes long
 
     Returns:
         unsigned int representation of the byte data
     """
-    int_bytes = [ord(b) for b in byte_data]
-    return (int_bytes[0] << 16) \
-         + (int_bytes[1] <<  8) \
-         + (int_bytes[2])
+    return _UINT16.unpack_from(byte_data)[0]
 
 
-def _read_16bit_nonsyncsafe(byte_data):
-    """Reads a standard 16-bit unsigned integer
+class _FrameFormat(object):
+    """Layout of the frame headers of one ID3v2 version
+
+    Attributes:
+        header: struct.Struct unpacking a frame header. For ID3v2.2 this gives
+            the id and the high byte and low 16 bits of the size, otherwise it
+            gives the id, size and flags.
+        header_size: int byte size of each frame header
+        syncsafe_size: bool, True if the size is a syncsafe integer
+        valid_ids: frozenset of the frame ids defined by this version
+        flag_masks: dictionary mapping strings to the bit of the flags for
+            each available flag
+        known_flags: int mask of every bit of the flags which is understood
+    """
+    def __init__(self, header_layout, syncsafe_size, valid_ids, flag_masks):
+        self.header = struct.Struct(header_layout)
+        self.header_size = self.header.size
+        self.syncsafe_size = syncsafe_size
+        self.valid_ids = frozenset(valid_ids)
+        self.flag_masks = flag_masks
+        self.known_flags = 0
+        for mask in flag_masks.values():
+            self.known_flags |= mask
+
+
+_FRAME_FORMATS = {
+    2: _FrameFormat('>3sBH', False, _V22_FRAME_IDS, {}),
+    3: _FrameFormat('>4sIH', False, _V23_FRAME_IDS, {
+        'tag_alter_preservation': 0x8000, 'file_alter_preservation': 0x4000,
+        'read_only': 0x2000, 'compression': 0x0080, 'encryption': 0x0040,
+        'grouping_identity': 0x0020}),
+    4: _FrameFormat('>4sIH', True, _V24_FRAME_IDS, {
+        'tag_alter_preservation': 0x4000, 'file_alter_preservation': 0x2000,
+        'read_only': 0x1000, 'grouping_identity': 0x0040,
+        'compression': 0x0008, 'encryption': 0x0004,
+        'unsynchronisation': 0x0002, 'data_length_indicator': 0x0001})}
+# Frame flags describing how the frame should be treated, rather than how its
+# body is stored. These mean the same in every version which has flags.
+_STATUS_FLAGS = ['tag_alter_preservation', 'file_alter_preservation', 'read_only']
+# ID3v2.4 frame flags which change how the frame's body is stored.
+_V24_ENCODED_FLAGS = 0x004F
+
+
+def _iter_frames(tag_data, version, offset, end):
+    """Walks the frames of a tag without copying their contents
+
+    Frame headers are unpacked in place from a memoryview of the tag and
+    validated. Frame bodies are left untouched so only those which are
+    actually needed are ever copied.
 
     Args:
-        byte_data: character array of bytes. Must be 2 bytes long
+        tag_data: character array of bytes of the tag
+        version: int major version of the tag
+        offset: int offset of the first frame from the start of the tag
+        end: int offset of the end of the frames from the start of the tag
+
+    Yields:
+        A (frame_id, flags, body_offset, body_size) tuple for each frame, where
+        frame_id is the string id of the frame, flags is its int flags field
+        (always 0 for ID3v2.2), body_offset is the int offset of its body from
+        the start of the tag and body_size is the int byte size of its body.
+    """
+    if version not in _FRAME_FORMATS:
+        raise Exception("Unknown tag version 'ID3v2.%d'" % (version))
+    frame_format = _FRAME_FORMATS[version]
+    unpack_from = frame_format.header.unpack_from
+    header_size = frame_format.header_size
+    view = memoryview(tag_data)
+    while offset + header_size <= end:
+        if view[offset] == '\0':
+            # If we have read a null byte we have reached the end of the
+            # tag. It turns out the majority of ID3 tags are heavily padded
+            # and are actually significantly longer than necessary so
+            # editors can modify without having to rewrite the entire MP3
+            # file. This is poorly documented.
+            # The ID3 tags I have tested are typically between 500 and 1000
+            # bytes while actual allocation is around 4200 bytes per tag.
+            break
+        if version == 2:
+            frame_id, size_high, size_low = unpack_from(view, offset)
+            body_size = (size_high << 16) | size_low
+            flags = 0
+        else:
+            frame_id, body_size, flags = unpack_from(view, offset)
+            if frame_format.syncsafe_size:
+                body_size = _decode_syncsafe(body_size)
+        # Assert frame id is known
+        if not (frame_id in frame_format.valid_ids or \
+                frame_id[0] in _EXPERIMENTAL_FRAME_ID_PREFIXS):
+            if version == 3 and frame_id[:3] in _FRAME_FORMATS[2].valid_ids:
+                # Some archaeic players (iTunes 6.0 in particular) write out
+                # v2.3 tags but using v2.2 Frame IDs. Completely against the
+                # standard but this affects enough files it's worth addressing...
+                frame_id = _V22_V23_FRAME_ID_MAPPINGS[frame_id[:3]]
+                # TODO: Warning?
+            else:
+                raise Exception("Unknown ID3v2.%d Frame ID '%s'" % (version, frame_id))
+        # Assert frame size is valid
+        # TODO: Handle this properly
+        if body_size == 0:
+            #raise Exception("Invalid ID3v2.%d Frame Size '0'" % (version))
+            print "WARNING: Empty frame found. Technically illegal"
+        # TODO: Handle unsupported flags
+        # Ensure flags are valid
+        if flags & ~frame_format.known_flags:
+            raise Exception("Unknown ID3v2.%d Flags '0x%04X' (should be 0)" % \
+                (version, flags & ~frame_format.known_flags))
+        offset += header_size
+        yield frame_id, flags, offset, body_size
+        offset += body_size
+
+
+def _deunsynchronise(data):
+    """Reverses the unsynchronisation scheme in a single pass
+
+    Unsynchronisation inserts a null byte after every 0xFF byte which could
+    otherwise be mistaken for the start of an MPEG sync word, so removing the
+    null byte after every 0xFF restores the original data.
+
+    Args:
+        data: character array of unsynchronised bytes
 
     Returns:
-        unsigned int representation of the byte data
+        character array of the original bytes
+    """
+    return data.replace('\xFF\x00', '\xFF')
+
+
+def _decode_frame_body(version, frame_id, flags, body_data, unsynchronised=False):
+    """Decodes the raw body of a frame into its content
+
+    Strips the additional data the frame's flags add to the start of its body,
+    then undoes any unsynchronisation and compression. The data length
+    indicator (or, in ID3v2.3, the decompressed size) is used to size the
+    output buffer up front when decompressing.
+
+    Args:
+        version: int major version of the tag the frame was read from
+        frame_id: string id of the frame, for error reporting
+        flags: int flags field of the frame, as yielded by _iter_frames
+        body_data: character array of bytes of the frame's body as stored
+        unsynchronised: Optional bool, True if the whole ID3v2.4 tag is
+            unsynchronised regardless of the frame's flags
+
+    Returns:
+        character array of bytes of the frame's content, or None if the frame
+        is encrypted (and so cannot be read)
+    """
+    if version == 2:
+        return body_data
+    flag_masks = _FRAME_FORMATS[version].flag_masks
+    data_length = None
+    prefix_size = 0
+    if version == 3:
+        # Additional data is in the order: decompressed size, encryption
+        # method, group identifier.
+        if flags & flag_masks['compression']:
+            data_length = _UINT32.unpack_from(body_data)[0]
+            prefix_size += 4
+        if flags & flag_masks['encryption']:
+            return None
+        if flags & flag_masks['grouping_identity']:
+            prefix_size += 1
+        body_data = body_data[prefix_size:]
+    else:
+        # Additional data is in the order: group identifier, encryption
+        # method, data length indicator.
+        if flags & flag_masks['grouping_identity']:
+            prefix_size += 1
+        if flags & flag_masks['encryption']:
+            return None
+        if flags & flag_masks['data_length_indicator']:
+            data_length = _decode_syncsafe(_UINT32.unpack_from(body_data, prefix_size)[0])
+            prefix_size += 4
+        body_data = body_data[prefix_size:]
+        if unsynchronised or flags & flag_masks['unsynchronisation']:
+            body_data = _deunsynchronise(body_data)
+    if flags & flag_masks['compression']:
+        try:
+            if data_length:
+                body_data = zlib.decompress(body_data, zlib.MAX_WBITS, data_length)
+            else:
+                body_data = zlib.decompress(body_data)
+        except zlib.error:
+            raise Exception("Corrupt compressed ID3v2.%d Frame '%s'" % (version, frame_id))
+    return body_data
+
+
+def _frame_flags(version, flags):
+    """Decodes the flags of a frame
+
+    Args:
+        version: int major version of the tag the frame was read from
+        flags: int flags field of the frame, as yielded by _iter_frames
+
+    Returns:
+        dictionary mapping strings to bools for each available flag
+    """
+    flag_masks = _FRAME_FORMATS[version].flag_masks
+    return dict((flag, (flags & flag_masks[flag]) != 0) for flag in flag_masks)
+
+
+def _convert_v24_flags(flags):
+    """Converts the status flags of an ID3v2.4 frame to ID3v2.3 flags
+
+    Format flags are dropped, the frame's body must have been decoded to match.
+
+    Args:
+        flags: int flags field of the ID3v2.4 frame
+
+    Returns:
+        int flags field for the ID3v2.3 frame
+    """
+    v24_masks = _FRAME_FORMATS[4].flag_masks
+    v23_masks = _FRAME_FORMATS[3].flag_masks
+    converted_flags = 0
+    for flag in _STATUS_FLAGS:
+        if flags & v24_masks[flag]:
+            converted_flags |= v23_masks[flag]
+    return converted_flags
+
+
+def _convert_v22_picture(body_data):
+    """Converts the body of an ID3v2.2 PIC frame to that of an APIC frame
+
+    The three character image format is replaced by a MIME type.
+
+    Args:
+        body_data: character array of bytes of the PIC frame's body
+
+    Returns:
+        character array of bytes of the APIC frame's body
+    """
+    image_format = body_data[1:4].lower()
+    if image_format == "jpg":
+        image_format = "jpeg"
+    return body_data[0] + "image/" + image_format + "\0" + body_data[4:]
+
+
+def _convert_v24_timestamp(body_data):
+    """Converts the body of an ID3v2.4 timestamp frame to that of a year frame
+
+    Args:
+        body_data: character array of bytes of the timestamp frame's body
+
+    Returns:
+        character array of bytes of the ID3v2.3 year frame's body
+    """
+    return "\x00" + _read_frame_text(body_data)[:4]
+
+
+def _convert_utf8_text(body_data):
+    """Re-encodes a UTF-8 text frame body (only valid in ID3v2.4) as UTF-16
+
+    Args:
+        body_data: character array of bytes of the frame's body
+
+    Returns:
+        character array of bytes of the frame's body in ID3v2.3 encoding
     """
-    int_bytes = [ord(b) for b in byte_data]
-    return (int_bytes[0] <<  8) \
-         + (int_bytes[1])
+    return "\x01" + body_data[1:].decode('utf_8').encode('utf_16')
 
 
 class _TagHeader(object):
@@ -250,304 +528,235 @@ class _TagExtendedHeader(object):
 
 
 
-class _FrameHeader(object):
-    """ID3v2 tag frame
-
-    Attributes:
-        id: string id of the frame
-        version: int version of the tag this frame was read from
-        body_offset: the absolute file offset of this frame's body
-        header_size: int byte size of header data
-        body_size: int byte size of all non-header data in the frame
-        flags: dictionary mapping strings to bools for each available flag
-    """
-    def __init__(self, version, header_data, offset):
-        """Interprets byte data as a frame header to build object
-
-        Args:
-            version: int version of the tag this frame was read from
-            header_data: character array of bytes representing the tag header
-            offset: int absolute file offset of this frame's body
-        """
-        self.flags = {}
-        self.version = version
-        self.body_offset = offset
-        # Extract header information depending on version
-        if version == 2:
-            self.id = header_data[:3]
-            self.header_size = 6
-            self.body_size = _read_24bit_nonsyncsafe(header_data[3:6])
-            unknown_flags = 0
-            valid_ids = _V22_FRAME_IDS
-        elif version == 3:
-            self.id = header_data[:4]
-            self.header_size = 10
-            self.body_size = _read_32bit_nonsyncsafe(header_data[4:8])
-            flag_int = _read_16bit_nonsyncsafe(header_data[8:10])
-            self.flags['tag_alter_preservation'] = flag_int & 0x8000
-            self.flags['file_alter_preservation'] = flag_int & 0x4000
-            self.flags['read_only'] = flag_int & 0x2000
-            self.flags['compression'] = flag_int & 0x0080
-            self.flags['encryption'] = flag_int & 0x0040
-            self.flags['grouping_identity'] = flag_int & 0x0020
-            unknown_flags = flag_int & ~0xE0E0
-            valid_ids = _V23_FRAME_IDS
-        elif version == 4:
-            self.id = header_data[:4]
-            self.header_size = 10
-            self.body_size = _read_32bit_syncsafe(header_data[4:8])
-            flag_int = _read_16bit_nonsyncsafe(header_data[8:10])
-            self.flags['tag_alter_preservation'] = flag_int & 0x4000
-            self.flags['file_alter_preservation'] = flag_int & 0x2000
-            self.flags['read_only'] = flag_int & 0x1000
-            self.flags['grouping_identity'] = flag_int & 0x0040
-            self.flags['compression'] = flag_int & 0x0008
-            self.flags['encryption'] = flag_int & 0x0004
-            self.flags['unsynchronisation'] = flag_int & 0x0002
-            self.flags['data_length_indicator'] = flag_int & 0x0001
-            unknown_flags = flag_int & ~0x704F
-            valid_ids = _V24_FRAME_IDS
-        else:
-            raise Exception("Unknown tag version 'ID3v2.%d'" % (version))
-        # Assert frame id is known
-        if not (self.id[0] in _EXPERIMENTAL_FRAME_ID_PREFIXS or self.id in valid_ids):
-            if version == 3 and self.id[:3] in _V22_FRAME_IDS:
-                # Some archaeic players (iTunes 6.0 in particular) write out
-                # v2.3 tags but using v2.2 Frame IDs. Completely against the
-                # standard but this affects enough files it's worth addressing...
-                self.id = _V22_V23_FRAME_ID_MAPPINGS[self.id[:3]]
-                # TODO: Warning?
-            else:
-                raise Exception("Unknown ID3v2.%d Frame ID '%s'" % (self.version, self.id))
-        # Assert frame size is valid
-        # TODO: Handle this properly
-        if self.body_size == 0:
-            #raise Exception("Invalid ID3v2.%d Frame Size '0'" % (self.version))
-            print "WARNING: Empty frame found. Technically illegal"
-        # TODO: Handle unsupported flags
-        # Ensure flags are valid
-        if unknown_flags != 0:
-            raise Exception("Unknown ID3v2.%d Flags '0x%04X' (should be 0)" % \
-                (self.version, unknown_flags))
-
-    def __str__(self):
-        """Override string printing method"""
-        set_flags = [flag for flag in self.flags if self.flags[flag]]
-        return "%s Size=%d %s" % (self.id, self.body_size, ','.join(set_flags))
-
-    def read_body(self, file_handle):
-        """Reads this frame's body content from the file
-
-        Args:
-            file_handle: file handle to read the data from. Must be opened at
-                least as 'rb'.
-
-        Returns:
-            character byte array of data from the frame's body
-        """
-        file_handle.seek(self.body_offset, 0)
-        return file_handle.read(self.body_size)
-
-
 class _Tag(object):
     """ID3v2 tag
 
     Attributes:
         header: _TagHeader ID3v2 tag header
         extended_header: _TagExtendedHeader ID3v2 tag extended header, or None
-        frames: list of _FrameHeader ID3v2 tag frame headers
+        frames: list of a (frame_id, flags, body_offset, body_size) tuple for
+            each frame in the tag, in tag order, locating the frame's body in
+            data. Frame ids may be repeated (e.g. multiple COMM frames).
+        data: character array of bytes the tag was read from. For unsynchronised
+            ID3v2.2 and ID3v2.3 tags this has been de-unsynchronised.
+        padding_size: int number of bytes between the end of the last frame and
+            the end of the tag
     """
-    def __init__(self, file_handle):
-        """Reads an ID3v2 tag from a file. File must contain a tag.
+    def __init__(self, tag_data):
+        """Parses an ID3v2 tag from the bytes at the start of a file. The bytes
+        must contain a tag.
 
         Args:
-            file_handle: file handle open in at least 'rb' mode to read tag from
+            tag_data: character array of bytes read from the start of the file.
+                Should cover the entire tag (see read_tag_bytes), frames beyond
+                its end are ignored.
         """
-        file_handle.seek(0, 0)
         # Read header
-        header_data = file_handle.read(10)
-        self.header = _TagHeader(header_data)
-        total_size = self.header.header_size + self.header.body_size
+        self.header = _TagHeader(tag_data[:TAG_HEADER_SIZE])
+        total_size = min(self.header.header_size + self.header.body_size,
+                         len(tag_data))
+        offset = self.header.header_size
+        # Before ID3v2.4 unsynchronisation applies to everything after the
+        # header (with frame sizes describing the original data) so undo it up
+        # front. In ID3v2.4 it applies to frame bodies individually, so is
+        # undone as each is read. Either way it costs nothing unless flagged.
+        self.__unsynchronised_frames = False
+        if self.header.flags['unsynchronisation']:
+            if self.header.version < 4:
+                tag_data = tag_data[:offset] + _deunsynchronise(tag_data[offset:total_size])
+                total_size = len(tag_data)
+            else:
+                self.__unsynchronised_frames = True
+        self.data = tag_data
         # Read extended header (if applicable)
         if self.header.has_extended_header():
-            xheader_data = file_handle.read(self.header.extended_header_size)
-            self.extended_header = _TagExtendedHeader(self.header.version, xheader_data)
-            file_handle.seek(self.extended_header.body_size, 1)
+            xheader_end = offset + self.header.extended_header_size
+            self.extended_header = _TagExtendedHeader(self.header.version,
+                                                      tag_data[offset:xheader_end])
+            offset = xheader_end + self.extended_header.body_size
         else:
             self.extended_header = None
-        # Read frames
-        self.frames = {}
-        while file_handle.tell() < total_size:
-            fheader_data = file_handle.read(self.header.frame_header_size)
-            if fheader_data[0] == '\0':
-                # If we have read a null byte we have reached the end of the
-                # tag. It turns out the majority of ID3 tags are heavily padded
-                # and are actually significantly longer than necessary so
-                # editors can modify without having to rewrite the entire MP3
-                # file. This is poorly documented.
-                # The ID3 tags I have tested are typically between 500 and 1000
-                # bytes while actual allocation is around 4200 bytes per tag.
-                break
-            frame = _FrameHeader(self.header.version, fheader_data, file_handle.tell())
-            self.__add_frame(frame)
-            file_handle.seek(frame.body_size, 1)
+        # Read frames, indexing the last of any repeated frames for lookup.
+        self.frames = list(_iter_frames(tag_data, self.header.version, offset,
+                                        total_size))
+        self.__frame_index = dict((frame[0], frame) for frame in self.frames)
+        if self.frames:
+            frames_end = self.frames[-1][2] + self.frames[-1][3]
+        else:
+            frames_end = offset
+        self.padding_size = max(total_size - frames_end, 0)
 
     def __str__(self):
         """Override string printing method"""
-        frames_str = '\n  '.join([str(frame) for frame in self.frames])
+        frame_strs = []
+        for frame_id, flags, _, body_size in self.frames:
+            frame_flags = _frame_flags(self.header.version, flags)
+            set_flags = [flag for flag in frame_flags if frame_flags[flag]]
+            frame_strs.append("%s Size=%d %s" % (frame_id, body_size, ','.join(set_flags)))
+        frames_str = '\n  '.join(frame_strs)
         if self.extended_header:
             return "%s\n  %s\n  %s" % (str(self.header), str(self.extended_header), \
                                        frames_str)
         else:
             return "%s\n  %s" % (self.header, frames_str)
 
-    def __add_frame(self, frame):
-        """Adds the frame header to this tag
+    def read_frame_body(self, frame_id):
+        """Retrieves the content of the frame with the given ID
+
+        This is the only point at which a frame's body is copied out of the tag
+        and decoded (e.g. decompressed), so frames which are never asked for
+        (such as large APIC or PRIV frames) are never decoded.
 
         Args:
-            frame: _FrameHeader frame header to add
+            frame_id: ID of the frame to retrieve
 
         Returns:
-            None
+            character array of bytes of the frame's content, or None if this tag
+            doesn't contain the frame or it is encrypted
         """
-        self.frames[frame.id] = frame
+        try:
+            _, flags, body_offset, body_size = self.__frame_index[frame_id]
+        except KeyError:
+            return None
+        return _decode_frame_body(self.header.version, frame_id, flags,
+                                  self.data[body_offset:body_offset + body_size],
+                                  self.__unsynchronised_frames)
+
+    def copy_frames(self, excluded_frame_ids=()):
+        """Copies the frames of this tag as ID3v2.3 frames
+
+        ID3v2.3 frames (including any repeated frames) are copied byte for
+        byte, so compressed frames are never decoded. Frames from other
+        versions have their headers converted, and their bodies only where the
+        formats differ. ID3v2.4 recording and original release times are
+        converted to ID3v2.3 years, and sort orders to the experimental frames
+        ID3v2.3 players use for them. Frames which cannot be represented in
+        ID3v2.3 (those with no ID3v2.3 equivalent, or encrypted ID3v2.4
+        frames) are dropped.
 
-    def __get_frame(self, frame_id):
-        """Retrieves the frame header with the given ID
+        Args:
+            excluded_frame_ids: Optional iterable of ID3v2.3 frame IDs of
+                frames not to copy.
+
+        Returns:
+            A list of (frame_id, frame_string) tuples of the ID3v2.3 frame ID
+            and bytes of each copied frame, in tag order.
+        """
+        version = self.header.version
+        copied_frames = []
+        for frame_id, flags, body_offset, body_size in self.frames:
+            body_data = self.data[body_offset:body_offset + body_size]
+            if version == 2:
+                if frame_id in _V22_UNCONVERTIBLE_FRAME_IDS:
+                    continue
+                frame_id = _V22_V23_FRAME_ID_MAPPINGS.get(frame_id)
+                if frame_id == "APIC":
+                    body_data = _convert_v22_picture(body_data)
+            elif version == 4:
+                v23_frame_id = _V24_V23_FRAME_ID_MAPPINGS.get(frame_id, frame_id)
+                if v23_frame_id not in _FRAME_FORMATS[3].valid_ids and \
+                   v23_frame_id[0] not in _EXPERIMENTAL_FRAME_ID_PREFIXS:
+                    continue
+                if flags & _V24_ENCODED_FLAGS or self.__unsynchronised_frames:
+                    body_data = _decode_frame_body(version, frame_id, flags, body_data,
+                                                   self.__unsynchronised_frames)
+                    if body_data is None:
+                        continue
+                flags = _convert_v24_flags(flags)
+                if frame_id in _V24_TIMESTAMP_FRAME_IDS:
+                    body_data = _convert_v24_timestamp(body_data)
+                elif frame_id[0] == "T" and body_data[:1] == "\x03":
+                    body_data = _convert_utf8_text(body_data)
+                frame_id = v23_frame_id
+            if frame_id is None or frame_id in excluded_frame_ids:
+                continue
+            copied_frames.append((frame_id, frame_id + _UINT32.pack(len(body_data)) \
+                                  + _UINT16.pack(flags) + body_data))
+        return copied_frames
+
+    def __read_text_frame(self, v22_frame_id, frame_id):
+        """Retrieves the text of the frame with the given ID
 
         Args:
-            frame_id: ID of the frame header to retrieve
+            v22_frame_id: ID of the frame in ID3v2.2 tags
+            frame_id: ID of the frame in ID3v2.3 and ID3v2.4 tags
 
         Returns:
-            _FrameHeader frame header
+            string text of the frame or None if this tag doesn't contain it
         """
-        try:
-            return self.frames[frame_id]
-        except KeyError:
+        if self.header.version == 2:
+            body_data = self.read_frame_body(v22_frame_id)
+        else:
+            body_data = self.read_frame_body(frame_id)
+        if body_data is None:
             return None
+        return _read_frame_text(body_data)
 
-    def get_artist(self, file_handle):
+    def get_artist(self):
         """Retrieves the track artist data from this tag
 
-        Args:
-            file_handle: open file handle to read the frame body from
-
         Returns:
             string track artist or None if this tag doesn't contain it
         """
-        version = self.header.version
-        if version == 2:
-            frame_id = "TP1"
-        elif version == 3 or version == 4:
-            frame_id = "TPE1"
-        else:
-            return None
-        frame = self.__get_frame(frame_id)
-        if frame:
-            return _read_frame_text(frame.read_body(file_handle))
-        return None
+        return self.__read_text_frame("TP1", "TPE1")
 
-    def get_album(self, file_handle):
+    def get_album(self):
         """Retrieves the track album data from this tag
 
-        Args:
-            file_handle: open file handle to read the frame body from
-
         Returns:
             string track album or None if this tag doesn't contain it
         """
-        version = self.header.version
-        if version == 2:
-            frame_id = "TAL"
-        elif version == 3 or version == 4:
-            frame_id = "TALB"
-        else:
-            return None
-        frame = self.__get_frame(frame_id)
-        if frame:
-            return _read_frame_text(frame.read_body(file_handle))
-        return None
+        return self.__read_text_frame("TAL", "TALB")
 
-    def get_title(self, file_handle):
+    def get_title(self):
         """Retrieves the track title data from this tag
 
-        Args:
-            file_handle: open file handle to read the frame body from
-
         Returns:
             string track title or None if this tag doesn't contain it
         """
-        version = self.header.version
-        if version == 2:
-            frame_id = "TT2"
-        elif version == 3 or version == 4:
-            frame_id = "TIT2"
-        else:
-            return None
-        frame = self.__get_frame(frame_id)
-        if frame:
-            return _read_frame_text(frame.read_body(file_handle))
-        return None
+        return self.__read_text_frame("TT2", "TIT2")
 
-    def get_track(self, file_handle):
+    def get_track(self):
         """Retrieves the track number from this tag
 
-        Args:
-            file_handle: open file handle to read the frame body from
-
         Returns:
             int track number or None if this tag doesn't contain it
         """
-        version = self.header.version
-        if version == 2:
-            frame_id = "TRK"
-        elif version == 3 or version == 4:
-            frame_id = "TRCK"
-        else:
-            return None
-        frame = self.__get_frame(frame_id)
-        if frame:
-            body_data = _read_frame_text(frame.read_body(file_handle))
+        body_data = self.__read_text_frame("TRK", "TRCK")
+        if body_data is not None:
             return TrackData.mint(body_data.split('/')[0])
         return None
 
-    def get_year(self, file_handle):
+    def get_year(self):
         """Retrieves the track year from this tag
 
-        Args:
-            file_handle: open file handle to read the frame body from
+        In ID3v2.4 tags this is read from the recording time, falling back to a
+        (non-standard) year frame.
 
         Returns:
             int track year or None if this tag doesn't contain it
         """
-        version = self.header.version
-        if version == 2:
-            frame_id = "TYE"
-        elif version == 3 or version == 4:
-            frame_id = "TYER"
-        else:
-            return None
-        frame = self.__get_frame(frame_id)
-        if frame:
-            body_data = _read_frame_text(frame.read_body(file_handle))
+        body_data = None
+        if self.header.version == 4:
+            body_data = self.__read_text_frame(None, "TDRC")
+        if body_data is None:
+            body_data = self.__read_text_frame("TYE", "TYER")
+        if body_data is not None:
             return TrackData.mint(body_data[0:4])
         return None
 
-    def get_data(self, file_handle):
+    def get_data(self):
         """Extracts TrackData from this tag
 
-        Args:
-            file_handle: open file handle to read the relevant frames from
-
         Returns:
             TrackData with this tag's raw data
         """
         data = TrackData.TrackData()
-        data.artist = self.get_artist(file_handle)
-        data.album = self.get_album(file_handle)
-        data.title = self.get_title(file_handle)
-        data.track = self.get_track(file_handle)
-        data.year = self.get_year(file_handle)
+        data.artist = self.get_artist()
+        data.album = self.get_album()
+        data.title = self.get_title()
+        data.track = self.get_track()
+        data.year = self.get_year()
         return data
 
 
@@ -558,19 +767,119 @@ def _read_frame_text(body_data):
         body_data: character array of bytes read from the frame body
 
     Returns:
-        python string, decoded according to its character encoding
+        python string, decoded according to its character encoding and held
+        as UTF-8 (as file paths usually are)
     """
     encoding = ord(body_data[0])
-    # TODO: Deal with unicode properly (not using encode('ascii', 'replace'))
     if encoding == 0:   # ISO-8859-1
-        return body_data[1:].decode('iso-8859-1').encode('ascii', 'replace')
+        text = body_data[1:].decode('iso-8859-1')
     elif encoding == 1: # UTF-16
-        return body_data[1:].decode('utf_16').encode('ascii', 'replace')
+        text = body_data[1:].decode('utf_16')
     elif encoding == 2: # UTF-16BE
-        return body_data[1:].decode('utf_16_be').encode('ascii', 'replace')
+        text = body_data[1:].decode('utf_16_be')
     elif encoding == 3: # UTF-8
-        return body_data[1:].decode('utf_8').encode('ascii', 'replace')
-    return body_data
+        text = body_data[1:].decode('utf_8')
+    else:
+        return body_data
+    # The text may be null terminated (as create_tag_frames writes it), or in
+    # ID3v2.4 hold several null separated strings, of which only the first is
+    # used.
+    return text.split(u'\0', 1)[0].encode('utf_8')
+
+
+def _create_frame_text(text):
+    """Encodes a python string as the body of an ID3v2.3 text frame
+
+    Text which is entirely ASCII is written as ISO-8859-1, and anything else as
+    UTF-16 (with a byte order mark) so it reads back as it was.
+
+    Args:
+        text: python string, held as UTF-8 (as decoded from ID3v2 tags and
+            file paths) or, where it is not valid UTF-8, as ISO-8859-1 (as
+            read from ID3v1 tags).
+
+    Returns:
+        character array of bytes of the frame's body, null terminated
+    """
+    try:
+        unicode_text = text.decode('utf_8')
+    except UnicodeDecodeError:
+        unicode_text = text.decode('iso-8859-1')
+    try:
+        return '\x00' + unicode_text.encode('ascii') + '\x00'
+    except UnicodeEncodeError:
+        return '\x01' + unicode_text.encode('utf_16') + '\x00\x00'
+
+
+def read_tag_size(header_data):
+    """Calculates the size of an ID3v2.x tag from its header
+
+    Args:
+        header_data: character array of bytes read from the start of the file.
+            Must be at least TAG_HEADER_SIZE bytes long (unless the file is
+            shorter than that).
+
+    Returns:
+        int number of bytes in the tag (including its footer, if it has one),
+        or 0 if the file does not have one
+    """
+    if header_data[:3] == "ID3":
+        tag = _TagHeader(header_data[:TAG_HEADER_SIZE])
+        if tag.flags.get('footer_present'):
+            return tag.header_size + tag.body_size + FOOTER_SIZE
+        return tag.header_size + tag.body_size
+    return 0
+
+
+def read_footer_tag_size(footer_data):
+    """Calculates the size of an ID3v2.4 tag from its footer
+
+    Args:
+        footer_data: character array of the FOOTER_SIZE bytes which may be the
+            footer of a tag.
+
+    Returns:
+        int number of bytes in the tag (including its header and footer) ending
+        with the footer, or 0 if the bytes are not a footer
+    """
+    if footer_data[:3] != "3DI":
+        return 0
+    # The footer is a copy of the header with a different identifier.
+    tag = _TagHeader("ID3" + footer_data[3:FOOTER_SIZE])
+    return tag.header_size + tag.body_size + FOOTER_SIZE
+
+
+def read_padding_size(tag_data):
+    """Calculates the amount of padding after the frames of an ID3v2.x tag
+
+    Args:
+        tag_data: character array of bytes covering the entire tag.
+
+    Returns:
+        int number of bytes of padding in the tag, or 0 if there is no tag
+    """
+    if tag_data[:3] != "ID3":
+        return 0
+    return _Tag(tag_data).padding_size
+
+
+def read_seek_offset(tag_data):
+    """Reads the offset to the next tag from the SEEK frame of an ID3v2.4 tag
+
+    Args:
+        tag_data: character array of bytes covering the entire tag.
+
+    Returns:
+        int number of bytes from the end of the tag to the start of the next
+        one, or None if the tag doesn't have a SEEK frame
+    """
+    # Avoid parsing tags which cannot contain a SEEK frame.
+    if tag_data[:4] != "ID3\x04" or "SEEK" not in tag_data:
+        return None
+    body_data = _Tag(tag_data).read_frame_body("SEEK")
+    if body_data is None or len(body_data) < 4:
+        return None
+    return _UINT32.unpack_from(body_data)[0]
 
 
 def calculate_tag_size(file_handle):
@@ -585,19 +894,84 @@ def calculate_tag_size(file_handle):
     # Read the standard and extended tag headers
     cursor_pos = file_handle.tell()
     file_handle.seek(0, 0)
-    tag_header = file_handle.read(10)
+    tag_header = file_handle.read(TAG_HEADER_SIZE)
     file_handle.seek(cursor_pos, 0)
     # Calculate tag size
-    if tag_header[:3] == "ID3":
-        tag = _TagHeader(tag_header)
-        return tag.header_size + tag.body_size
-    return 0
+    return read_tag_size(tag_header)
+
+
+def read_tag_bytes(file_handle):
+    """Reads the bytes of the ID3v2 tag at the start of a file.
+
+    The first SPECULATIVE_READ_SIZE bytes are read in one call, which covers
+    most tags entirely. Only if the tag is larger than that is the remainder
+    read, in one further call.
+
+    Args:
+        file_handle: a file handle opened in a readable binary mode. Must be
+            positioned at the start of the file.
+
+    Returns:
+        character array of bytes from the start of the file. Covers the entire
+        tag if the file has one, otherwise is only the first bytes of the file.
+    """
+    head_data = file_handle.read(SPECULATIVE_READ_SIZE)
+    try:
+        tag_size = read_tag_size(head_data)
+    except Exception: # pylint: disable=broad-except
+        # Leave reporting the broken header to the parser.
+        tag_size = 0
+    if tag_size > len(head_data) and len(head_data) == SPECULATIVE_READ_SIZE:
+        head_data += file_handle.read(tag_size - len(head_data))
+    return head_data
+
+
+def parse_tag_data(head_data, appended_data=(), clean=True):
+    """Parses the ID3v2 tag data from a file (if present).
+
+    ID3 v2.2.x, 2.3.x and 2.4.x tags are all supported. Tags found later in the
+    file (by following a SEEK frame or from a footer) update the tag at the
+    start of the file, so their fields take precedence.
+
+    Args:
+        head_data: character array of bytes read from the start of the file.
+            Must cover the entire tag, if the file has one.
+        appended_data: Optional list of character arrays of bytes of each
+            further tag in the file, in file order, as read by
+            TagReader.read_appended_tags.
+        clean: Optional boolean, whether to clean the strings read. Defaults
+            to True.
+
+    Returns:
+        A TrackData with the fields initialised to the data read from the tags.
+        Non-present fields will be initialised to None. If no valid tag exists
+        None will be returned.
+    """
+    tags_data = list(appended_data)
+    if head_data[:3] == "ID3":
+        tags_data.insert(0, head_data)
+    # If we don't have a tag, drop out
+    if not tags_data:
+        return None
+    # Parse the tags
+    data = _Tag(tags_data[0]).get_data()
+    for tag_data in tags_data[1:]:
+        update = _Tag(tag_data).get_data()
+        for attr in ['title', 'album', 'artist', 'track', 'year']:
+            if update.__getattribute__(attr) is not None:
+                data.__setattr__(attr, update.__getattribute__(attr))
+    # clean the strings generated
+    if clean:
+        data.clean(False)
+    return data
 
 
 def read_tag_data(file_path):
     """Reads the ID3v2 tag data from a file (if present).
 
-    ID3 v2.2.x, 2.3.x and 2.4.x tags are all supported.
+    ID3 v2.2.x, 2.3.x and 2.4.x tags are all supported. Only the tag at the
+    start of the file is read (TagReader.read_tag_regions also finds tags
+    appended to the file).
 
     Args:
         file_path: String path to the file to read the tag from.
@@ -608,33 +982,52 @@ def read_tag_data(file_path):
         None will be returned.
     """
     with open(file_path, "rb", 0) as f:
-        has_tag = f.read(3) == "ID3"
-        # If we don't have a tag, drop out
-        if not has_tag:
-            return None
-        # Parse the tag
-        tag = _Tag(f)
-        data = tag.get_data(f)
-        # clean the strings generated
-        data.clean(False)
-        return data
-    return None
+        head_data = read_tag_bytes(f)
+    return parse_tag_data(head_data)
 
 
-def create_tag_string(data, file_path):
-    """Converts the given TrackData into a ID3v2.3.0 tag.
+def create_tag_header(body_size):
+    """Creates the header of an ID3v2.3.0 tag.
+
+    Args:
+        body_size: int number of bytes in the tag after the header, including
+            any padding.
+
+    Returns:
+        A string of the TAG_HEADER_SIZE bytes of the header.
+    """
+    # produce the size string
+    size_b1 = (body_size >> 21) % 128
+    size_b2 = (body_size >> 14) % 128
+    size_b3 = (body_size >>  7) % 128
+    size_b4 = body_size         % 128
+    size_string = chr(size_b1) + chr(size_b2) + chr(size_b3) + chr(size_b4)
+    # write the header
+    new_header = "ID3"                 # tag identifier
+    new_header += chr(3) + chr(0)      # tag version number (v2.3.0)
+    new_header += chr(0)               # flags
+    new_header += size_string
+    return new_header
+
+
+def create_tag_frames(data, head_data, appended_data=()):
+    """Converts the given TrackData into the frames of an ID3v2.3.0 tag.
 
     Args:
         data: A TrackData object whose data will be put into the tag.
-        file_path: A string file path to the MP3 file this TrackData is
-            originally from. This is required as we read all other ID3v2 frames
-            from it so we may preserve them. This is a bit of a hack.
+        head_data: character array of bytes read from the start of the MP3
+            file this TrackData is originally from, covering its entire ID3v2
+            tag (see read_tag_bytes). All other frames are copied from it so
+            we may preserve them.
+        appended_data: Optional list of character arrays of bytes of each
+            further tag in the file, as given to parse_tag_data. Their frames
+            are copied too, taking precedence over frames with the same ID in
+            the tags before them, so the new tag can replace them all.
 
     Returns:
-        A string of the correct byte length representing the ID3v2.3.0 tag.
+        A string of the bytes of all frames of the tag, without its header or
+        any padding.
     """
-    # FIXME: No need to take file_path and read file again. Should tag all
-    # frames to the TrackData originally returned.
     def create_id3v2_frame_string(frame_id, frame_content):
         """Constructs an id3v2 text content frame.
 
@@ -645,7 +1038,8 @@ def create_tag_string(data, file_path):
         Returns:
             A string representing this text frame
         """
-        size = len(frame_content) + 2   # encoding mark + content + null byte
+        body = _create_frame_text(frame_content)
+        size = len(body)    # encoding mark + content + null terminator
         size_b1 = (size >> 24) % 256
         size_b2 = (size >> 16) % 256
         size_b3 = (size >>  8) % 256
@@ -655,25 +1049,9 @@ def create_tag_string(data, file_path):
         frame = frame_id
         frame += size_string
         frame += flag_string
-        frame += '\00'      # encoding mark (ISO-8859-1)
-        frame += frame_content
-        frame += '\00'
+        frame += body
         return frame
 
-    # read the entire input file in.
-    with open(file_path, "rb") as f:
-        track_data = f.read()
-
-    # check what existing id3v2 tag we have (if any). if we have one, separate
-    # the track from it.
-    had_id3v2_tag = False
-    if track_data[:3] == "ID3":
-        had_id3v2_tag = True
-        # Parse the tag header.
-        tag = _TagHeader(track_data)
-        total_tag_size = tag.header_size + tag.body_size
-        tag_data = track_data[:total_tag_size]
-
     # create a new tag and add our data to it
     # write the frames to it (we do this before we write the header so we can
     # calculate the size)
@@ -690,46 +1068,42 @@ def create_tag_string(data, file_path):
     # their own data in them and in some cases the frames will store user data
     # which will have taken some time to generate/collect, e.g. the POPM tag
     # (though this is far from a standard itself).
-    if had_id3v2_tag:
-        # TODO: This is going to screw up with id3v2.2 tags
-        total_read_size = 10
-        while total_read_size < total_tag_size:
-            if tag_data[total_read_size] == '\00':
-                break
-            frame_data = tag_data[total_read_size:total_read_size+10]
-            frame_id = frame_data[0:4]
-            total_frame_size = _read_32bit_syncsafe(frame_data[4:8]) + 10
-            # TODO: This if statement could be extended to include other frames
-            # to be left out, or even replaced with just PRIV frames (UFID and
-            # POPM should probably also be kept as they contain information
-            # which will have been generated by other media players and is not
-            # easily reproducible). For now I have chosen to err on the side of
-            # caution and leave all other frames intact, but for a completely
-            # clean and identically tagged music collection this is an option.
-            if frame_id != "TALB" and \
-               frame_id != "TIT2" and \
-               frame_id != "TPE1" and \
-               frame_id != "TRCK" and \
-               frame_id != "TYER":
-                new_frames += tag_data[total_read_size:total_read_size+total_frame_size]
-            total_read_size += total_frame_size
+    # TODO: The excluded frames could be extended to include other frames to
+    # be left out, or even replaced with just PRIV frames (UFID and POPM should
+    # probably also be kept as they contain information which will have been
+    # generated by other media players and is not easily reproducible). For now
+    # I have chosen to err on the side of caution and leave all other frames
+    # intact, but for a completely clean and identically tagged music
+    # collection this is an option.
+    tags_data = list(appended_data)
+    if head_data[:3] == "ID3":
+        tags_data.insert(0, head_data)
+    copied_frames = []
+    for tag_data in reversed(tags_data):
+        later_frame_ids = set(frame_id for frame_id, _ in copied_frames)
+        copied_frames = [frame for frame in _Tag(tag_data).copy_frames(_REPLACED_FRAME_IDS) \
+                         if frame[0] not in later_frame_ids] + copied_frames
+    return new_frames + ''.join(frame_string for _, frame_string in copied_frames)
+
+
+def create_tag_string(data, head_data, padding_size=500, appended_data=()):
+    """Converts the given TrackData into a ID3v2.3.0 tag.
+
+    Args:
+        data: A TrackData object whose data will be put into the tag.
+        head_data: character array of bytes read from the start of the MP3
+            file this TrackData is originally from. See create_tag_frames.
+        padding_size: Optional int number of bytes of padding to add after the
+            frames.
+        appended_data: Optional list of character arrays of bytes of each
+            further tag in the file. See create_tag_frames.
+
+    Returns:
+        A string of the correct byte length representing the ID3v2.3.0 tag.
+    """
     # calculate the size and add padding (I don't really like this approach, but
     # I guess there's a reason all the tracks I tested include large amounts of
     # padding so I will re-pad). Doing it at this stage leaves the option to
-    # have the amount of padding added dependent on the tag size. For now simply
-    # add 500 bytes of padding.
-    new_frames += '\00' * 500
-    size = len(new_frames)
-    # produce the size string
-    size_b1 = (size >> 21) % 128
-    size_b2 = (size >> 14) % 128
-    size_b3 = (size >>  7) % 128
-    size_b4 = size         % 128
-    size_string = chr(size_b1) + chr(size_b2) + chr(size_b3) + chr(size_b4)
-    # write the header
-    new_header = "ID3"                 # tag identifier
-    new_header += chr(3) + chr(0)      # tag version number (v2.3.0)
-    new_header += chr(0)               # flags
-    new_header += size_string
-
-    return new_header + new_frames
+    # have the amount of padding added dependent on the tag size.
+    new_frames = create_tag_frames(data, head_data, appended_data) + '\00' * padding_size
+    return create_tag_header(len(new_frames)) + new_frames
@@ -0,0 +1,576 @@
+"""Imports:
+    threading: indexing several tracks concurrently
+    multiprocessing: indexing several directories in parallel processes
+    Queue: passing tracks between the indexer and its worker threads
+    TagReader: reading the tag regions of files
+    TagBatch: reading and decoding the tags of batches of files
+    TrackFile: rebuilding tracks indexed by worker processes
+"""
+import threading
+import multiprocessing
+import Queue
+import TagReader
+import TagBatch
+import TrackFile
+
+
+def index_track(track, manifest=None):
+    """Loads and finalises all data about a track
+
+    Args:
+        track: TrackFile to index.
+        manifest: Optional Manifest to restore the track's data from if the
+            file is unchanged, and to record it in if not.
+
+    Returns:
+        None
+    """
+    if manifest is None:
+        track.load_all_data()
+    elif not manifest.load(track):
+        track.load_all_data()
+        manifest.store(track)
+    track.finalise_data()
+
+
+class Indexer(object):
+    """Indexes the tracks in each directory one track at a time.
+
+    Attributes:
+        track_factory: function taking a string directory path and a list of
+            the names of the files in it, and returning a list of unindexed
+            TrackFiles for the tracks amongst them.
+        manifest: Manifest to index tracks through, or None.
+    """
+    def __init__(self, track_factory, manifest=None):
+        """Creates the Indexer object.
+
+        Args:
+            track_factory: function creating the TrackFiles in a directory, as
+                described by the track_factory attribute.
+            manifest: Optional Manifest to index tracks through.
+
+        Returns:
+            The initialised Indexer object.
+        """
+        self.track_factory = track_factory
+        self.manifest = manifest
+
+
+    def index(self, listings, warnings):
+        """Creates, indexes and finalises the tracks in each directory.
+
+        Args:
+            listings: iterable of (dirname, filenames) tuples for each directory
+                to index, as yielded by a Crawler.
+            warnings: list to append string warnings to.
+
+        Yields:
+            A list of indexed and finalised TrackFiles for each directory
+            containing tracks, in the order the directories were given.
+        """
+        for dirname, filenames in listings:
+            track_files = self.track_factory(dirname, filenames)
+            for track in track_files:
+                index_track(track, self.manifest)
+            if track_files:
+                yield track_files
+
+
+class ThreadedIndexer(Indexer):
+    """Indexes batches of tracks across a pool of threads.
+
+    Reading tags is dominated by waiting on storage (which releases the GIL), so
+    on high-latency storage many files can usefully be read at once. All
+    access to the manifest, and to the batches once yielded, stays on the
+    calling thread.
+
+    Attributes:
+        track_factory: function creating the TrackFiles in a directory, as
+            described by Indexer.
+        manifest: Manifest to index tracks through, or None.
+        thread_count: int number of threads to index tracks with.
+        max_tracks_in_flight: int maximum number of tracks which may have been
+            handed to the threads but not yet finished.
+        max_batches_in_flight: int maximum number of directories which may have
+            been taken from the input but not yet yielded.
+    """
+    def __init__(self, track_factory, manifest=None, thread_count=1,
+                 max_tracks_in_flight=None):
+        """Creates the ThreadedIndexer object.
+
+        Args:
+            track_factory: function creating the TrackFiles in a directory, as
+                described by Indexer.
+            manifest: Optional Manifest to index tracks through.
+            thread_count: Optional int number of threads to index tracks with.
+            max_tracks_in_flight: Optional int maximum number of tracks handed
+                to the threads at once. Defaults to four per thread.
+
+        Returns:
+            The initialised ThreadedIndexer object.
+        """
+        super(ThreadedIndexer, self).__init__(track_factory, manifest)
+        if thread_count < 1:
+            raise Exception("Cannot create a %s with %d threads." \
+                            % (self.__class__.__name__, thread_count))
+        self.thread_count = thread_count
+        self.max_tracks_in_flight = max_tracks_in_flight or 4 * thread_count
+        self.max_batches_in_flight = max(4 * thread_count, self.max_tracks_in_flight)
+
+
+    def _process(self, track):
+        """Does the work of indexing a track. Runs on a pool thread.
+
+        Args:
+            track: TrackFile to index.
+
+        Returns:
+            A result to pass to _complete.
+        """
+        track.load_all_data()
+        track.finalise_data()
+        return None
+
+
+    def _complete(self, track, result):
+        """Finishes indexing a track. Runs on the calling thread.
+
+        Args:
+            track: TrackFile passed to _process.
+            result: value returned by _process.
+
+        Returns:
+            None
+        """
+        # pylint: disable=unused-argument
+        if self.manifest is not None:
+            self.manifest.store(track)
+
+
+    def index(self, listings, warnings):
+        """Creates, indexes and finalises the tracks in each directory.
+
+        Tracks which fail to index are dropped with a warning rather than
+        stopping the rest of the indexing.
+
+        Args:
+            listings: iterable of (dirname, filenames) tuples for each directory
+                to index, as yielded by a Crawler.
+            warnings: list to append string warnings to.
+
+        Yields:
+            A list of the successfully indexed and finalised TrackFiles for each
+            directory containing tracks, in the order the directories were
+            given.
+        """
+        pending = Queue.Queue()
+        results = Queue.Queue()
+
+        def worker():
+            """Processes tracks from the pending queue until told to stop"""
+            while True:
+                job = pending.get()
+                if job is None:
+                    return
+                batch_number, track = job
+                try:
+                    results.put((batch_number, track, self._process(track), None))
+                except Exception as e: # pylint: disable=broad-except
+                    results.put((batch_number, track, None, e))
+
+        threads = [threading.Thread(target=worker) for _ in range(self.thread_count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # Maps the number of each batch in flight to a list of its tracks and
+        # the number of them still being processed.
+        in_flight = {}
+        next_batch_number = [0]
+        tracks_in_flight = [0]
+
+        def drop_track(batch_number, track, error):
+            """Removes a track which failed to index from its batch"""
+            in_flight[batch_number][0].remove(track)
+            warnings.append('Failed to index %s: %s' % (track.file_path, error))
+
+        def collect_result():
+            """Waits for a single track to finish processing and records it"""
+            batch_number, track, result, error = results.get()
+            in_flight[batch_number][1] -= 1
+            tracks_in_flight[0] -= 1
+            if error is None:
+                try:
+                    self._complete(track, result)
+                except Exception as e: # pylint: disable=broad-except
+                    error = e
+            if error is not None:
+                drop_track(batch_number, track, error)
+
+        def completed_batches():
+            """Removes and returns finished batches which are next in order"""
+            batches = []
+            while next_batch_number[0] in in_flight and \
+                  in_flight[next_batch_number[0]][1] == 0:
+                track_files = in_flight.pop(next_batch_number[0])[0]
+                if track_files:
+                    batches.append(track_files)
+                next_batch_number[0] += 1
+            return batches
+
+        try:
+            for batch_number, (dirname, filenames) in enumerate(listings):
+                track_files = self.track_factory(dirname, filenames)
+                in_flight[batch_number] = [track_files, 0]
+                for track in list(track_files):
+                    if self.manifest is not None and self.manifest.load(track):
+                        try:
+                            track.finalise_data()
+                        except Exception as e: # pylint: disable=broad-except
+                            drop_track(batch_number, track, e)
+                        continue
+                    while tracks_in_flight[0] >= self.max_tracks_in_flight:
+                        collect_result()
+                    in_flight[batch_number][1] += 1
+                    tracks_in_flight[0] += 1
+                    pending.put((batch_number, track))
+                # Yield whatever has finished, only waiting on the pool once too
+                # many batches are in flight.
+                for completed_track_files in completed_batches():
+                    yield completed_track_files
+                while len(in_flight) >= self.max_batches_in_flight:
+                    collect_result()
+                    for completed_track_files in completed_batches():
+                        yield completed_track_files
+            while in_flight:
+                collect_result()
+                for completed_track_files in completed_batches():
+                    yield completed_track_files
+        finally:
+            # Abandon any queued work, then wait for the threads to stop.
+            try:
+                while True:
+                    pending.get_nowait()
+            except Queue.Empty:
+                pass
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+
+
+class AsyncIndexer(ThreadedIndexer):
+    """Indexes batches of tracks with an asynchronous read engine.
+
+    Only the raw reads of each file's tag regions are offloaded to the pool of
+    I/O threads, which act as the executor of an event loop run on the calling
+    thread. The loop keeps up to max_tracks_in_flight reads outstanding at
+    once, with a thread for each, and parses each file's buffers (with the
+    ID3v1 and ID3v2 parsers) and finalises its data as the reads complete.
+    This keeps the I/O threads doing nothing but waiting on storage, so many
+    reads can be outstanding on high-latency mounts, while all parsing stays
+    on a single thread.
+
+    Attributes:
+        track_factory: function creating the TrackFiles in a directory, as
+            described by Indexer.
+        manifest: Manifest to index tracks through, or None.
+        thread_count: int number of I/O threads to read files with, one per
+            read in flight.
+        max_tracks_in_flight: int maximum number of reads outstanding at once.
+        max_batches_in_flight: int maximum number of directories which may have
+            been taken from the input but not yet yielded.
+    """
+    def __init__(self, track_factory, manifest=None, max_tracks_in_flight=64):
+        """Creates the AsyncIndexer object.
+
+        Args:
+            track_factory: function creating the TrackFiles in a directory, as
+                described by Indexer.
+            manifest: Optional Manifest to index tracks through.
+            max_tracks_in_flight: Optional int maximum number of reads
+                outstanding at once. Defaults to 64.
+
+        Returns:
+            The initialised AsyncIndexer object.
+        """
+        super(AsyncIndexer, self).__init__(track_factory, manifest, max_tracks_in_flight,
+                                           max_tracks_in_flight)
+
+
+    def _process(self, track):
+        """Reads a track's tag regions. Runs on an I/O thread.
+
+        Args:
+            track: TrackFile to read.
+
+        Returns:
+            TagRegions read from the track's file.
+        """
+        return TagReader.read_tag_regions(track.file_path)
+
+
+    def _complete(self, track, result):
+        """Parses a track's tag regions and finalises it. Runs on the loop.
+
+        Args:
+            track: TrackFile passed to _process.
+            result: TagRegions returned by _process.
+
+        Returns:
+            None
+        """
+        track.load_tag_regions(result)
+        track.finalise_data()
+        super(AsyncIndexer, self)._complete(track, result)
+
+
+class BatchIndexer(Indexer):
+    """Indexes the tracks of many directories at once as a single batch.
+
+    Tracks are gathered from successive directories until a batch is full. The
+    tag regions of the whole batch are then read together (planning any
+    further reads of large ID3v2 tags for the batch at once) and their tags
+    decoded together with TagBatch, which vectorises decoding with NumPy when
+    it is available.
+
+    Attributes:
+        track_factory: function creating the TrackFiles in a directory, as
+            described by Indexer.
+        manifest: Manifest to index tracks through, or None.
+        batch_size: int number of tracks to read and decode at once.
+    """
+    def __init__(self, track_factory, manifest=None, batch_size=1024):
+        """Creates the BatchIndexer object.
+
+        Args:
+            track_factory: function creating the TrackFiles in a directory, as
+                described by Indexer.
+            manifest: Optional Manifest to index tracks through.
+            batch_size: Optional int number of tracks to read and decode at
+                once.
+
+        Returns:
+            The initialised BatchIndexer object.
+        """
+        super(BatchIndexer, self).__init__(track_factory, manifest)
+        if batch_size < 1:
+            raise Exception("Cannot create a BatchIndexer with batches of %d tracks." \
+                            % (batch_size))
+        self.batch_size = batch_size
+
+
+    def __index_batch(self, tracks, warnings):
+        """Reads, decodes and finalises a batch of tracks.
+
+        Args:
+            tracks: list of (track_files, track) tuples for each track to index,
+                where track_files is the list of tracks in the track's
+                directory.
+            warnings: list to append string warnings to.
+
+        Returns:
+            None
+        """
+        read_results = TagBatch.read_tag_regions([track.file_path for _, track in tracks])
+        read_tracks = []
+        for (track_files, track), (regions, error) in zip(tracks, read_results):
+            if error is not None:
+                track_files.remove(track)
+                warnings.append('Failed to index %s: %s' % (track.file_path, error))
+            else:
+                read_tracks.append((track_files, track, regions))
+        parse_results = TagBatch.parse_tag_regions([regions for _, _, regions in read_tracks])
+        for (track_files, track, _), (v1, v2, error) in zip(read_tracks, parse_results):
+            if error is None:
+                try:
+                    track.load_tag_data(v1, v2)
+                    track.finalise_data()
+                    if self.manifest is not None:
+                        self.manifest.store(track)
+                except Exception as e: # pylint: disable=broad-except
+                    error = e
+            if error is not None:
+                track_files.remove(track)
+                warnings.append('Failed to index %s: %s' % (track.file_path, error))
+
+
+    def index(self, listings, warnings):
+        """Creates, indexes and finalises the tracks in each directory.
+
+        Tracks which fail to index are dropped with a warning rather than
+        stopping the rest of the indexing.
+
+        Args:
+            listings: iterable of (dirname, filenames) tuples for each directory
+                to index, as yielded by a Crawler.
+            warnings: list to append string warnings to.
+
+        Yields:
+            A list of the successfully indexed and finalised TrackFiles for each
+            directory containing tracks, in the order the directories were
+            given.
+        """
+        # Directories whose tracks have been gathered, and the tracks from them
+        # still to index.
+        pending_directories = []
+        pending_tracks = []
+        for dirname, filenames in listings:
+            track_files = self.track_factory(dirname, filenames)
+            pending_directories.append(track_files)
+            for track in list(track_files):
+                if self.manifest is not None and self.manifest.load(track):
+                    try:
+                        track.finalise_data()
+                    except Exception as e: # pylint: disable=broad-except
+                        track_files.remove(track)
+                        warnings.append('Failed to index %s: %s' % (track.file_path, e))
+                else:
+                    pending_tracks.append((track_files, track))
+            if len(pending_tracks) >= self.batch_size:
+                self.__index_batch(pending_tracks, warnings)
+                pending_tracks = []
+                for completed_track_files in pending_directories:
+                    if completed_track_files:
+                        yield completed_track_files
+                pending_directories = []
+        if pending_tracks:
+            self.__index_batch(pending_tracks, warnings)
+        for completed_track_files in pending_directories:
+            if completed_track_files:
+                yield completed_track_files
+
+
+# The track factory used by each worker process of a ProcessIndexer.
+_worker_track_factory = None
+
+def _init_worker(track_factory):
+    """Initialises a ProcessIndexer worker process
+
+    Args:
+        track_factory: function creating the TrackFiles in a directory, as
+            described by Indexer.
+
+    Returns:
+        None
+    """
+    global _worker_track_factory # pylint: disable=global-statement
+    _worker_track_factory = track_factory
+
+
+def _index_directory(listing):
+    """Creates, indexes and finalises the tracks in a directory
+
+    Runs in a ProcessIndexer worker process. Rather than whole TrackFiles, only
+    the data needed to rebuild each track is returned, to keep what is pickled
+    back to the parent small.
+
+    Args:
+        listing: (dirname, filenames) tuple for the directory to index.
+
+    Returns:
+        A list of (file_path, indexed_data, final, error) tuples for each track
+        in the directory, where indexed_data is as returned by
+        TrackFile.get_indexed_data, final is the finalised TrackData and error
+        is None, or indexed_data and final are None and error is a string
+        describing why the track could not be indexed.
+    """
+    dirname, filenames = listing
+    results = []
+    for track in _worker_track_factory(dirname, filenames):
+        try:
+            track.load_all_data()
+            track.finalise_data()
+            results.append((track.file_path, track.get_indexed_data(), track.final, None))
+        except Exception as e: # pylint: disable=broad-except
+            results.append((track.file_path, None, None, str(e)))
+    return results
+
+
+def _rebuild_track(file_path, indexed_data, final):
+    """Rebuilds a track indexed and finalised by a worker process
+
+    Args:
+        file_path: string path to the track's file.
+        indexed_data: dictionary returned by TrackFile.get_indexed_data in the
+            worker.
+        final: finalised TrackData of the track.
+
+    Returns:
+        The indexed and finalised TrackFile.
+    """
+    track = TrackFile.TrackFile(file_path, indexed_data['cleaned_filename'])
+    track.set_indexed_data(indexed_data)
+    track.final = final
+    track.finalised = True
+    return track
+
+
+class ProcessIndexer(Indexer):
+    """Indexes the tracks in each directory across a pool of processes.
+
+    Once tags are cached, indexing is dominated by string cleaning and
+    comparison, which threads cannot run in parallel. Each directory is instead
+    sent to a worker process which creates (including cleaning the filenames),
+    indexes and finalises its tracks, returning only their indexed and
+    finalised data, from which the TrackFiles are rebuilt.
+
+    Attributes:
+        track_factory: function creating the TrackFiles in a directory, as
+            described by Indexer. Must be picklable (i.e. a module level
+            function).
+        manifest: always None, a ProcessIndexer cannot index through one.
+        process_count: int number of processes to index tracks with.
+    """
+    def __init__(self, track_factory, process_count=1):
+        """Creates the ProcessIndexer object.
+
+        Args:
+            track_factory: function creating the TrackFiles in a directory, as
+                described by the track_factory attribute.
+            process_count: Optional int number of processes to index tracks
+                with.
+
+        Returns:
+            The initialised ProcessIndexer object.
+        """
+        super(ProcessIndexer, self).__init__(track_factory)
+        if process_count < 1:
+            raise Exception("Cannot create a ProcessIndexer with %d processes." \
+                            % (process_count))
+        self.process_count = process_count
+
+
+    def index(self, listings, warnings):
+        """Creates, indexes and finalises the tracks in each directory.
+
+        Tracks which fail to index are dropped with a warning rather than
+        stopping the rest of the indexing.
+
+        Args:
+            listings: iterable of (dirname, filenames) tuples for each directory
+                to index, as yielded by a Crawler.
+            warnings: list to append string warnings to.
+
+        Yields:
+            A list of the successfully indexed and finalised TrackFiles for each
+            directory containing tracks, in the order the directories were
+            given.
+        """
+        pool = multiprocessing.Pool(self.process_count, _init_worker,
+                                    (self.track_factory,))
+        try:
+            for results in pool.imap(_index_directory, listings):
+                track_files = []
+                for file_path, indexed_data, final, error in results:
+                    if error is not None:
+                        warnings.append('Failed to index %s: %s' % (file_path, error))
+                    else:
+                        track_files.append(_rebuild_track(file_path, indexed_data, final))
+                if track_files:
+                    yield track_files
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
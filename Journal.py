@@ -0,0 +1,305 @@
+"""Imports:
+    os: syncing written files and undoing incomplete writes
+    sqlite3: storing the journal on disk
+    ID3v2: sizing the tags of files being recovered
+    TagReader: reading the tag regions of files before they are written
+"""
+import os
+import sqlite3
+import ID3v2
+import TagReader
+
+JOURNAL_FILENAME = '.music_tagger_journal.sqlite'
+# Version of the journal's tables. Bump this whenever they change so stale
+# journals are discarded.
+_SCHEMA_VERSION = 1
+
+
+def _write_at(file_path, data, offset):
+    """Writes bytes at a position in an existing file.
+
+    Args:
+        file_path: string path to the file.
+        data: string of bytes to write.
+        offset: int position to write them at.
+
+    Returns:
+        None
+    """
+    with open(file_path, "r+b", 0) as f:
+        f.seek(offset, 0)
+        f.write(data)
+
+
+def _fsync_path(path):
+    """Flushes a file or directory to disk.
+
+    Args:
+        path: string path to the file or directory.
+
+    Returns:
+        None
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        # Directories cannot be opened on some platforms.
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def _remove_temp_files(file_path):
+    """Removes any temporary files left by an interrupted TrackFile.save.
+
+    Args:
+        file_path: string path the track was being saved to.
+
+    Returns:
+        None
+    """
+    directory, name = os.path.split(os.path.abspath(file_path))
+    try:
+        filenames = os.listdir(directory)
+    except OSError:
+        return
+    for filename in filenames:
+        if filename.startswith('.' + name) and filename.endswith('.tmp'):
+            os.remove(os.path.join(directory, filename))
+
+
+class Journal(object):
+    """A write-ahead journal of the files written by the rewriting stage.
+
+    Every file is planned in the journal, along with the regions of it which
+    may hold tags, before it is written, and completed once it has been. The
+    plans of a whole batch (e.g. an album) are committed together before any
+    of it is written, and the completions committed together once all of it
+    has been, with the written files and their directories synced to disk
+    just before. This costs one commit and one set of syncs per batch.
+
+    After a crash, writes which were planned but never completed are undone:
+    files being created elsewhere are removed, files being moved are moved
+    back, and tags being patched in place have their original regions
+    restored. A resumed run then skips every completed file. Once a run
+    finishes the journal is emptied, leaving nothing to resume.
+
+    Attributes:
+        db_path: string path to the SQLite database backing the journal.
+        output_path: string path to the directory structure being created by
+            the run, or None if tracks are written in place.
+        skipped_count: int number of files skipped as already written.
+    """
+    def __init__(self, db_path, resume=False):
+        """Opens (creating if necessary) the journal.
+
+        Args:
+            db_path: string path to the SQLite database backing the journal.
+            resume: Optional bool, True to keep the completed files of the
+                previous run, False (the default) to start afresh. Incomplete
+                writes must be undone with recover either way.
+
+        Returns:
+            The initialised Journal object.
+        """
+        self.db_path = db_path
+        self.skipped_count = 0
+        # Paths written since the last commit, to sync before it.
+        self._unsynced_paths = []
+        self._db = sqlite3.connect(db_path)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                         'key TEXT PRIMARY KEY, value)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS operations ('
+                         'source BLOB PRIMARY KEY, target BLOB, file_size INTEGER, '
+                         'head BLOB, tail BLOB, method TEXT)')
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != _SCHEMA_VERSION:
+            self._db.execute('DELETE FROM operations')
+            self._db.execute('DELETE FROM meta')
+            self._db.execute("INSERT INTO meta VALUES ('version', ?)", (_SCHEMA_VERSION,))
+            self._db.commit()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'output_path'").fetchone()
+        self.output_path = str(row[0]) if row is not None and resume else None
+        self._resume = resume
+
+
+    def recover(self):
+        """Undoes every write which was planned but never completed.
+
+        Must be called before any file is indexed, as an interrupted in-place
+        patch may have left a file's tags partially written. A file which had
+        already been rewritten in full (so is whole, with its new tags) is
+        left as it is; its original tags are kept by the undo log.
+
+        Returns:
+            int number of writes undone.
+        """
+        rows = self._db.execute('SELECT source, target, file_size, head, tail '
+                                'FROM operations WHERE method IS NULL').fetchall()
+        undone_count = 0
+        for source, target, file_size, head, tail in rows:
+            source = str(source)
+            _remove_temp_files(str(target) if target is not None else source)
+            undone = False
+            if target is not None:
+                target = str(target)
+                if os.path.exists(source):
+                    # The file was being copied (or its move never started),
+                    # leaving the original untouched.
+                    if os.path.lexists(target):
+                        os.remove(target)
+                        undone_count += 1
+                    continue
+                if not os.path.exists(target):
+                    continue
+                os.rename(target, source)
+                undone = True
+            elif not os.path.exists(source):
+                continue
+            if head is not None:
+                # Patches keep the tag the same size (though a torn one may
+                # leave no valid tag at all), so if it is not a full rewrite
+                # has since replaced the file and there is nothing to undo.
+                regions = TagReader.read_tag_regions(source)
+                if ID3v2.read_tag_size(regions.head) in (0, ID3v2.read_tag_size(str(head))):
+                    if not regions.head.startswith(str(head)):
+                        _write_at(source, str(head), 0)
+                        undone = True
+                    if regions.file_size != file_size or \
+                       not regions.tail.endswith(str(tail)):
+                        _write_at(source, str(tail), file_size - len(tail))
+                        undone = True
+            if undone:
+                undone_count += 1
+        self._db.execute('DELETE FROM operations WHERE method IS NULL')
+        if not self._resume:
+            self._db.execute('DELETE FROM operations')
+            self._db.execute("DELETE FROM meta WHERE key = 'output_path'")
+        self._db.commit()
+        return undone_count
+
+
+    def set_output_path(self, output_path):
+        """Records the directory structure being created by the run.
+
+        Args:
+            output_path: string path to the directory.
+
+        Returns:
+            None
+        """
+        self.output_path = output_path
+        self._db.execute("INSERT OR REPLACE INTO meta VALUES ('output_path', ?)",
+                         (output_path,))
+        self._db.commit()
+
+
+    def is_done(self, source):
+        """Checks whether a file was completely written by a previous run.
+
+        Files which were are counted in skipped_count.
+
+        Args:
+            source: string path to the track's file.
+
+        Returns:
+            True if the file was completely written and should be skipped,
+            False otherwise.
+        """
+        row = self._db.execute('SELECT method FROM operations WHERE source = ?',
+                               (sqlite3.Binary(source),)).fetchone()
+        if row is not None and row[0] is not None:
+            self.skipped_count += 1
+            return True
+        return False
+
+
+    def plan(self, source, target=None, regions=None, rename_only=False):
+        """Records that a file is about to be written.
+
+        Args:
+            source: string path to the track's file.
+            target: Optional string path the track is being copied or moved
+                to, or None if its own file is being written in place.
+            regions: Optional TagRegions already read from the file. They are
+                read if not given.
+            rename_only: Optional bool, True if the file is only being moved
+                to target, leaving its contents alone. Nothing is read from
+                it, and recovery just moves it back.
+
+        Returns:
+            None
+        """
+        if rename_only:
+            self._db.execute('INSERT OR REPLACE INTO operations VALUES '
+                             '(?, ?, NULL, NULL, NULL, NULL)',
+                             (sqlite3.Binary(source), sqlite3.Binary(target)))
+            return
+        # The regions of the file which may hold tags are recorded so a write
+        # to it (in place, or after moving it) can be undone.
+        if regions is None:
+            regions = TagReader.read_tag_regions(source)
+        self._db.execute('INSERT OR REPLACE INTO operations VALUES (?, ?, ?, ?, ?, NULL)',
+                         (sqlite3.Binary(source),
+                          sqlite3.Binary(target) if target is not None else None,
+                          regions.file_size, sqlite3.Binary(regions.head),
+                          sqlite3.Binary(regions.tail)))
+
+
+    def complete(self, source, target, method):
+        """Records that a planned file has been written.
+
+        Args:
+            source: string path to the track's file.
+            target: string path to the file actually written (which may be the
+                track's own file).
+            method: TagWriter.WriteMethod the file was written with.
+
+        Returns:
+            None
+        """
+        self._unsynced_paths.append(target)
+        self._db.execute('UPDATE operations SET method = ?, head = NULL, tail = NULL '
+                         'WHERE source = ?', (method.name, sqlite3.Binary(source)))
+
+
+    def commit(self):
+        """Syncs all files written since the last commit, then commits.
+
+        Returns:
+            None
+        """
+        directories = set()
+        for path in self._unsynced_paths:
+            _fsync_path(path)
+            directories.add(os.path.dirname(os.path.abspath(path)))
+        for directory in directories:
+            _fsync_path(directory)
+        self._unsynced_paths = []
+        self._db.commit()
+
+
+    def finish(self):
+        """Records that the run completed, so there is nothing to resume.
+
+        Returns:
+            None
+        """
+        self.commit()
+        self._db.execute('DELETE FROM operations')
+        self._db.execute("DELETE FROM meta WHERE key = 'output_path'")
+        self._db.commit()
+
+
+    def close(self):
+        """Commits all outstanding writes and closes the journal.
+
+        Returns:
+            None
+        """
+        self.commit()
+        self._db.close()
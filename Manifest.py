@@ -0,0 +1,135 @@
+"""Imports:
+    os: stat-ing track files
+    sqlite3: storing the manifest on disk
+    cPickle: serialising the indexed data of each track
+"""
+import os
+import sqlite3
+import cPickle
+
+MANIFEST_FILENAME = '.music_tagger_manifest.sqlite'
+# Version of the data stored for each track. Bump this whenever the contents of
+# TrackFile.get_indexed_data change so stale manifests are discarded.
+_SCHEMA_VERSION = 4
+
+
+def stat_signature(file_path):
+    """Calculates the signature used to decide whether a file has changed.
+
+    Args:
+        file_path: string path to the file.
+
+    Returns:
+        A tuple of (inode, size, mtime) for the file, or None if it could not be
+        stat-ed.
+    """
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_size, stat.st_mtime)
+
+
+class Manifest(object):
+    """A persistent store of the data indexed from each track file.
+
+    Each track file's indexed data is stored against its path along with the
+    stat signature (inode, size, mtime) the file had when it was indexed. A
+    later run can then restore the indexed data for any file whose signature
+    has not changed instead of opening and parsing it again.
+
+    Attributes:
+        db_path: string path to the SQLite database backing the manifest.
+        hit_count: int number of tracks restored from the manifest.
+        miss_count: int number of tracks which had to be indexed.
+    """
+    def __init__(self, db_path):
+        """Opens (creating if necessary) the manifest.
+
+        Args:
+            db_path: string path to the SQLite database backing the manifest.
+
+        Returns:
+            The initialised Manifest object.
+        """
+        self.db_path = db_path
+        self.hit_count = 0
+        self.miss_count = 0
+        # Signatures of files which missed, taken before they were indexed.
+        self._pending_signatures = {}
+        # The manifest may be handed to another thread (e.g. by a pipeline
+        # stage) but is only ever used by one thread at a time.
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute('CREATE TABLE IF NOT EXISTS meta ('
+                         'key TEXT PRIMARY KEY, value INTEGER)')
+        self._db.execute('CREATE TABLE IF NOT EXISTS tracks ('
+                         'path BLOB PRIMARY KEY, inode INTEGER, size INTEGER, '
+                         'mtime REAL, data BLOB)')
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if row is None or row[0] != _SCHEMA_VERSION:
+            self._db.execute('DELETE FROM tracks')
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                             (_SCHEMA_VERSION,))
+            self._db.commit()
+
+
+    def load(self, track):
+        """Restores a track's indexed data from the manifest, if up to date.
+
+        Args:
+            track: TrackFile to restore. If this returns False the track should
+                be indexed with load_all_data and then passed to store.
+
+        Returns:
+            True if the track's indexed data was restored, False if the file
+            has changed since it was last indexed or was never indexed.
+        """
+        signature = stat_signature(track.file_path)
+        row = self._db.execute('SELECT inode, size, mtime, data FROM tracks '
+                               'WHERE path = ?',
+                               (sqlite3.Binary(track.file_path),)).fetchone()
+        if signature is not None and row is not None and tuple(row[:3]) == signature:
+            track.set_indexed_data(cPickle.loads(str(row[3])))
+            self.hit_count += 1
+            return True
+        self._pending_signatures[track.file_path] = signature
+        self.miss_count += 1
+        return False
+
+
+    def store(self, track):
+        """Records a freshly indexed track's data in the manifest.
+
+        Args:
+            track: TrackFile which has had load_all_data called on it since it
+                was passed to load.
+
+        Returns:
+            None
+        """
+        signature = self._pending_signatures.pop(track.file_path, None)
+        if signature is None:
+            return
+        data = cPickle.dumps(track.get_indexed_data(), cPickle.HIGHEST_PROTOCOL)
+        self._db.execute('INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?)',
+                         (sqlite3.Binary(track.file_path),) + signature + \
+                         (sqlite3.Binary(data),))
+
+
+    def commit(self):
+        """Commits all stored data to disk.
+
+        Returns:
+            None
+        """
+        self._db.commit()
+
+
+    def close(self):
+        """Commits all stored data to disk and closes the manifest.
+
+        Returns:
+            None
+        """
+        self._db.commit()
+        self._db.close()
@@ -0,0 +1,228 @@
+"""Imports:
+    os: resolving the searched directory
+    json: encoding the plan
+    TrackData: recreating the finalised data of planned tracks
+    TrackFile: recreating planned tracks
+    TrackCollection: collecting planned tracks to write
+    ID3v1: sizing the fields of ID3v1 tags
+    TagWriter: predicting how each track's tags will be written
+    Manifest: checking files have not changed since they were planned
+"""
+import os
+import json
+import TrackData
+import TrackFile
+import TrackCollection
+import ID3v1
+import TagWriter
+import Manifest
+
+# Version of the plan format. Bump this whenever it changes so stale plans are
+# refused.
+PLAN_VERSION = 2
+_FIELDS = ('title', 'artist', 'album', 'track', 'year')
+
+
+def _encode_string(string):
+    """Encodes a byte string for storing in a plan.
+
+    Args:
+        string: string of bytes, or None.
+
+    Returns:
+        The string decoded as UTF-8 where it is valid UTF-8, otherwise a
+        dictionary holding it decoded as Latin-1 (so any bytes round trip).
+    """
+    if string is None:
+        return None
+    try:
+        return string.decode('utf-8')
+    except UnicodeDecodeError:
+        return {'latin-1': string.decode('latin-1')}
+
+
+def _decode_string(value):
+    """Decodes a byte string stored by _encode_string.
+
+    Args:
+        value: value returned by _encode_string.
+
+    Returns:
+        The original string of bytes, or None.
+    """
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        return value['latin-1'].encode('latin-1')
+    return value.encode('utf-8')
+
+
+def _encode_data(data):
+    """Encodes a TrackData for storing in a plan.
+
+    Args:
+        data: TrackData to encode, or None.
+
+    Returns:
+        A dictionary mapping each field to its encoded value, or None.
+    """
+    if data is None:
+        return None
+    return dict((field, _encode_string(getattr(data, field)) \
+                 if isinstance(getattr(data, field), str) else getattr(data, field)) \
+                for field in _FIELDS)
+
+
+def _decode_data(fields):
+    """Decodes a TrackData stored by _encode_data.
+
+    Args:
+        fields: value returned by _encode_data.
+
+    Returns:
+        The original TrackData, or None.
+    """
+    if fields is None:
+        return None
+    data = TrackData.TrackData()
+    for field in _FIELDS:
+        value = fields[field]
+        setattr(data, field, value if isinstance(value, int) or value is None \
+                             else _decode_string(value))
+    return data
+
+
+def _describe_changes(final, data, max_length=None):
+    """Lists the fields of a tag which writing a track will change.
+
+    Args:
+        final: finalised TrackData of the track.
+        data: TrackData parsed from the tag, or None if there is no tag.
+        max_length: Optional int number of characters strings are truncated to
+            in the tag, or None if they are not.
+
+    Returns:
+        A dictionary mapping the name of each changed field to a list of its
+        encoded current and new values.
+    """
+    current = data or TrackData.TrackData()
+    changes = {}
+    for field in _FIELDS:
+        old_value = getattr(current, field)
+        new_value = getattr(final, field)
+        if isinstance(new_value, str):
+            new_value = new_value[:max_length]
+        if (old_value or None) != (new_value or None):
+            if isinstance(new_value, str):
+                changes[field] = [_encode_string(old_value), _encode_string(new_value)]
+            else:
+                changes[field] = [old_value, new_value]
+    return changes
+
+
+def export_plan(plan_path, directory, output_mode_name, music_collection, warnings):
+    """Writes a plan of the changes writing a collection would make.
+
+    The plan is a JSON lines file: a header object (with the plan version,
+    searched directory and output mode) followed by an object per track, in
+    the order they would be written. Each track's object holds its file's
+    path and stat signature, its finalised data, the (uncleaned) data parsed
+    from each of its tags and the changes writing it makes to them, how it is
+    expected to be written in the output mode (e.g. only renamed, or left
+    unchanged) and (for output modes which create a new directory structure)
+    its path within it.
+
+    Args:
+        plan_path: string path to write the plan to.
+        directory: string path to the searched directory.
+        output_mode_name: string name of the Config.OutputMode to plan for.
+        music_collection: processed and standardised TrackCollection.
+        warnings: list to append string warnings to.
+
+    Returns:
+        int number of tracks in the plan.
+    """
+    copy = output_mode_name in ('copy', 'hardlink', 'reflink')
+    track_count = 0
+    with open(plan_path, 'w') as f:
+        f.write(json.dumps({'version': PLAN_VERSION,
+                            'directory': _encode_string(os.path.realpath(directory)),
+                            'output_mode': output_mode_name}) + '\n')
+        for artist in music_collection.collection:
+            for album in music_collection.collection[artist]:
+                for song in music_collection.collection[artist][album]:
+                    signature = Manifest.stat_signature(song.file_path)
+                    try:
+                        strategy = TagWriter.predict_write_method(
+                            song, copy, output_mode_name == 'hardlink',
+                            output_mode_name == 'reflink', output_mode_name == 'move').name
+                    except Exception as e: # pylint: disable=broad-except
+                        warnings.append('Failed to plan %s: %s' % (song.file_path, e))
+                        continue
+                    if signature is None:
+                        warnings.append('Failed to plan %s: cannot stat file' % (song.file_path))
+                        continue
+                    subpath = music_collection.get_track_subpath(artist, album, song)
+                    f.write(json.dumps({
+                        'source': _encode_string(song.file_path),
+                        'signature': list(signature),
+                        'final': _encode_data(song.final),
+                        'tags': {'id3v1': _encode_data(song.raw_v1),
+                                 'id3v2': _encode_data(song.raw_v2)},
+                        'changes': {'id3v1': _describe_changes(song.final, song.raw_v1,
+                                                               ID3v1.FIELD_SIZE),
+                                    'id3v2': _describe_changes(song.final, song.raw_v2)},
+                        'strategy': strategy,
+                        'target': _encode_string(subpath) \
+                                  if output_mode_name != 'in_place' else None},
+                        sort_keys=True) + '\n')
+                    track_count += 1
+    return track_count
+
+
+def load_plan(plan_path, directory, warnings):
+    """Reads a plan written by export_plan, ready to be written.
+
+    Tracks whose files have changed (or gone) since the plan was made, going
+    by their stat signature, are dropped with a warning. Nothing else is read
+    from the tracks' files. Each track is given the data parsed from its tags
+    when the plan was made, so the same tracks are only renamed (see
+    TagWriter.data_matches) as the plan expects.
+
+    Args:
+        plan_path: string path to the plan.
+        directory: string path to the searched directory, which must be the
+            one the plan was made for.
+        warnings: list to append string warnings to.
+
+    Returns:
+        A tuple of the string name of the Config.OutputMode the plan was made
+        for and a TrackCollection of the planned tracks, finalised with their
+        planned data.
+
+    Raises:
+        Exception: the plan is of a different version, or was made for a
+            different directory.
+    """
+    music_collection = TrackCollection.TrackCollection()
+    with open(plan_path, 'r') as f:
+        header = json.loads(f.readline())
+        if header.get('version') != PLAN_VERSION:
+            raise Exception("Cannot apply a version %s plan (expected version %d)." \
+                            % (header.get('version'), PLAN_VERSION))
+        if _decode_string(header['directory']) != os.path.realpath(directory):
+            raise Exception("The plan was made for %s, not %s." \
+                            % (_decode_string(header['directory']), directory))
+        for line in f:
+            entry = json.loads(line)
+            file_path = _decode_string(entry['source'])
+            if Manifest.stat_signature(file_path) != tuple(entry['signature']):
+                warnings.append('Skipping %s: changed since the plan was made' % (file_path))
+                continue
+            track = TrackFile.TrackFile(file_path)
+            track.raw_v1 = _decode_data(entry['tags']['id3v1'])
+            track.raw_v2 = _decode_data(entry['tags']['id3v2'])
+            track.final = _decode_data(entry['final'])
+            track.finalised = True
+            music_collection.add(track)
+    return header['output_mode'], music_collection
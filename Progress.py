@@ -21,3 +21,25 @@ def report(description, total_units, done_units):
         sys.stdout.write("%s... %3.0f%%\r" % (description, percentage))
         #sys.stdout.write("%s... %4d/%4d\r" % (description, done_units, total_units))
         sys.stdout.flush()
+
+def rate(description, done_units, elapsed_seconds, unit_name, finished=False):
+    """Prints a description with the number of units done and their rate"""
+    units_per_second = done_units / elapsed_seconds if elapsed_seconds > 0 else 0.0
+    if finished:
+        sys.stdout.write("%s... %d %s (%.0f %s/s)\n" % (description, done_units,
+                         unit_name, units_per_second, unit_name))
+    else:
+        sys.stdout.write("%s... %d %s (%.0f %s/s)\r" % (description, done_units,
+                         unit_name, units_per_second, unit_name))
+        sys.stdout.flush()
+
+def throughput(description, total_units, done_units, done_bytes, elapsed_seconds):
+    """Prints a description with its total progress and its rate in units and
+    megabytes"""
+    units_per_second = done_units / elapsed_seconds if elapsed_seconds > 0 else 0.0
+    mb_per_second = done_bytes / elapsed_seconds / (1 << 20) if elapsed_seconds > 0 else 0.0
+    percentage = (done_units / float(total_units)) * 100 if total_units else 100.0
+    end = "\n" if done_units == total_units else "\r"
+    sys.stdout.write("%s... %3.0f%% (%.0f files/s, %.1f MB/s)%s" % (description,
+                     percentage, units_per_second, mb_per_second, end))
+    sys.stdout.flush()
@@ -0,0 +1,235 @@
+"""Imports:
+    os: finding the size of files
+    TrackData: for containing the extracted information
+    ID3v1: decoding the tags at the end of each file
+    ID3v2: decoding the tags at the start of each file
+    TagReader: holding the regions read from each file
+    numpy: (optional) decoding the fixed layout fields of a whole batch of tags
+        at once. When it is not available each tag is decoded in turn.
+"""
+import os
+import TrackData
+import ID3v1
+import ID3v2
+import TagReader
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+if numpy is not None:
+    # Layout of the last ID3v1.MAX_TAG_SIZE bytes of a file: an (optional)
+    # extended tag followed by a standard tag.
+    _ID3V1_DTYPE = numpy.dtype([
+        ('xmagic', 'S4'), ('xtitle', 'S60'), ('xartist', 'S60'),
+        ('xalbum', 'S60'), ('xother', 'V43'),
+        ('magic', 'S3'), ('title', 'S30'), ('artist', 'S30'), ('album', 'S30'),
+        ('year', 'u1', (4,)), ('comment', 'S28'), ('zero', 'u1'),
+        ('track', 'u1'), ('genre', 'u1')])
+    # Layout of the header at the start of an ID3v2 tag.
+    _ID3V2_HEADER_DTYPE = numpy.dtype([
+        ('magic', 'S3'), ('version', 'u1'), ('revision', 'u1'), ('flags', 'u1'),
+        ('size', 'u1', (4,))])
+    # Tag header flags defined by each ID3v2 version (indexed by the version),
+    # as accepted by ID3v2._TagHeader.
+    _ID3V2_KNOWN_FLAGS = numpy.array([0, 0, 0xC0, 0xE0, 0xF0], dtype=numpy.uint8)
+
+
+def _pad_tail(tail_data):
+    """Pads the tail of a short file to exactly ID3v1.MAX_TAG_SIZE bytes.
+
+    Args:
+        tail_data: character array of bytes read from the end of the file.
+
+    Returns:
+        tail_data, preceded by null bytes if it was short.
+    """
+    if len(tail_data) < ID3v1.MAX_TAG_SIZE:
+        return '\0' * (ID3v1.MAX_TAG_SIZE - len(tail_data)) + tail_data
+    return tail_data[-ID3v1.MAX_TAG_SIZE:]
+
+
+def decode_id3v1_tails(tails):
+    """Decodes the ID3v1 tags at the end of a batch of files.
+
+    With NumPy the tag magic, extended tag magic, v1.1 track byte, year and
+    genre fields of the whole batch are decoded in a handful of array
+    operations, leaving only the text fields to be sliced out per file.
+
+    Args:
+        tails: list of character arrays of bytes read from the end of each
+            file, as returned in TagRegions.tail.
+
+    Returns:
+        A tuple of two lists, each with an entry per file. The first holds the
+        uncleaned TrackData read from each tag and the second the int genre of
+        each tag. Both entries are None for files without a tag.
+    """
+    if numpy is None or not tails:
+        tracks_data = []
+        genres = []
+        for tail_data in tails:
+            if ID3v1.read_tag_size(tail_data) == 0:
+                tracks_data.append(None)
+                genres.append(None)
+                continue
+            tag = ID3v1._Tag(tail_data[-ID3v1.TAG_SIZE:],
+                             tail_data[-ID3v1.MAX_TAG_SIZE:-ID3v1.TAG_SIZE])
+            tracks_data.append(tag.get_data())
+            genres.append(tag.genre)
+        return tracks_data, genres
+
+    blob = ''.join(_pad_tail(tail_data) for tail_data in tails)
+    records = numpy.frombuffer(blob, dtype=_ID3V1_DTYPE)
+    has_tag = records['magic'] == 'TAG'
+    is_extended = has_tag & (records['xmagic'] == 'TAG+')
+    is_v11 = (records['zero'] == 0) & (records['track'] != 0)
+    year_digits = records['year'].astype(numpy.int32) - ord('0')
+    is_numeric_year = ((year_digits >= 0) & (year_digits <= 9)).all(axis=1)
+    years = (year_digits * numpy.array([1000, 100, 10, 1])).sum(axis=1)
+
+    tracks_data = [None] * len(tails)
+    genres = [None] * len(tails)
+    for i in numpy.flatnonzero(has_tag):
+        tag_data = blob[(i + 1) * ID3v1.MAX_TAG_SIZE - ID3v1.TAG_SIZE:
+                        (i + 1) * ID3v1.MAX_TAG_SIZE]
+        data = TrackData.TrackData()
+        data.title = ID3v1._strip_null_bytes(tag_data[3:33])
+        data.artist = ID3v1._strip_null_bytes(tag_data[33:63])
+        data.album = ID3v1._strip_null_bytes(tag_data[63:93])
+        if is_numeric_year[i]:
+            data.year = int(years[i])
+        else:
+            data.year = TrackData.mint(ID3v1._strip_null_bytes(tag_data[93:97]))
+        data.track = int(records['track'][i]) if is_v11[i] else None
+        if is_extended[i]:
+            xtag_data = blob[i * ID3v1.MAX_TAG_SIZE:
+                             (i + 1) * ID3v1.MAX_TAG_SIZE - ID3v1.TAG_SIZE]
+            data.title += ID3v1._strip_null_bytes(xtag_data[4:64])
+            data.artist += ID3v1._strip_null_bytes(xtag_data[64:124])
+            data.album += ID3v1._strip_null_bytes(xtag_data[124:184])
+        tracks_data[i] = data
+        genres[i] = int(records['genre'][i])
+    return tracks_data, genres
+
+
+def plan_head_reads(heads):
+    """Calculates the size of the ID3v2 tag at the start of a batch of files.
+
+    With NumPy the tag magic, version, flags and syncsafe size fields of the
+    whole batch are validated and decoded in a handful of array operations,
+    accepting exactly the headers ID3v2.read_tag_size does.
+
+    Args:
+        heads: list of character arrays of bytes read from the start of each
+            file. Only the first ID3v2.TAG_HEADER_SIZE bytes are used.
+
+    Returns:
+        A list of the int number of bytes which must be read from the start of
+        each file to cover its whole ID3v2 tag. This is 0 for files without a
+        tag, or with a broken tag header (leaving it to the parser to report).
+    """
+    if numpy is None or not heads:
+        sizes = []
+        for head_data in heads:
+            try:
+                sizes.append(ID3v2.read_tag_size(head_data))
+            except Exception: # pylint: disable=broad-except
+                sizes.append(0)
+        return sizes
+
+    blob = ''.join(head_data[:ID3v2.TAG_HEADER_SIZE].ljust(ID3v2.TAG_HEADER_SIZE, '\0') \
+                   for head_data in heads)
+    records = numpy.frombuffer(blob, dtype=_ID3V2_HEADER_DTYPE)
+    size_bytes = records['size'].astype(numpy.int64)
+    is_complete = numpy.array([len(head_data) >= ID3v2.TAG_HEADER_SIZE for head_data in heads])
+    known_flags = _ID3V2_KNOWN_FLAGS[numpy.minimum(records['version'], 4)]
+    is_valid = is_complete & (records['magic'] == 'ID3') \
+             & (records['version'] >= 2) & (records['version'] <= 4) \
+             & (records['revision'] != 0xFF) \
+             & ((records['flags'] & ~known_flags) == 0) \
+             & (size_bytes < 0x80).all(axis=1)
+    body_sizes = (size_bytes[:, 0] << 21) | (size_bytes[:, 1] << 14) \
+               | (size_bytes[:, 2] << 7) | (size_bytes[:, 3])
+    has_footer = (records['version'] == 4) & ((records['flags'] & 0x10) != 0)
+    sizes = numpy.where(is_valid & (body_sizes > 0),
+                        body_sizes + ID3v2.TAG_HEADER_SIZE \
+                        + numpy.where(has_footer, ID3v2.FOOTER_SIZE, 0), 0)
+    return [int(size) for size in sizes]
+
+
+def read_tag_regions(file_paths):
+    """Reads all regions which may contain tags from a batch of files.
+
+    The start and end of every file are read first (the start speculatively,
+    as ID3v2.read_tag_bytes does). The ID3v2 tag sizes of the whole batch are
+    then planned at once with plan_head_reads, and only those files whose tag
+    overran the speculative read, or which have further tags appended, are
+    read again.
+
+    Args:
+        file_paths: list of string paths to the files to read.
+
+    Returns:
+        A list with a (regions, error) tuple for each file, where regions is the
+        file's TagRegions and error is None, or regions is None and error is
+        the exception raised reading the file.
+    """
+    results = []
+    for file_path in file_paths:
+        try:
+            with open(file_path, "rb", 0) as f:
+                file_size = os.fstat(f.fileno()).st_size
+                head = f.read(ID3v2.SPECULATIVE_READ_SIZE)
+                tail_size = min(file_size, TagReader.TAIL_SIZE)
+                f.seek(file_size - tail_size, 0)
+                tail = f.read(tail_size)
+            results.append((TagReader.TagRegions(file_size, head, tail), None))
+        except (IOError, OSError) as e:
+            results.append((None, e))
+
+    read_indices = [i for i, (regions, _) in enumerate(results) if regions is not None]
+    head_sizes = plan_head_reads([results[i][0].head for i in read_indices])
+    for i, head_size in zip(read_indices, head_sizes):
+        regions = results[i][0]
+        if head_size > len(regions.head) and \
+           len(regions.head) == ID3v2.SPECULATIVE_READ_SIZE:
+            try:
+                with open(file_paths[i], "rb", 0) as f:
+                    f.seek(len(regions.head), 0)
+                    regions.head += f.read(head_size - len(regions.head))
+            except (IOError, OSError) as e:
+                results[i] = (None, e)
+                continue
+        if TagReader.has_appended_tags(regions):
+            try:
+                with open(file_paths[i], "rb", 0) as f:
+                    regions.appended_offsets, regions.appended = \
+                        TagReader.read_appended_tags(f, regions)
+            except (IOError, OSError) as e:
+                results[i] = (None, e)
+    return results
+
+
+def parse_tag_regions(regions_list):
+    """Parses the ID3v1 and ID3v2 tags from the regions of a batch of files.
+
+    Args:
+        regions_list: list of TagRegions, one per file.
+
+    Returns:
+        A list with a (v1, v2, error) tuple for each file, where v1 and v2 are
+        the uncleaned TrackData from each tag (or None if the file does not
+        have one), as taken by TrackFile.load_tag_data, and error is None, or
+        v1 and v2 are None and error is the exception raised parsing the
+        file's tags.
+    """
+    tracks_data, _ = decode_id3v1_tails([regions.tail for regions in regions_list])
+    results = []
+    for regions, v1 in zip(regions_list, tracks_data):
+        try:
+            v2 = ID3v2.parse_tag_data(regions.head, regions.appended, clean=False)
+            results.append((v1, v2, None))
+        except Exception as e: # pylint: disable=broad-except
+            results.append((None, None, e))
+    return results
@@ -0,0 +1,208 @@
+"""Imports:
+    os: finding the size of files
+    ID3v1: sizing the region at the end of the file to read
+    ID3v2: sizing the region at the start of the file to read, and finding tags
+        appended to the file
+"""
+import os
+import ID3v1
+import ID3v2
+
+# Byte size of the region read from the end of every file. This covers the
+# largest possible ID3v1 tag and the footer of any ID3v2 tag just before it.
+TAIL_SIZE = ID3v1.MAX_TAG_SIZE + ID3v2.FOOTER_SIZE
+# Maximum number of SEEK frames followed from one tag to the next.
+_MAX_SEEKS = 8
+
+
+class TagRegions(object):
+    """The regions of a file which may contain tags.
+
+    Attributes:
+        file_size: int byte size of the whole file.
+        head: string of bytes from the start of the file. Covers the entire
+            ID3v2 tag when the file has one, otherwise only its first few
+            kilobytes.
+        tail: string of bytes from the end of the file. Covers the largest
+            possible ID3v1 tag (including an extended tag) and the ID3v2 footer
+            which may precede it.
+        appended: list of strings of bytes of each ID3v2 tag found after the
+            start of the file, in file order.
+        appended_offsets: list of int positions in the file of each tag in
+            appended.
+    """
+    def __init__(self, file_size, head, tail, appended=None, appended_offsets=None):
+        self.file_size = file_size
+        self.head = head
+        self.tail = tail
+        self.appended = appended if appended is not None else []
+        self.appended_offsets = appended_offsets if appended_offsets is not None else []
+
+
+def _read_tag_at(file_handle, offset, end):
+    """Reads an ID3v2 tag from a given position in a file
+
+    Args:
+        file_handle: a file handle opened in a readable binary mode.
+        offset: int position the tag should start at.
+        end: int position the tag must end by.
+
+    Returns:
+        character array of bytes of the whole tag, or None if there is no valid
+        tag at the position.
+    """
+    if offset < 0 or offset + ID3v2.TAG_HEADER_SIZE > end:
+        return None
+    file_handle.seek(offset, 0)
+    tag_data = file_handle.read(ID3v2.TAG_HEADER_SIZE)
+    try:
+        tag_size = ID3v2.read_tag_size(tag_data)
+    except Exception: # pylint: disable=broad-except
+        return None
+    if tag_size == 0 or offset + tag_size > end:
+        return None
+    return tag_data + file_handle.read(tag_size - len(tag_data))
+
+
+def _locate_footer_tag(file_size, tail):
+    """Locates an ID3v2 tag appended to a file from its footer
+
+    Args:
+        file_size: int byte size of the whole file.
+        tail: string of bytes from the end of the file, as in TagRegions.tail.
+
+    Returns:
+        A tuple of the int position and size of the tag, or None if there is no
+        footer just before the ID3v1 tag (or the end of the file).
+    """
+    footer_end = len(tail) - ID3v1.read_tag_size(tail)
+    if footer_end < ID3v2.FOOTER_SIZE:
+        return None
+    try:
+        tag_size = ID3v2.read_footer_tag_size(tail[footer_end - ID3v2.FOOTER_SIZE:footer_end])
+    except Exception: # pylint: disable=broad-except
+        return None
+    if tag_size == 0:
+        return None
+    return file_size - (len(tail) - footer_end) - tag_size, tag_size
+
+
+def has_appended_tags(regions):
+    """Cheaply checks whether a file may have ID3v2 tags after its start
+
+    Args:
+        regions: TagRegions read from the file (without appended tags).
+
+    Returns:
+        True if the tag at the start of the file has a SEEK frame or the end of
+        the file has an ID3v2 footer, False otherwise.
+    """
+    try:
+        if ID3v2.read_seek_offset(regions.head) is not None:
+            return True
+    except Exception: # pylint: disable=broad-except
+        # Leave reporting the broken tag to the parser.
+        pass
+    footer_tag = _locate_footer_tag(regions.file_size, regions.tail)
+    return footer_tag is not None and footer_tag[0] > 0
+
+
+def read_appended_tags(file_handle, regions):
+    """Reads any ID3v2 tags after the start of a file.
+
+    Tags are found by following the SEEK frame of each tag in turn from the
+    tag at the start of the file, and from a footer just before the ID3v1 tag
+    (or the end of the file). Only the tags themselves are read, the audio is
+    never scanned.
+
+    Args:
+        file_handle: a file handle opened in a readable binary mode.
+        regions: TagRegions read from the file (without appended tags).
+
+    Returns:
+        A tuple of a list of the int positions of each tag found and a list of
+        character arrays of their bytes, both in file order.
+    """
+    audio_end = regions.file_size - ID3v1.read_tag_size(regions.tail)
+    found = {}
+    # Follow SEEK frames.
+    tag_data = regions.head
+    try:
+        tag_end = ID3v2.read_tag_size(regions.head)
+    except Exception: # pylint: disable=broad-except
+        tag_data = None
+    for _ in range(_MAX_SEEKS):
+        if tag_data is None:
+            break
+        try:
+            seek_offset = ID3v2.read_seek_offset(tag_data)
+        except Exception: # pylint: disable=broad-except
+            break
+        if seek_offset is None:
+            break
+        tag_start = tag_end + seek_offset
+        if tag_start in found:
+            break
+        tag_data = _read_tag_at(file_handle, tag_start, audio_end)
+        if tag_data is not None:
+            found[tag_start] = tag_data
+            tag_end = tag_start + len(tag_data)
+    # Check for a footer.
+    footer_tag = _locate_footer_tag(regions.file_size, regions.tail)
+    if footer_tag is not None and footer_tag[0] > 0 and footer_tag[0] not in found:
+        tag_data = _read_tag_at(file_handle, footer_tag[0], audio_end)
+        if tag_data is not None:
+            found[footer_tag[0]] = tag_data
+    tag_starts = sorted(found)
+    return tag_starts, [found[tag_start] for tag_start in tag_starts]
+
+
+def audio_ranges(regions):
+    """Locates the audio of a file, between its tags.
+
+    Args:
+        regions: TagRegions read from the file.
+
+    Returns:
+        A list of (offset, size) tuples of each range of bytes in the file
+        which is neither the ID3v2 tag at its start, a tag appended to it
+        (including any footer) nor its ID3v1 tag, in file order.
+    """
+    offset = ID3v2.read_tag_size(regions.head)
+    audio_end = regions.file_size - ID3v1.read_tag_size(regions.tail)
+    ranges = []
+    for tag_start, tag_data in zip(regions.appended_offsets, regions.appended):
+        if tag_start > offset:
+            ranges.append((offset, tag_start - offset))
+        offset = max(offset, tag_start + len(tag_data))
+    if audio_end > offset:
+        ranges.append((offset, audio_end - offset))
+    return ranges
+
+
+def read_tag_regions(file_path):
+    """Reads all regions of a file which may contain tags, opening it once.
+
+    The ID3v2 tag is read in one go (with a single top up read if it is larger
+    than the speculative first read), then the end of the file is read in one
+    go. Only if these show further ID3v2 tags (from a SEEK frame or a footer)
+    is anything else read. The resulting buffers can be parsed by
+    ID3v1.parse_tag_data and ID3v2.parse_tag_data without touching the file
+    again.
+
+    Args:
+        file_path: String path to the file to read.
+
+    Returns:
+        A TagRegions for the file.
+    """
+    with open(file_path, "rb", 0) as f:
+        file_size = os.fstat(f.fileno()).st_size
+        head = ID3v2.read_tag_bytes(f)
+        tail_size = min(file_size, TAIL_SIZE)
+        f.seek(file_size - tail_size, 0)
+        tail = f.read(tail_size)
+        regions = TagRegions(file_size, head, tail)
+        if has_appended_tags(regions):
+            regions.appended_offsets, regions.appended = read_appended_tags(f, regions)
+    return regions
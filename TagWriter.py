@@ -0,0 +1,441 @@
+"""Imports:
+    errno: detecting moves between filesystems
+    os: finding the size of files, writing at an offset within them, and
+        linking and moving them
+    Enum: for enumerating the ways tags may be written
+    ID3v1: creating and sizing ID3v1 tags
+    ID3v2: creating and sizing ID3v2 tags
+    TagReader: reading the regions of files containing tags
+    fcntl: (optional) cloning files on filesystems which support reflinks.
+        When it is not available files are never cloned.
+"""
+import errno
+import os
+from enum import Enum
+import ID3v1
+import ID3v2
+import TagReader
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# Block size assumed for files whose filesystem does not report one.
+_DEFAULT_BLOCK_SIZE = 4096
+# Bounds on the padding retained from a file's previous tag under the smart
+# padding policy. Below the minimum, small edits would not fit in place; above
+# the maximum, one oddly padded tag would be carried forward forever.
+_MIN_SMART_PADDING = 1024
+_MAX_SMART_PADDING = 65536
+# Linux ioctl request to clone the whole of one file into another, sharing its
+# extents (supported by e.g. btrfs and XFS).
+_FICLONE = 0x40049409
+
+class WriteMethod(Enum):
+    """Enum representing how the tags of a file were written."""
+    patched = 0     # The tag regions were overwritten in place
+    rewritten = 1   # The whole file was rewritten
+    linked = 2      # The file was hard linked, its tags already being correct
+    cloned = 3      # The file was reflinked, then its tags patched in place
+    renamed = 4     # The file was moved, its tags already being correct
+    unchanged = 5   # The file was left untouched, its tags already being correct
+
+
+def _write_at(file_handle, data, offset):
+    """Writes bytes at a position in a file in a single call.
+
+    Args:
+        file_handle: a file handle opened in a writable binary mode.
+        data: string of bytes to write.
+        offset: int position to write them at.
+
+    Returns:
+        None
+    """
+    if hasattr(os, 'pwrite'):
+        os.pwrite(file_handle.fileno(), data, offset)
+    else:
+        file_handle.seek(offset, 0)
+        file_handle.write(data)
+        file_handle.flush()
+
+
+def tags_match(regions, v2_frames, v1_tag):
+    """Checks whether a file's tags are exactly those which would be written.
+
+    Args:
+        regions: TagRegions read from the file.
+        v2_frames: string of bytes of the new ID3v2 frames, as returned by
+            ID3v2.create_tag_frames.
+        v1_tag: string of bytes of the new ID3v1 tag.
+
+    Returns:
+        True if the ID3v2 tag at the start of the file holds exactly the new
+        frames followed only by padding, there are no further ID3v2 tags
+        appended to the file (which would override it) and the ID3v1 tag is
+        exactly the new one, False otherwise.
+    """
+    if regions.appended:
+        return False
+    head_data = regions.head
+    frames_end = ID3v2.TAG_HEADER_SIZE + len(v2_frames)
+    v2_tag_size = ID3v2.read_tag_size(head_data)
+    # Compare everything but the size field of the header.
+    if head_data[:6] != ID3v2.create_tag_header(0)[:6] or \
+       v2_tag_size < frames_end or head_data[ID3v2.TAG_HEADER_SIZE:frames_end] != v2_frames or \
+       head_data[frames_end:v2_tag_size].strip('\00'):
+        return False
+    return ID3v1.read_tag_size(regions.tail) == len(v1_tag) and regions.tail.endswith(v1_tag)
+
+
+def _data_matches(final, data, max_length=None):
+    """Checks whether data parsed from a tag is that which would be written.
+
+    Args:
+        final: finalised TrackData to be written.
+        data: TrackData parsed from the tag, or None if there is no tag.
+        max_length: Optional int number of characters strings are truncated to
+            in the tag, or None if they are not.
+
+    Returns:
+        True if every field of data matches final, False otherwise.
+    """
+    if data is None:
+        return False
+    for attr in ('title', 'artist', 'album'):
+        if (getattr(data, attr) or '') != getattr(final, attr)[:max_length]:
+            return False
+    return (data.track or 0) == final.track and (data.year or 0) == final.year
+
+
+def data_matches(track):
+    """Checks whether a track's tags already hold its finalised data.
+
+    This compares the data already parsed from the track's tags, so reads
+    nothing from the file. The data is compared as it was before it was
+    cleaned, so tags which differ only in what cleaning changes (e.g.
+    capitalisation) do not match, and are rewritten.
+
+    Args:
+        track: TrackFile to check. Must be finalised.
+
+    Returns:
+        True if both the track's ID3v1 and ID3v2 tags hold its finalised data,
+        False otherwise.
+    """
+    return _data_matches(track.final, track.raw_v2) and \
+           _data_matches(track.final, track.raw_v1, ID3v1.FIELD_SIZE)
+
+
+def tags_fit(regions, v2_frames):
+    """Checks whether new tags can be patched over a file's existing ones.
+
+    Args:
+        regions: TagRegions read from the file.
+        v2_frames: string of bytes of the new ID3v2 frames, as returned by
+            ID3v2.create_tag_frames.
+
+    Returns:
+        True if the new frames (and a tag header) are no larger than the
+        existing ID3v2 tag, the existing tags do not overlap and there are no
+        further ID3v2 tags appended to the file (which patching would leave in
+        place, still overriding the new tag), False otherwise.
+    """
+    v2_tag_size = ID3v2.read_tag_size(regions.head)
+    return not regions.appended and \
+           v2_tag_size >= ID3v2.TAG_HEADER_SIZE + len(v2_frames) and \
+           v2_tag_size + ID3v1.read_tag_size(regions.tail) <= regions.file_size
+
+
+def patch_tags(file_handle, regions, v2_frames, v1_tag):
+    """Overwrites the tags of a file in place, if the new ones fit.
+
+    The new ID3v2 frames fit when they (and a tag header) are no larger than
+    the existing ID3v2 tag, including its padding (see tags_fit). The whole
+    tag region is then written in one call, padded out to exactly the old
+    tag's size, so the audio after it never moves. The ID3v1 tag at the end of
+    the file is replaced in the same way.
+
+    Args:
+        file_handle: a file handle opened in "r+b" mode.
+        regions: TagRegions read from the file, which must not have changed
+            since.
+        v2_frames: string of bytes of the new ID3v2 frames, as returned by
+            ID3v2.create_tag_frames.
+        v1_tag: string of bytes of the new ID3v1 tag.
+
+    Returns:
+        True if the file was patched, False if the new frames did not fit (in
+        which case the file is left untouched).
+    """
+    if not tags_fit(regions, v2_frames):
+        return False
+    file_size = regions.file_size
+    v2_tag_size = ID3v2.read_tag_size(regions.head)
+    v1_tag_size = ID3v1.read_tag_size(regions.tail)
+    body_size = v2_tag_size - ID3v2.TAG_HEADER_SIZE
+    _write_at(file_handle, ID3v2.create_tag_header(body_size) \
+              + v2_frames + '\00' * (body_size - len(v2_frames)), 0)
+    _write_at(file_handle, v1_tag, file_size - v1_tag_size)
+    if v1_tag_size > len(v1_tag):
+        # Drop the remains of an extended tag.
+        file_handle.truncate(file_size - v1_tag_size + len(v1_tag))
+    return True
+
+
+def choose_padding_size(frames_size, previous_padding_size, block_size, padding=-1):
+    """Chooses how much padding to give a new ID3v2 tag.
+
+    With the smart policy the previous tag's padding is retained (within
+    bounds), with room for the frames to grow by an eighth, and the padding is
+    then extended so the tag ends (and so the audio starts) on a block
+    boundary. This leaves space for later edits to be patched in place.
+
+    Args:
+        frames_size: int byte size of the frames of the new tag.
+        previous_padding_size: int number of bytes of padding in the tag being
+            replaced, or 0 if there was none.
+        block_size: int byte size of the blocks of the filesystem the file is
+            written to.
+        padding: Optional int number of bytes of padding to use, or -1 (the
+            default) for the smart policy. As Config.id3v2_padding.
+
+    Returns:
+        int number of bytes of padding.
+    """
+    if padding >= 0:
+        return padding
+    padding_size = max(min(previous_padding_size, _MAX_SMART_PADDING),
+                       _MIN_SMART_PADDING, frames_size // 8)
+    tag_size = ID3v2.TAG_HEADER_SIZE + frames_size + padding_size
+    return padding_size + (-tag_size % block_size)
+
+
+def plan_padding_size(output_path, head_data, frames_size, padding=-1):
+    """Chooses how much padding to give the new ID3v2 tag of a file.
+
+    Args:
+        output_path: string path the file is being written to. The tag is
+            aligned to the blocks of the filesystem holding its directory,
+            which may not be the one holding the original file.
+        head_data: character array of bytes read from the start of the
+            original file, covering its entire ID3v2 tag.
+        frames_size: int byte size of the frames of the new tag.
+        padding: Optional int number of bytes of padding to use, or -1 (the
+            default) for the smart policy. See choose_padding_size.
+
+    Returns:
+        int number of bytes of padding.
+    """
+    if padding >= 0:
+        return padding
+    try:
+        block_size = getattr(os.stat(os.path.dirname(os.path.abspath(output_path))),
+                             'st_blksize', 0)
+    except OSError:
+        block_size = 0
+    return choose_padding_size(frames_size, ID3v2.read_padding_size(head_data),
+                               block_size or _DEFAULT_BLOCK_SIZE)
+
+
+def predict_write_method(track, copy=False, hardlink=False, reflink=False, move=False,
+                         regions=None):
+    """Predicts how a track would be written, without writing anything.
+
+    This predicts write_tags, or write_track_copy when copying and move_track
+    when moving, taking the same options. Links and clones are predicted as
+    though the filesystem supports them, and moves as though they stay on one
+    filesystem. Tracks which would only be renamed are not read.
+
+    Args:
+        track: TrackFile to check. Must be finalised.
+        copy: Optional bool, True to predict write_track_copy.
+        hardlink: Optional bool, as given to write_track_copy.
+        reflink: Optional bool, as given to write_track_copy.
+        move: Optional bool, True to predict move_track.
+        regions: Optional TagRegions already read from the track's file. They
+            are read if not given.
+
+    Returns:
+        The WriteMethod the track would be written with.
+    """
+    if move and data_matches(track):
+        return WriteMethod.renamed
+    if regions is None:
+        regions = TagReader.read_tag_regions(track.file_path)
+    v1_tag = ID3v1.create_tag_string(track.final, regions.tail)
+    v2_frames = ID3v2.create_tag_frames(track.final, regions.head, regions.appended)
+    unchanged = tags_match(regions, v2_frames, v1_tag)
+    fits = tags_fit(regions, v2_frames)
+    if copy or hardlink or reflink:
+        if hardlink and unchanged:
+            return WriteMethod.linked
+        if (hardlink or reflink) and fits:
+            return WriteMethod.cloned
+        return WriteMethod.rewritten
+    if unchanged:
+        return WriteMethod.renamed if move else WriteMethod.unchanged
+    return WriteMethod.patched if fits else WriteMethod.rewritten
+
+
+def write_tags(track, padding=-1, regions=None):
+    """Writes a track's finalised data to the tags of its file.
+
+    The file's tags are read once (unless already given), and the ID3v2
+    frames not being replaced are copied into the new tag (as are the ID3v1
+    comment and genre). If the new tags are byte for byte those already in the
+    file, it is left untouched (it is not even opened for writing, so neither
+    its modification time nor anything watching it sees a change). Otherwise
+    the tags are patched in place where the new ID3v2 tag fits within the old
+    one, so only a few kilobytes are written, or else the whole file is
+    rewritten with TrackFile.save.
+
+    Args:
+        track: TrackFile to write. Must be finalised.
+        padding: Optional int number of bytes of padding to give the ID3v2 tag
+            if the file is rewritten, or -1 (the default) for the smart policy.
+            See choose_padding_size.
+        regions: Optional TagRegions already read from the track's file (e.g.
+            when it was journaled). They are read if not given.
+
+    Returns:
+        The WriteMethod used.
+    """
+    if regions is None:
+        regions = TagReader.read_tag_regions(track.file_path)
+    v1_tag = ID3v1.create_tag_string(track.final, regions.tail)
+    v2_frames = ID3v2.create_tag_frames(track.final, regions.head, regions.appended)
+    if tags_match(regions, v2_frames, v1_tag):
+        return WriteMethod.unchanged
+    with open(track.file_path, "r+b", 0) as f:
+        if patch_tags(f, regions, v2_frames, v1_tag):
+            return WriteMethod.patched
+    padding_size = plan_padding_size(track.file_path, regions.head, len(v2_frames), padding)
+    track.save(track.file_path, padding_size, regions)
+    return WriteMethod.rewritten
+
+
+def clone_file(src_path, dst_path):
+    """Creates a copy of a file which shares its data on disk (a reflink).
+
+    Args:
+        src_path: string path to the file to clone.
+        dst_path: string path to create the clone at. Must not exist.
+
+    Returns:
+        True if the file was cloned, False if the platform or filesystem does
+        not support it (in which case nothing is created).
+    """
+    if fcntl is None:
+        return False
+    with open(src_path, "rb", 0) as src:
+        dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         os.fstat(src.fileno()).st_mode & 0o7777)
+        try:
+            fcntl.ioctl(dst_fd, _FICLONE, src.fileno())
+        except (IOError, OSError):
+            os.close(dst_fd)
+            os.remove(dst_path)
+            return False
+        os.close(dst_fd)
+    return True
+
+
+def write_track_copy(track, output_path, padding=-1, hardlink=False, reflink=False,
+                     regions=None):
+    """Writes a track, with its finalised data in its tags, to a new location.
+
+    The track's own file is left untouched. Rather than copying the whole
+    file, a file whose tags are already correct may be hard linked, and other
+    files whose new tags fit within their old ones may be reflinked and have
+    their tags patched in place. Either falls back to a full copy (see
+    TrackFile.save) where the filesystem does not support it. Copies of files
+    whose new tags fit keep the old ID3v2 tag's size, as patching does, so
+    the new file is byte for byte the same however it was made.
+
+    Args:
+        track: TrackFile to write. Must be finalised.
+        output_path: string path to write the file to. Must not exist.
+        padding: Optional int number of bytes of padding to give the ID3v2 tag
+            if it does not fit within the old one, or -1 (the default) for the
+            smart policy. See choose_padding_size.
+        hardlink: Optional bool, True to hard link files whose tags are already
+            correct, and reflink the rest.
+        reflink: Optional bool, True to reflink files.
+        regions: Optional TagRegions already read from the track's file (e.g.
+            when it was journaled). They are read if not given.
+
+    Returns:
+        The WriteMethod used.
+    """
+    if regions is None:
+        regions = TagReader.read_tag_regions(track.file_path)
+    v1_tag = ID3v1.create_tag_string(track.final, regions.tail)
+    v2_frames = ID3v2.create_tag_frames(track.final, regions.head, regions.appended)
+    unchanged = tags_match(regions, v2_frames, v1_tag)
+    if hardlink and unchanged:
+        try:
+            os.link(track.file_path, output_path)
+            return WriteMethod.linked
+        except OSError:
+            # e.g. the output is on another filesystem.
+            pass
+    if tags_fit(regions, v2_frames):
+        padding_size = ID3v2.read_tag_size(regions.head) - ID3v2.TAG_HEADER_SIZE \
+                       - len(v2_frames)
+        if (hardlink or reflink) and clone_file(track.file_path, output_path):
+            try:
+                if not unchanged:
+                    with open(output_path, "r+b", 0) as f:
+                        patch_tags(f, regions, v2_frames, v1_tag)
+            except BaseException:
+                os.remove(output_path)
+                raise
+            return WriteMethod.cloned
+    else:
+        padding_size = plan_padding_size(output_path, regions.head, len(v2_frames), padding)
+    track.save(output_path, padding_size, regions)
+    return WriteMethod.rewritten
+
+
+def move_track(track, output_path, padding=-1, regions=None):
+    """Moves a track to a new location, writing its finalised data to its tags.
+
+    Tracks whose tags already hold their finalised data (see data_matches)
+    are only renamed, without reading or writing anything in the file. The
+    rest are renamed and then have their tags written at the new location as
+    by write_tags. Where the new location is on another filesystem the track
+    is instead copied there (see TrackFile.save) and its file removed.
+
+    Args:
+        track: TrackFile to move. Must be finalised. Its file_path is updated
+            to the new location.
+        output_path: string path to move the file to. Must not exist.
+        padding: Optional int number of bytes of padding to give the ID3v2 tag
+            if the file is rewritten, or -1 (the default) for the smart policy.
+            See choose_padding_size.
+        regions: Optional TagRegions already read from the track's file (e.g.
+            when it was journaled). They are read if not given.
+
+    Returns:
+        The WriteMethod used.
+
+    Raises:
+        Exception: the new location already exists.
+    """
+    if os.path.lexists(output_path):
+        raise Exception("%s already exists" % (output_path))
+    try:
+        os.rename(track.file_path, output_path)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        method = write_track_copy(track, output_path, padding, regions=regions)
+        os.remove(track.file_path)
+        track.file_path = output_path
+        return method
+    track.file_path = output_path
+    if data_matches(track):
+        return WriteMethod.renamed
+    method = write_tags(track, padding, regions)
+    return WriteMethod.renamed if method is WriteMethod.unchanged else method
@@ -2,11 +2,16 @@
     defaultdict: for multidimensional dictionaries (implicitly instantiating
         the nested dictionaries as the dimensions are accessed)
     operator: sorting dictionaries
-    os: writing the collection out to disk
+    os: writing the collection out to disk and comparing track directories
+    TagWriter: writing each track's tags back to its file
+    Writer: writing the tracks of each album, optionally across a pool of
+        threads
 """
 from collections import defaultdict
 import operator
 import os
+import TagWriter
+import Writer
 
 class TrackCollection(object):
     """A structure sorting tracks by artist and album
@@ -60,7 +65,7 @@ class TrackCollection(object):
                 indexing purposes).
 
         Returns:
-            None
+            A tuple of the (artist, album) the track was added under.
 
         Raises:
             Exception: The given track was not finalised.
@@ -73,6 +78,53 @@ class TrackCollection(object):
             self.collection[track.final.artist][track.final.album] = []
         self.collection[track.final.artist][track.final.album].append(track)
         self.file_count += 1
+        return (track.final.artist, track.final.album)
+
+
+    def merge(self, other):
+        """Adds all TrackFiles from another collection to this one.
+
+        Args:
+            other: TrackCollection whose tracks to add. It is left unmodified.
+
+        Returns:
+            None
+        """
+        for artist in other.collection:
+            for album in other.collection[artist]:
+                for track in other.collection[artist][album]:
+                    self.add(track)
+
+
+    def remove_directory(self, dirname):
+        """Removes all TrackFiles located directly within a directory.
+
+        Albums and artists left without any tracks are removed entirely.
+
+        Args:
+            dirname: string path to the directory whose tracks to remove.
+
+        Returns:
+            A set of (artist, album) tuples which tracks were removed from.
+        """
+        dirname = os.path.normpath(dirname)
+        affected_albums = set()
+        for artist in self.collection.keys():
+            for album in self.collection[artist].keys():
+                songs = self.collection[artist][album]
+                remaining = [song for song in songs \
+                             if os.path.dirname(song.file_path) != dirname]
+                if len(remaining) == len(songs):
+                    continue
+                affected_albums.add((artist, album))
+                self.file_count -= len(songs) - len(remaining)
+                if remaining:
+                    self.collection[artist][album] = remaining
+                else:
+                    del self.collection[artist][album]
+            if not self.collection[artist]:
+                del self.collection[artist]
+        return affected_albums
 
 
     def remove_duplicates(self, warnings=None, report_progress=None):
@@ -94,37 +146,51 @@ class TrackCollection(object):
         Returns:
             None
         """
-        # TODO: Compilations are going to go crazy here... revist this later,
-        # probably with a TrackFile flag for (probable) compilation tracks.
+        total_count = self.file_count
         processed_count = 0
         for artist in self.collection:
             for album in self.collection[artist]:
-                duplicate_tracker = {}
-                to_be_removed = []
-                for song in self.collection[artist][album]:
-                    title = song.final.title
-                    # If a track with this title already exists within this
-                    # artist/album tuple, mark it as a duplicate (and optionally
-                    # generate a warning
-                    if title in duplicate_tracker:
-                        duplicate = duplicate_tracker[title]
-                        if warnings is not None and ( \
-                                duplicate.final.track != song.final.track or \
-                                duplicate.final.year != song.final.year):
-                            warnings.append('Found songs with the same artist, ' \
-                                'album and title but differing track or year:\n' \
-                                '  %s\n    %s\n  %s\n    %s' % ( \
-                                    duplicate, duplicate.file_path, \
-                                    song, song.file_path))
-                        to_be_removed.append(song)
-                    else:
-                        duplicate_tracker[title] = song
-                    processed_count += 1
-                    if report_progress:
-                        report_progress(self.file_count, processed_count)
-                for song in to_be_removed:
-                    self.collection[artist][album].remove(song)
-                self.file_count -= len(to_be_removed)
+                processed_count += len(self.collection[artist][album])
+                self.remove_album_duplicates(artist, album, warnings)
+                if report_progress:
+                    report_progress(total_count, processed_count)
+
+
+    def remove_album_duplicates(self, artist, album, warnings=None):
+        """Look for duplicate songs within a single album and remove them.
+
+        Args:
+            artist: string artist the album is listed under.
+            album: string album to remove duplicates from.
+
+        Returns:
+            None
+        """
+        # TODO: Compilations are going to go crazy here... revist this later,
+        # probably with a TrackFile flag for (probable) compilation tracks.
+        duplicate_tracker = {}
+        to_be_removed = []
+        for song in self.collection[artist][album]:
+            title = song.final.title
+            # If a track with this title already exists within this
+            # artist/album tuple, mark it as a duplicate (and optionally
+            # generate a warning
+            if title in duplicate_tracker:
+                duplicate = duplicate_tracker[title]
+                if warnings is not None and ( \
+                        duplicate.final.track != song.final.track or \
+                        duplicate.final.year != song.final.year):
+                    warnings.append('Found songs with the same artist, ' \
+                        'album and title but differing track or year:\n' \
+                        '  %s\n    %s\n  %s\n    %s' % ( \
+                            duplicate, duplicate.file_path, \
+                            song, song.file_path))
+                to_be_removed.append(song)
+            else:
+                duplicate_tracker[title] = song
+        for song in to_be_removed:
+            self.collection[artist][album].remove(song)
+        self.file_count -= len(to_be_removed)
 
 
     def standardise_album_tracks(self, warnings=None, report_progress=None):
@@ -141,40 +207,74 @@ class TrackCollection(object):
         Returns:
             None
         """
-        # TODO Compilations are going to wreak havoc here too, see note on
-        # remove_duplicates.
         processed_count = 0
         for artist in self.collection:
             for album in self.collection[artist]:
-                # First collect the number of times each different album year
-                # data appears. Ideally all tracks should have the same year.
-                album_year_votes = {}
-                for song in self.collection[artist][album]:
-                    if song.final.year in album_year_votes:
-                        album_year_votes[song.final.year] += 1
-                    else:
-                        album_year_votes[song.final.year] = 1
-                    processed_count += 1
-                    if report_progress:
-                        report_progress(self.file_count, processed_count)
-                # If there is more than one album year listed, standardise. A
-                # good argument could be made for any number of strategies for
-                # standardising. Currently the majority vote takes it, but the
-                # latest 'sensible' year would also be an idea.
-                if len(album_year_votes.keys()) > 1:
-                    sorted_album_year_votes = sorted(album_year_votes.iteritems(),
-                                                     key=operator.itemgetter(1),
-                                                     reverse=True)
-                    if sorted_album_year_votes[0][0] != 0:
-                        correct_year = sorted_album_year_votes[0][0]
-                    else:
-                        correct_year = sorted_album_year_votes[1][0]
-                    if warnings is not None:
-                        warnings.append('Multiple album years for %s ' \
-                            'by %s: %s. Using %d.' \
-                            % (album, artist, str(sorted_album_year_votes), correct_year))
-                    for song in self.collection[artist][album]:
-                        song.final.year = correct_year
+                self.standardise_album(artist, album, warnings)
+                processed_count += len(self.collection[artist][album])
+                if report_progress:
+                    report_progress(self.file_count, processed_count)
+
+
+    def standardise_album(self, artist, album, warnings=None):
+        """Standardises track data between tracks within a single album.
+
+        Args:
+            artist: string artist the album is listed under.
+            album: string album to standardise.
+
+        Returns:
+            None
+        """
+        # TODO Compilations are going to wreak havoc here too, see note on
+        # remove_duplicates.
+        # First collect the number of times each different album year
+        # data appears. Ideally all tracks should have the same year.
+        album_year_votes = {}
+        for song in self.collection[artist][album]:
+            if song.final.year in album_year_votes:
+                album_year_votes[song.final.year] += 1
+            else:
+                album_year_votes[song.final.year] = 1
+        # If there is more than one album year listed, standardise. A
+        # good argument could be made for any number of strategies for
+        # standardising. Currently the majority vote takes it, but the
+        # latest 'sensible' year would also be an idea.
+        if len(album_year_votes.keys()) > 1:
+            sorted_album_year_votes = sorted(album_year_votes.iteritems(),
+                                             key=operator.itemgetter(1),
+                                             reverse=True)
+            if sorted_album_year_votes[0][0] != 0:
+                correct_year = sorted_album_year_votes[0][0]
+            else:
+                correct_year = sorted_album_year_votes[1][0]
+            if warnings is not None:
+                warnings.append('Multiple album years for %s ' \
+                    'by %s: %s. Using %d.' \
+                    % (album, artist, str(sorted_album_year_votes), correct_year))
+            for song in self.collection[artist][album]:
+                song.final.year = correct_year
+
+
+    def process_album(self, artist, album, warnings=None):
+        """Removes duplicates from and standardises a single album.
+
+        This is equivalent to running remove_duplicates followed by
+        standardise_album_tracks but limited to one album, so is suitable for
+        updating an album after its tracks have changed.
+
+        Args:
+            artist: string artist the album is listed under.
+            album: string album to process. Nothing is done if the collection
+                does not contain it.
+
+        Returns:
+            None
+        """
+        if artist not in self.collection or album not in self.collection[artist]:
+            return
+        self.remove_album_duplicates(artist, album, warnings)
+        self.standardise_album(artist, album, warnings)
 
 
     def sort_songs_by_track(self):
@@ -188,25 +288,133 @@ class TrackCollection(object):
                 self.collection[artist][album].sort(key=lambda x: x.final.track)
 
 
-    def create_new_filesystem(self, new_path):
+    def get_album_subpath(self, artist, album):
+        """Generates the path of an album's directory in a new collection.
+
+        Args:
+            artist: string artist the album is listed under.
+            album: string album.
+
+        Returns:
+            string path of the album's directory, relative to the root of the
+            new collection (and starting with a '/').
+        """
+        year = self.collection[artist][album][0].final.year
+        if year != 0:
+            return '/%s/[%d] %s' % (artist, year, album)
+        return '/%s/%s' % (artist, album)
+
+
+    def get_track_subpath(self, artist, album, song):
+        """Generates the path of a track's file in a new collection.
+
+        Args:
+            artist: string artist the track's album is listed under.
+            album: string album the track is listed under.
+            song: TrackFile of the track.
+
+        Returns:
+            string path of the track's file, relative to the root of the new
+            collection (and starting with a '/').
+        """
+        return self.get_album_subpath(artist, album) \
+            + '/%02d %s.mp3' % (song.final.track, song.final.title)
+
+
+    def write_tags(self, padding=-1, writer=None, warnings=None, report_progress=None):
+        """Writes the finalised data of every track to the tags of its file.
+
+        Each file's tags are patched in place where possible (see
+        TagWriter.write_tags). Files which fail to write are skipped.
+
+        Args:
+            padding: Optional int number of bytes of padding to give rewritten
+                ID3v2 tags, or -1 (the default) for the smart policy.
+            writer: Optional Writer to write the tracks with, each album as a
+                separate directory. Defaults to a plain Writer.
+            warnings: Optional list to append string warnings to.
+            report_progress: Optional four argument function to report
+                progress, as described by Writer.write.
+
+        Returns:
+            A dictionary mapping each TagWriter.WriteMethod to the int number
+            of files written with it.
+        """
+        def write_track(song, _, regions):
+            """Writes a track's tags in place"""
+            return TagWriter.write_tags(song, padding, regions)
+
+        def predict_method(song, regions):
+            """Predicts how a track's tags will be written"""
+            return TagWriter.predict_write_method(song, regions=regions)
+
+        directories = ([(song, None) for song in self.collection[artist][album]] \
+                       for artist in self.collection for album in self.collection[artist])
+        return (writer or Writer.Writer()).write(write_track, directories, self.file_count,
+                                                 warnings if warnings is not None else [],
+                                                 report_progress, None, predict_method)
+
+
+    def create_new_filesystem(self, new_path, padding=-1, hardlink=False,
+                              reflink=False, move=False, writer=None,
+                              warnings=None, report_progress=None):
         """Creates a collection starting from a root directory.
 
+        Each track is written with its finalised data in its tags (see
+        TagWriter.write_track_copy), leaving the original files untouched, or
+        moved there (see TagWriter.move_track). Files which fail to write are
+        skipped. Directories which already exist (e.g. from a resumed run) are
+        reused. When moving, tracks whose tags already hold their finalised
+        data are only renamed, without their files being read.
+
         Args:
-            new_path: The path to recursively search for the collection within.
+            new_path: The path to create the collection within.
+            padding: Optional int number of bytes of padding to give copied
+                ID3v2 tags, or -1 (the default) for the smart policy.
+            hardlink: Optional bool, True to hard link tracks whose tags are
+                already correct and reflink the rest, where supported.
+            reflink: Optional bool, True to reflink tracks where supported.
+            move: Optional bool, True to move tracks rather than copy them.
+            writer: Optional Writer to write the tracks with, each album
+                directory in turn. Defaults to a plain Writer.
+            warnings: Optional list to append string warnings to.
+            report_progress: Optional four argument function to report
+                progress, as described by Writer.write.
 
         Returns:
-            None
+            A dictionary mapping each TagWriter.WriteMethod to the int number
+            of files written with it.
         """
-        os.mkdir(new_path)
-        for artist in self.collection:
-            artist_subpath = '/%s' % (artist)
-            os.mkdir(new_path + artist_subpath)
-            for album in self.collection[artist]:
-                if self.collection[artist][album][0].final.year != 0:
-                    album_subpath = '/[%d] %s' % (self.collection[artist][album][0].final.year, album)
-                else:
-                    album_subpath = '/%s' % (album)
-                os.mkdir(new_path + artist_subpath + album_subpath)
-                for song in self.collection[artist][album]:
-                    song_subpath = '/%02d %s.mp3' % (song.final.track, song.final.title)
-                    create_new_file(song, new_path + artist_subpath + album_subpath + song_subpath)
+        def make_directory(path):
+            """Creates a directory, unless it already exists"""
+            if not os.path.isdir(path):
+                os.mkdir(path)
+
+        def write_track(song, target, regions):
+            """Writes a track to its new location"""
+            if move:
+                return TagWriter.move_track(song, target, padding, regions)
+            return TagWriter.write_track_copy(song, target, padding, hardlink, reflink,
+                                              regions)
+
+        def predict_method(song, regions):
+            """Predicts how a track will be written to its new location"""
+            return TagWriter.predict_write_method(song, not move, hardlink, reflink, move,
+                                                  regions)
+
+        def album_directories():
+            """Creates each album's directory, yielding the tracks to write"""
+            make_directory(new_path)
+            for artist in self.collection:
+                make_directory(new_path + '/%s' % (artist))
+                for album in self.collection[artist]:
+                    make_directory(new_path + self.get_album_subpath(artist, album))
+                    yield [(song, new_path + self.get_track_subpath(artist, album, song)) \
+                           for song in self.collection[artist][album]]
+
+        return (writer or Writer.Writer()).write(write_track, album_directories(),
+                                                 self.file_count,
+                                                 warnings if warnings is not None else [],
+                                                 report_progress,
+                                                 TagWriter.data_matches if move else None,
+                                                 predict_method)
@@ -1,16 +1,76 @@
 """Imports:
+    copy: copying the data parsed from tags to clean it
+    os: copying the audio between files and replacing files
+    tempfile: creating the files saved tracks are written to
     Levenshtein: calculating string similarity
     TrackData: data about each file
     ID3v1: parsing ID3v1 tag data from the file
     ID3v2: parsing ID3v2 tag data from the file
+    TagReader: reading the regions of the file containing tags
     FilePathParser: parsing path data from the file
 """
+import copy
+import os
+import tempfile
 import Levenshtein
 import TrackData
 import ID3v1
 import ID3v2
+import TagReader
 import FilePathParser
 
+# Byte size of each read when copying audio between files without sendfile.
+COPY_CHUNK_SIZE = 1 << 20
+
+
+def copy_file_range(src_handle, dst_handle, offset, size):
+    """Copies a range of bytes from one file to the end of another.
+
+    The bytes are never held in memory all at once. Where the platform
+    supports it they are copied by the kernel with sendfile, otherwise they
+    are copied in chunks of COPY_CHUNK_SIZE bytes.
+
+    Args:
+        src_handle: a file handle opened in a readable binary mode.
+        dst_handle: a file handle opened in a writable binary mode, positioned
+            at its end.
+        offset: int position in the source file of the first byte to copy.
+        size: int number of bytes to copy.
+
+    Returns:
+        None
+
+    Raises:
+        Exception: the source file ended before all bytes were copied.
+    """
+    if hasattr(os, 'sendfile'):
+        dst_handle.flush()
+        while size > 0:
+            sent = os.sendfile(dst_handle.fileno(), src_handle.fileno(), offset, size)
+            if sent == 0:
+                raise Exception("File truncated while copying")
+            offset += sent
+            size -= sent
+        dst_handle.seek(0, 2)
+        return
+    src_handle.seek(offset, 0)
+    while size > 0:
+        chunk = src_handle.read(min(size, COPY_CHUNK_SIZE))
+        if not chunk:
+            raise Exception("File truncated while copying")
+        dst_handle.write(chunk)
+        size -= len(chunk)
+
+
+def _clean_data(data):
+    """Returns a cleaned copy of TrackData parsed from a tag, or None if None"""
+    if data is None:
+        return None
+    cleaned = copy.copy(data)
+    cleaned.clean(False)
+    return cleaned
+
+
 class TrackFile(object):
     """Represents all data extracted from a file about a track.
 
@@ -23,6 +83,8 @@ class TrackFile(object):
         fp: TrackData extracted from the file path
         v1: TrackData extracted from the ID3v1 tag
         v2: TrackData extracted from the ID3v2 tag
+        raw_v1: TrackData extracted from the ID3v1 tag, before it was cleaned
+        raw_v2: TrackData extracted from the ID3v2 tag, before it was cleaned
         final: TrackData generated by combining all other TrackData fields
     """
     def __init__(self, file_path, cleaned_filename=""):
@@ -53,6 +115,8 @@ class TrackFile(object):
         self.fp = None
         self.v1 = None
         self.v2 = None
+        self.raw_v1 = None
+        self.raw_v2 = None
         self.final = None
 
 
@@ -67,12 +131,87 @@ class TrackFile(object):
     def load_all_data(self):
         """ Loads TrackData for the file from all available sources.
 
+        The file is opened only once, with both tags read from the buffers
+        returned by TagReader.
+
+        Returns:
+            None
+        """
+        self.load_tag_regions(TagReader.read_tag_regions(self.file_path))
+
+
+    def load_tag_regions(self, regions):
+        """ Loads TrackData for the file from already read tag regions.
+
+        This is equivalent to load_all_data, but leaves reading the file to the
+        caller.
+
+        Args:
+            regions: TagRegions read from this file.
+
+        Returns:
+            None
+        """
+        self.load_tag_data(ID3v1.parse_tag_data(regions.tail, clean=False),
+                           ID3v2.parse_tag_data(regions.head, regions.appended, clean=False))
+
+
+    def load_tag_data(self, v1, v2):
+        """ Loads TrackData for the file from already parsed tags.
+
+        The data is kept as parsed (see TagWriter.data_matches) and a cleaned
+        copy is used for everything else.
+
+        Args:
+            v1: uncleaned TrackData parsed from the file's ID3v1 tag, or None.
+            v2: uncleaned TrackData parsed from the file's ID3v2 tag, or None.
+
         Returns:
             None
         """
         self.fp = FilePathParser.read_file_path_data(self.file_path, self.cleaned_filename)
-        self.v1 = ID3v1.read_tag_data(self.file_path)
-        self.v2 = ID3v2.read_tag_data(self.file_path)
+        self.raw_v1 = v1
+        self.raw_v2 = v2
+        self.v1 = _clean_data(v1)
+        self.v2 = _clean_data(v2)
+
+
+    def get_indexed_data(self):
+        """ Returns the data loaded by load_all_data in a picklable form.
+
+        Returns:
+            A dictionary which may later be passed to set_indexed_data.
+        """
+        return {'cleaned_filename': self.cleaned_filename,
+                'fp': self.fp,
+                'v1': self.v1,
+                'v2': self.v2,
+                'raw_v1': self.raw_v1,
+                'raw_v2': self.raw_v2}
+
+
+    def set_indexed_data(self, indexed_data):
+        """ Restores data previously returned by get_indexed_data.
+
+        This has the same effect as calling load_all_data without reading the
+        file. The file path data is regenerated if the cleaned filename has
+        since changed (e.g. because other files were added to the folder).
+
+        Args:
+            indexed_data: dictionary returned by get_indexed_data for a file at
+                the same path.
+
+        Returns:
+            None
+        """
+        if indexed_data['cleaned_filename'] == self.cleaned_filename:
+            self.fp = indexed_data['fp']
+        else:
+            self.fp = FilePathParser.read_file_path_data(self.file_path, self.cleaned_filename)
+        self.v1 = indexed_data['v1']
+        self.v2 = indexed_data['v2']
+        self.raw_v1 = indexed_data['raw_v1']
+        self.raw_v2 = indexed_data['raw_v2']
 
 
     def finalise_data(self):
@@ -173,38 +312,45 @@ class TrackFile(object):
         self.finalised = True
 
 
-    def save(self, output_file_path):
+    def save(self, output_file_path, padding_size=500, regions=None):
         """Saves this file to an output location
 
+        The new tags are written around the audio, which is streamed from this
+        file so memory use does not depend on the size of the file. Any ID3v2
+        tags appended to the file are left out, their frames being folded into
+        the new tag at its start. The output is written to a temporary file
+        alongside it and then renamed into place, so it is never left
+        partially written.
+
         Args:
             output_file_path: string path to the output location. May be the
                 same location as the file to overwrite.
+            padding_size: Optional int number of bytes of padding to give the
+                ID3v2 tag.
+            regions: Optional TagRegions already read from this file. They are
+                read if not given.
 
         Returns:
             None
         """
-        def extract_track_data(file_path):
-            """Returns the actual MP3 data from a file, without tags
-
-            Args:
-                file_path: string path to the music file.
-
-            Returns:
-                A byte array of the track MP3 data
-            """
-            with open(file_path, "rb") as f:
-                v1_tag_size = ID3v1.calculate_tag_size(f)
-                v2_tag_size = ID3v2.calculate_tag_size(f)
-                track_data = f.read()
-                if v2_tag_size > 0:
-                    track_data = track_data[v1_tag_size:-v2_tag_size]
-                else:
-                    track_data = track_data[v1_tag_size:]
-                return track_data
-        track_data = extract_track_data(self.file_path)
-        id3v1_tag = ID3v1.create_tag_string(self.final)
-        id3v2_tag = ID3v2.create_tag_string(self.final, self.file_path)
-        with open(output_file_path, "wb") as f:
-            f.write(id3v2_tag + track_data + id3v1_tag)
-
-
+        if regions is None:
+            regions = TagReader.read_tag_regions(self.file_path)
+        id3v1_tag = ID3v1.create_tag_string(self.final, regions.tail)
+        id3v2_tag = ID3v2.create_tag_string(self.final, regions.head, padding_size,
+                                            regions.appended)
+        with open(self.file_path, "rb", 0) as f:
+            file_stat = os.fstat(f.fileno())
+            output_dir, output_name = os.path.split(os.path.abspath(output_file_path))
+            temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix='.' + output_name,
+                                                  dir=output_dir)
+            try:
+                with os.fdopen(temp_fd, "wb") as output:
+                    output.write(id3v2_tag)
+                    for offset, size in TagReader.audio_ranges(regions):
+                        copy_file_range(f, output, offset, size)
+                    output.write(id3v1_tag)
+                os.chmod(temp_path, file_stat.st_mode & 0o7777)
+                os.rename(temp_path, output_file_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
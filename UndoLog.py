@@ -0,0 +1,315 @@
+"""Imports:
+    os: restoring files' tags and names
+    struct: framing the records of the log
+    tempfile: creating the files tracks are restored to when rewritten
+    zlib: compressing and checksumming the records of the log
+    cPickle: serialising the records of the log
+    ID3v1: sizing ID3v1 tags
+    ID3v2: sizing ID3v2 tags
+    TagReader: reading the tags of files being restored
+    TrackFile: copying audio between files
+"""
+import os
+import struct
+import tempfile
+import zlib
+import cPickle
+import ID3v1
+import ID3v2
+import TagReader
+import TrackFile
+
+UNDO_LOG_FILENAME = '.music_tagger_undo.log'
+# Start of every undo log. Change this whenever the format of the log changes
+# so logs in another format are refused.
+_LOG_HEADER = 'music_tagger undo log 2\n'
+# Format of the header of each record in the log: the byte size and CRC-32 of
+# its compressed data.
+_RECORD_HEADER = struct.Struct('>II')
+
+
+def _copy_audio(src_handle, dst_handle, audio_ranges, size):
+    """Copies bytes from the start of a list of ranges of a file, consuming them.
+
+    Args:
+        src_handle: a file handle opened in a readable binary mode.
+        dst_handle: a file handle opened in a writable binary mode, positioned
+            at its end.
+        audio_ranges: list of (offset, size) tuples of the ranges of the source
+            file still to copy, as returned by TagReader.audio_ranges. The
+            copied bytes are removed from it.
+        size: int number of bytes to copy. Fewer are copied if the ranges run
+            out.
+
+    Returns:
+        None
+    """
+    while size > 0 and audio_ranges:
+        offset, range_size = audio_ranges.pop(0)
+        if range_size > size:
+            audio_ranges.insert(0, (offset + size, range_size - size))
+            range_size = size
+        TrackFile.copy_file_range(src_handle, dst_handle, offset, range_size)
+        size -= range_size
+
+
+def _read_records(f):
+    """Reads the records of an undo log up to the first incomplete one.
+
+    Args:
+        f: file handle opened in a readable binary mode, positioned just after
+            the log's header.
+
+    Returns:
+        A tuple of the list of records read, as recorded by UndoLog.record,
+        and the int offset in the log of the end of the last of them. This is
+        the end of the log unless it ends with a record which is incomplete
+        or corrupt (e.g. torn by a crash while being appended).
+    """
+    records = []
+    end = f.tell()
+    while True:
+        header = f.read(_RECORD_HEADER.size)
+        if len(header) < _RECORD_HEADER.size:
+            break
+        size, checksum = _RECORD_HEADER.unpack(header)
+        data = f.read(size)
+        if len(data) < size or zlib.crc32(data) & 0xFFFFFFFF != checksum:
+            break
+        try:
+            records.append(cPickle.loads(zlib.decompress(data)))
+        except (zlib.error, cPickle.UnpicklingError, EOFError, ValueError):
+            break
+        end = f.tell()
+    return records, end
+
+
+def _restore_tags(file_path, head_tag, tail_tag, appended_tags):
+    """Replaces the tags of a file with the given ones.
+
+    When the file's ID3v2 tag is the same size as the one being restored (as
+    it is after a patch) and there are no appended tags to restore, only the
+    tag regions are written. Otherwise (after a rewrite) the file is rewritten
+    around its audio, as TrackFile.save does, with the appended tags put back
+    where they were.
+
+    Args:
+        file_path: string path to the file.
+        head_tag: string of bytes of the ID3v2 tag to restore, or an empty
+            string for none.
+        tail_tag: string of bytes of the ID3v1 tag (including any extended
+            tag) to restore, or an empty string for none.
+        appended_tags: list of (offset, tag_data) tuples of the position in
+            the original file and string of bytes of each ID3v2 tag appended
+            to it to restore, in file order.
+
+    Returns:
+        True if the file was changed, False if it already had exactly these
+        tags.
+    """
+    regions = TagReader.read_tag_regions(file_path)
+    v2_tag_size = ID3v2.read_tag_size(regions.head)
+    v1_tag_size = ID3v1.read_tag_size(regions.tail)
+    if regions.head[:v2_tag_size] == head_tag and \
+       regions.tail[len(regions.tail) - v1_tag_size:] == tail_tag and \
+       zip(regions.appended_offsets, regions.appended) == appended_tags:
+        return False
+    audio_ranges = TagReader.audio_ranges(regions)
+    if v2_tag_size != len(head_tag) or regions.appended or appended_tags:
+        with open(file_path, "rb", 0) as f:
+            file_stat = os.fstat(f.fileno())
+            output_dir, output_name = os.path.split(os.path.abspath(file_path))
+            temp_fd, temp_path = tempfile.mkstemp(suffix='.tmp', prefix='.' + output_name,
+                                                  dir=output_dir)
+            try:
+                with os.fdopen(temp_fd, "wb") as output:
+                    output.write(head_tag)
+                    position = len(head_tag)
+                    for tag_start, tag_data in appended_tags:
+                        _copy_audio(f, output, audio_ranges, tag_start - position)
+                        output.write(tag_data)
+                        position = tag_start + len(tag_data)
+                    _copy_audio(f, output, audio_ranges,
+                                sum(size for _, size in audio_ranges))
+                    output.write(tail_tag)
+                os.chmod(temp_path, file_stat.st_mode & 0o7777)
+                os.rename(temp_path, file_path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        return True
+    audio_end = sum(audio_ranges[-1]) if audio_ranges else v2_tag_size
+    with open(file_path, "r+b", 0) as f:
+        f.write(head_tag)
+        f.seek(audio_end, 0)
+        f.truncate()
+        f.write(tail_tag)
+    return True
+
+
+class UndoLog(object):
+    """An append-only log of the original tags of written files.
+
+    Before a file is written its original ID3v2 tag, any ID3v2 tags appended
+    to it and its ID3v1 tag (including any extended tag) are appended to the
+    log with its original and new paths, and flushed to disk before the write
+    starts. Only the tags are kept, so the log costs a few kilobytes per file
+    rather than a copy of it. Each record is compressed and checksummed on its
+    own, so a record torn by a crash is detected (and dropped when the log is
+    next opened) without losing any other.
+
+    Attributes:
+        log_path: string path to the log.
+        record_count: int number of records appended since the log was opened.
+    """
+    def __init__(self, log_path):
+        """Opens (creating if necessary) the log for appending.
+
+        Any incomplete record left at the end of the log by an interrupted
+        run is removed first.
+
+        Args:
+            log_path: string path to the log.
+
+        Returns:
+            The initialised UndoLog object.
+
+        Raises:
+            Exception: the file is not an undo log in this format.
+        """
+        self.log_path = log_path
+        self.record_count = 0
+        self._file = os.fdopen(os.open(log_path, os.O_RDWR | os.O_CREAT, 0o666), 'r+b')
+        header = self._file.read(len(_LOG_HEADER))
+        if not header:
+            self._file.seek(0, 0)
+            self._file.write(_LOG_HEADER)
+        elif header != _LOG_HEADER:
+            self._file.close()
+            raise Exception("%s is not an undo log of this version." % (log_path))
+        else:
+            _, end = _read_records(self._file)
+            self._file.seek(end, 0)
+            self._file.truncate()
+
+
+    def record(self, source, target, regions):
+        """Appends the original tags of a file which is about to be written.
+
+        Args:
+            source: string path to the file before it is written.
+            target: string path to the file once written, which may be the
+                same.
+            regions: TagRegions read from the file before it is written, or
+                None if it is only being renamed, leaving its tags alone.
+
+        Returns:
+            None
+        """
+        if regions is None:
+            record = (source, target, None, None, [])
+        else:
+            v1_tag_size = ID3v1.read_tag_size(regions.tail)
+            record = (source, target, regions.head[:ID3v2.read_tag_size(regions.head)],
+                      regions.tail[len(regions.tail) - v1_tag_size:],
+                      zip(regions.appended_offsets, regions.appended))
+        data = zlib.compress(cPickle.dumps(record, cPickle.HIGHEST_PROTOCOL))
+        self._file.write(_RECORD_HEADER.pack(len(data), zlib.crc32(data) & 0xFFFFFFFF) + data)
+        self.record_count += 1
+
+
+    def flush(self):
+        """Flushes all records appended so far to disk.
+
+        Returns:
+            None
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+
+    def close(self):
+        """Flushes and closes the log.
+
+        Returns:
+            None
+        """
+        self.flush()
+        self._file.close()
+
+
+def read_records(log_path, warnings):
+    """Reads every record from an undo log, in the order they were appended.
+
+    A log which ends with an incomplete record (e.g. torn by a crash) is read
+    up to that record.
+
+    Args:
+        log_path: string path to the log.
+        warnings: list to append string warnings to.
+
+    Returns:
+        A list of (source, target, head_tag, tail_tag, appended_tags) tuples,
+        as recorded by UndoLog.record, where head_tag and tail_tag are None
+        for files which were only renamed.
+    """
+    with open(log_path, 'rb') as f:
+        if f.read(len(_LOG_HEADER)) != _LOG_HEADER:
+            warnings.append('%s is not an undo log of this version' % (log_path))
+            return []
+        records, end = _read_records(f)
+        f.seek(0, 2)
+        if end != f.tell():
+            warnings.append('Undo log %s is truncated after %d record(s)' \
+                            % (log_path, len(records)))
+    return records
+
+
+def undo(log_path, warnings, report_progress=None):
+    """Restores the tags and names of every file recorded in an undo log.
+
+    Records are undone newest first, so a file written by several runs ends
+    up as it was before the first. Each file has its original tags restored
+    where it now is (see _restore_tags), unless it was only renamed, and is
+    then moved back to its original path. As records are made before each
+    write, files which were never written (e.g. still at their original path,
+    or still holding their original tags) are left alone. Files which are
+    missing, or whose original path is now taken by another file, are skipped
+    with a warning.
+
+    Args:
+        log_path: string path to the log.
+        warnings: list to append string warnings to.
+        report_progress: Optional two argument function to report progress
+            where the first argument is the total number of items and the
+            second argument is the completed number of items.
+
+    Returns:
+        int number of files restored.
+    """
+    records = read_records(log_path, warnings)
+    restored_count = 0
+    for done_count, (source, target, head_tag, tail_tag, appended_tags) \
+            in enumerate(reversed(records), 1):
+        try:
+            if target != source and not os.path.lexists(target) and \
+               os.path.exists(source):
+                # The file was never moved.
+                pass
+            elif not os.path.exists(target):
+                raise Exception("file no longer exists")
+            elif target != source and os.path.lexists(source):
+                raise Exception("%s already exists" % (source))
+            else:
+                changed = head_tag is not None and \
+                          _restore_tags(target, head_tag, tail_tag, appended_tags)
+                if target != source:
+                    os.rename(target, source)
+                    changed = True
+                if changed:
+                    restored_count += 1
+        except Exception as e: # pylint: disable=broad-except
+            warnings.append('Failed to undo %s: %s' % (source, e))
+        if report_progress:
+            report_progress(len(records), done_count)
+    return restored_count
@@ -0,0 +1,304 @@
+"""Imports:
+    os: reading inotify events and stat-ing files
+    select: waiting for inotify events with a timeout
+    struct: decoding inotify events
+    time: debouncing changes
+    ctypes: calling the inotify functions in the C library
+    Crawler: listing the directory trees to watch
+"""
+import os
+import select
+import struct
+import time
+import ctypes
+import ctypes.util
+import Crawler
+
+DEFAULT_SETTLE_SECONDS = 5.0
+DEFAULT_POLL_SECONDS = 60.0
+
+# inotify constants, from <sys/inotify.h>.
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_FROM = 0x00000040
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ONLYDIR = 0x01000000
+_IN_ISDIR = 0x40000000
+_IN_CLOEXEC = 0x00080000
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE | \
+              _IN_DELETE | _IN_DELETE_SELF | _IN_ONLYDIR
+# struct inotify_event { int wd; uint32_t mask, cookie, len; char name[]; }
+_EVENT_STRUCT = struct.Struct('=iIII')
+
+try:
+    _LIBC = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _LIBC.inotify_init1
+    _LIBC.inotify_add_watch
+    _LIBC.inotify_rm_watch
+except (OSError, AttributeError):
+    _LIBC = None
+
+
+class _InotifyMonitor(object):
+    """Reports changed directories using the Linux inotify API.
+
+    Attributes:
+        watches: dictionary mapping int watch descriptors to the string path of
+            the directory they watch.
+    """
+    def __init__(self, root):
+        """Starts watching every directory in a tree.
+
+        Args:
+            root: string path to the root of the tree to watch.
+
+        Raises:
+            OSError: inotify is unavailable or the tree could not be watched
+                (e.g. the limit on the number of watches has been reached).
+        """
+        if _LIBC is None:
+            raise OSError("inotify is not available")
+        self.watches = {}
+        self._fd = _LIBC.inotify_init1(_IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        try:
+            self.add_tree(root)
+        except OSError:
+            self.close()
+            raise
+
+    def add_tree(self, root):
+        """Watches every directory in a tree.
+
+        Args:
+            root: string path to the root of the tree to watch.
+
+        Returns:
+            A list of string paths to the directories now watched.
+        """
+        dirnames = []
+        for dirname, _ in Crawler.Crawler(root):
+            wd = _LIBC.inotify_add_watch(self._fd, dirname, _WATCH_MASK)
+            if wd < 0:
+                raise OSError(ctypes.get_errno(), "inotify_add_watch failed on "
+                              "'%s'" % (dirname))
+            self.watches[wd] = dirname
+            dirnames.append(dirname)
+        return dirnames
+
+    def remove_tree(self, root):
+        """Stops watching every directory in a tree.
+
+        Args:
+            root: string path to the root of the tree to stop watching.
+
+        Returns:
+            A list of string paths to the directories no longer watched.
+        """
+        dirnames = []
+        for wd, dirname in self.watches.items():
+            if dirname == root or dirname.startswith(root + os.sep):
+                _LIBC.inotify_rm_watch(self._fd, wd)
+                del self.watches[wd]
+                dirnames.append(dirname)
+        return dirnames
+
+    def read_changes(self, timeout):
+        """Waits for changes to the watched directories.
+
+        Args:
+            timeout: float maximum number of seconds to wait, or None to wait
+                until a change happens.
+
+        Returns:
+            A set of string paths to the directories which have changed. May be
+            empty if the timeout expired.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+        changed = set()
+        data = os.read(self._fd, 64 * 1024)
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, name_length = _EVENT_STRUCT.unpack_from(data, offset)
+            offset += _EVENT_STRUCT.size
+            name = data[offset:offset+name_length].rstrip('\0')
+            offset += name_length
+            if mask & _IN_Q_OVERFLOW:
+                # Events have been lost, assume everything has changed.
+                changed.update(self.watches.values())
+                continue
+            dirname = self.watches.get(wd)
+            if dirname is None:
+                continue
+            if mask & _IN_IGNORED:
+                # The directory has gone (it will also have sent DELETE_SELF).
+                del self.watches[wd]
+            elif mask & _IN_DELETE_SELF:
+                changed.add(dirname)
+            elif mask & _IN_ISDIR:
+                # A subdirectory has appeared or disappeared. Its tracks (and
+                # those of its own subdirectories) must all be re-indexed.
+                subdirname = os.path.join(dirname, name)
+                if mask & _IN_MOVED_FROM:
+                    changed.update(self.remove_tree(subdirname))
+                elif mask & (_IN_MOVED_TO | _IN_CREATE):
+                    changed.update(self.add_tree(subdirname))
+            else:
+                changed.add(dirname)
+        return changed
+
+    def close(self):
+        """Stops watching all directories.
+
+        Returns:
+            None
+        """
+        os.close(self._fd)
+
+
+class _PollingMonitor(object):
+    """Reports changed directories by periodically re-listing the tree.
+
+    Attributes:
+        root: string path to the root of the tree being watched.
+        poll_seconds: float number of seconds between each listing.
+        snapshot: dictionary mapping string directory paths to a frozenset of
+            (filename, size, mtime) tuples for each of its files.
+    """
+    def __init__(self, root, poll_seconds):
+        """Takes the initial listing of the tree.
+
+        Args:
+            root: string path to the root of the tree to watch.
+            poll_seconds: float number of seconds between each listing.
+        """
+        self.root = root
+        self.poll_seconds = poll_seconds
+        self.snapshot = self.__take_snapshot()
+        self._next_poll = time.time() + poll_seconds
+
+    def __take_snapshot(self):
+        """Lists and stats every file in the tree.
+
+        Returns:
+            A snapshot dictionary, as described by the snapshot attribute.
+        """
+        snapshot = {}
+        for dirname, filenames in Crawler.Crawler(self.root):
+            entries = []
+            for filename in filenames:
+                try:
+                    stat = os.stat(os.path.join(dirname, filename))
+                except OSError:
+                    continue
+                entries.append((filename, stat.st_size, stat.st_mtime))
+            snapshot[dirname] = frozenset(entries)
+        return snapshot
+
+    def read_changes(self, timeout):
+        """Waits for changes to the watched directories.
+
+        Args:
+            timeout: float maximum number of seconds to wait, or None to wait
+                until a change happens.
+
+        Returns:
+            A set of string paths to the directories which have changed. May be
+            empty if the timeout expired.
+        """
+        while True:
+            wait = max(0.0, self._next_poll - time.time())
+            if timeout is not None and timeout < wait:
+                time.sleep(timeout)
+                return set()
+            time.sleep(wait)
+            self._next_poll = time.time() + self.poll_seconds
+            snapshot = self.__take_snapshot()
+            changed = set(dirname for dirname in set(snapshot) | set(self.snapshot) \
+                          if snapshot.get(dirname) != self.snapshot.get(dirname))
+            self.snapshot = snapshot
+            if changed or timeout is not None:
+                return changed
+
+    def close(self):
+        """Stops watching all directories.
+
+        Returns:
+            None
+        """
+        pass
+
+
+class Watcher(object):
+    """Watches a directory tree for changes to its files.
+
+    Iterating over a Watcher blocks until files have changed and then yields
+    the set of directories containing them. Changes are debounced: a directory
+    is only yielded once no further changes have been seen in it for the settle
+    time, so copying an album of many tracks yields its directory once rather
+    than once per track.
+
+    Attributes:
+        root: string path to the root of the tree to watch.
+        settle_seconds: float number of seconds a directory must go without
+            changes before it is yielded.
+        method: string name of the method used to detect changes, either
+            'inotify' or 'polling' (used when inotify is unavailable).
+    """
+    def __init__(self, root, settle_seconds=DEFAULT_SETTLE_SECONDS,
+                 poll_seconds=DEFAULT_POLL_SECONDS):
+        """Creates the Watcher object and starts watching the tree.
+
+        Args:
+            root: string path to the root of the tree to watch.
+            settle_seconds: Optional float number of seconds a directory must
+                go without changes before it is yielded.
+            poll_seconds: Optional float number of seconds between each listing
+                of the tree when falling back to polling.
+
+        Returns:
+            The initialised Watcher object.
+        """
+        self.root = root
+        self.settle_seconds = settle_seconds
+        try:
+            self._monitor = _InotifyMonitor(root)
+            self.method = 'inotify'
+        except OSError:
+            self._monitor = _PollingMonitor(root, poll_seconds)
+            self.method = 'polling'
+
+
+    def __iter__(self):
+        """Watches the tree until the iteration is abandoned.
+
+        Yields:
+            A set of string paths to the directories which have changed.
+        """
+        # Maps each changed directory to the time of its latest change.
+        pending = {}
+        try:
+            while True:
+                if pending:
+                    timeout = max(0.0, min(pending.values()) + self.settle_seconds \
+                                       - time.time())
+                else:
+                    timeout = None
+                for dirname in self._monitor.read_changes(timeout):
+                    pending[dirname] = time.time()
+                now = time.time()
+                settled = set(dirname for dirname, changed_time in pending.iteritems() \
+                              if now - changed_time >= self.settle_seconds)
+                if settled:
+                    for dirname in settled:
+                        del pending[dirname]
+                    yield settled
+        finally:
+            self._monitor.close()
@@ -0,0 +1,458 @@
+"""Imports:
+    os: finding the size of the files written
+    sys: passing exceptions from worker threads to the writer
+    threading: writing several tracks concurrently
+    time: measuring the rate tracks are written
+    Queue: passing directories between the writer and its worker threads
+    TagWriter: enumerating the ways tracks may be written
+    TagReader: reading the original tags of tracks before they are written
+    ID3v1: sizing the tags patched
+    ID3v2: sizing the tags patched
+"""
+import os
+import sys
+import threading
+import time
+import Queue
+import TagWriter
+import TagReader
+import ID3v1
+import ID3v2
+
+
+def _file_size(file_path):
+    """Finds the size of a file, for budgeting and reporting its write.
+
+    Args:
+        file_path: string path to the file.
+
+    Returns:
+        int byte size of the file, or 0 if it cannot be found.
+    """
+    try:
+        return os.path.getsize(file_path)
+    except OSError:
+        return 0
+
+
+def _written_size(method, file_path, regions):
+    """Finds how many bytes writing a track wrote, for reporting its write.
+
+    Args:
+        method: TagWriter.WriteMethod the track was written with.
+        file_path: string path to the file written.
+        regions: TagRegions read from the track's file before it was written,
+            or None if they were not read.
+
+    Returns:
+        int byte size of the whole file if it was rewritten (or copied), of its
+        tags if they were patched (or cloned and patched), and 0 if it was
+        only linked, renamed or left unchanged.
+    """
+    if method is TagWriter.WriteMethod.rewritten:
+        return _file_size(file_path)
+    if method not in (TagWriter.WriteMethod.patched, TagWriter.WriteMethod.cloned):
+        return 0
+    # Patching keeps the size of the ID3v2 tag, so it can be read from either.
+    head_data = regions.head if regions is not None else ''
+    if not head_data:
+        try:
+            with open(file_path, 'rb', 0) as f:
+                head_data = f.read(ID3v2.TAG_HEADER_SIZE)
+        except IOError:
+            return 0
+    return ID3v2.read_tag_size(head_data) + ID3v1.TAG_SIZE
+
+
+class Writer(object):
+    """Writes the tracks of each destination directory one track at a time.
+
+    Tracks are written by a function (e.g. TagWriter.write_tags) and, if given
+    a journal, through it: each directory's tracks are planned in the journal
+    before any of them is written, and their completions committed once all
+    of them have been. If given an undo log, the original tags of each track
+    are recorded (and flushed) in it before any of the directory is written.
+
+    Attributes:
+        journal: Journal to write tracks through, or None.
+        undo_log: UndoLog to record the original tags of tracks in, or None.
+        method_counts: dictionary mapping each TagWriter.WriteMethod to the int
+            number of tracks written with it by the most recent write.
+    """
+    def __init__(self, journal=None, undo_log=None):
+        """Creates the Writer object.
+
+        Args:
+            journal: Optional Journal to write tracks through.
+            undo_log: Optional UndoLog to record the original tags of tracks
+                in.
+
+        Returns:
+            The initialised Writer object.
+        """
+        self.journal = journal
+        self.undo_log = undo_log
+        self.method_counts = {}
+        self._start_time = 0.0
+        self._done_count = 0
+        self._done_bytes = 0
+
+
+    def _plan(self, jobs, warnings, rename_only=None):
+        """Plans a directory's tracks in the journal, skipping completed ones.
+
+        Each track is also recorded in the undo log. Tracks whose tags cannot
+        be read (to journal or log them) are skipped with a warning. Tracks
+        which will only be renamed have nothing read.
+
+        Args:
+            jobs: list of (track, target) tuples for the directory, as given
+                to write.
+            warnings: list to append string warnings to.
+            rename_only: Optional function taking a track and returning True
+                if writing it to its target will only rename its file, as
+                given to write.
+
+        Returns:
+            A list of (track, source, target, size, regions) tuples for each
+            track still to be written, where source is the string path to its
+            file (which write_track may move), size is the int number of bytes
+            writing it may copy (the byte size of the file, or 0 if it will
+            only be renamed) and regions are the TagRegions read from it before
+            it was written (or None with neither a journal nor an undo log, or
+            if it will only be renamed).
+        """
+        if self.journal is not None:
+            jobs = [(track, target) for track, target in jobs \
+                    if not self.journal.is_done(track.file_path)]
+        planned = []
+        for track, target in jobs:
+            regions = None
+            if target is not None and rename_only is not None and rename_only(track):
+                if self.journal is not None:
+                    self.journal.plan(track.file_path, target, rename_only=True)
+                if self.undo_log is not None:
+                    self.undo_log.record(track.file_path, target, None)
+                planned.append((track, track.file_path, target, 0, None))
+                continue
+            if self.journal is not None or self.undo_log is not None:
+                try:
+                    regions = TagReader.read_tag_regions(track.file_path)
+                except (IOError, OSError) as e:
+                    warnings.append('Failed to write %s: %s' % (track.file_path, e))
+                    continue
+            if self.journal is not None:
+                self.journal.plan(track.file_path, target, regions)
+            if self.undo_log is not None:
+                self.undo_log.record(track.file_path, target or track.file_path, regions)
+            planned.append((track, track.file_path, target,
+                            _file_size(track.file_path), regions))
+        self._commit()
+        return planned
+
+
+    def _commit(self):
+        """Commits the journal and flushes the undo log, where given.
+
+        Returns:
+            None
+        """
+        if self.journal is not None:
+            self.journal.commit()
+        if self.undo_log is not None:
+            self.undo_log.flush()
+
+
+    def _record(self, source, target, written_size, method, error, warnings):
+        """Records the outcome of writing a track.
+
+        Args:
+            source: string path to the track's file before it was written.
+            target: string path it was written to, or None if in place.
+            written_size: int number of bytes written (see _written_size).
+            method: TagWriter.WriteMethod it was written with, if successful.
+            error: exception raised writing it, or None if successful.
+            warnings: list to append string warnings to.
+
+        Returns:
+            None
+        """
+        self._done_count += 1
+        if error is not None:
+            warnings.append('Failed to write %s: %s' % (source, error))
+            return
+        self._done_bytes += written_size
+        self.method_counts[method] += 1
+        if self.journal is not None:
+            self.journal.complete(source, target or source, method)
+
+
+    def _report(self, total_count, report_progress):
+        """Reports the progress of the current write, if asked to.
+
+        Args:
+            total_count: int number of tracks being written in total.
+            report_progress: function taking the total number of tracks, the
+                number done, the number of bytes written to their files and the
+                number of seconds elapsed, or None.
+
+        Returns:
+            None
+        """
+        if report_progress:
+            report_progress(total_count, self._done_count, self._done_bytes,
+                            time.time() - self._start_time)
+
+
+    def write(self, write_track, directories, total_count, warnings, report_progress=None,
+              rename_only=None, predict_method=None):
+        """Writes the tracks of each destination directory in turn.
+
+        Tracks which fail to write are skipped with a warning.
+
+        Args:
+            write_track: three argument function writing the TrackFile given
+                as the first argument to the path given as the second (or in
+                place, if None) and returning the TagWriter.WriteMethod used.
+                The third argument is the TagRegions read from the track's
+                file when it was planned, or None if they were not read.
+            directories: iterable of lists of (track, target) tuples, one list
+                per destination directory, where target is the string path to
+                write track to, or None to write it in place.
+            total_count: int number of tracks in all the directories.
+            warnings: list to append string warnings to.
+            report_progress: Optional four argument function taking the total
+                number of tracks, the number written so far (or skipped), the
+                number of bytes written to their files (see _written_size) and
+                the number of seconds elapsed.
+            rename_only: Optional function taking a track and returning True
+                if writing it to its target will only rename its file (e.g.
+                TagWriter.data_matches, when moving tracks). Nothing is read
+                from those tracks' files before they are written, and the
+                journal and undo log record only their names.
+            predict_method: Optional function taking a track and the
+                TagRegions read from its file and returning the
+                TagWriter.WriteMethod write_track is expected to use (e.g. by
+                TagWriter.predict_write_method). Unused here, but see
+                ThreadedWriter.write.
+
+        Returns:
+            A dictionary mapping each TagWriter.WriteMethod to the int number
+            of tracks written with it.
+        """
+        self.method_counts = dict((method, 0) for method in TagWriter.WriteMethod)
+        self._start_time = time.time()
+        self._done_count = 0
+        self._done_bytes = 0
+        for jobs in directories:
+            planned = self._plan(jobs, warnings, rename_only)
+            self._done_count += len(jobs) - len(planned)
+            for track, source, target, _, regions in planned:
+                try:
+                    method = write_track(track, target, regions)
+                    written_size = _written_size(method, target or source, regions)
+                    error = None
+                except Exception as e: # pylint: disable=broad-except
+                    method = None
+                    written_size = 0
+                    error = e
+                self._record(source, target, written_size, method, error, warnings)
+                self._report(total_count, report_progress)
+            self._commit()
+            if not planned:
+                self._report(total_count, report_progress)
+        return self.method_counts
+
+
+class ThreadedWriter(Writer):
+    """Writes the tracks of many destination directories across a pool of
+    threads.
+
+    Each directory is handed whole to whichever thread is next free, which
+    writes its tracks in order, so each directory's entries are only ever
+    changed by one thread at a time while several directories are written at
+    once. A thread only starts copying a whole file (rewriting it, or copying
+    it to its target) while the total size of the files being copied stays
+    within a budget, so a few large files cannot crowd out the rest (or pile
+    up in the page cache). Tracks which are only patched, linked or renamed
+    are not charged to the budget. All access to the journal and undo log
+    stays on the calling thread.
+
+    Attributes:
+        journal: Journal to write tracks through, or None.
+        undo_log: UndoLog to record the original tags of tracks in, or None.
+        method_counts: dictionary mapping each TagWriter.WriteMethod to the int
+            number of tracks written with it by the most recent write.
+        thread_count: int number of threads to write tracks with.
+        max_bytes_in_flight: int maximum total byte size of the files being
+            copied at once. A single file larger than this is still copied,
+            alone.
+    """
+    def __init__(self, journal=None, undo_log=None, thread_count=1,
+                 max_bytes_in_flight=256 << 20):
+        """Creates the ThreadedWriter object.
+
+        Args:
+            journal: Optional Journal to write tracks through.
+            undo_log: Optional UndoLog to record the original tags of tracks
+                in.
+            thread_count: Optional int number of threads to write tracks with.
+            max_bytes_in_flight: Optional int maximum total byte size of the
+                files being copied at once. Defaults to 256 MiB.
+
+        Returns:
+            The initialised ThreadedWriter object.
+        """
+        super(ThreadedWriter, self).__init__(journal, undo_log)
+        if thread_count < 1:
+            raise Exception("Cannot create a %s with %d threads." \
+                            % (self.__class__.__name__, thread_count))
+        self.thread_count = thread_count
+        self.max_bytes_in_flight = max_bytes_in_flight
+
+
+    def write(self, write_track, directories, total_count, warnings, report_progress=None,
+              rename_only=None, predict_method=None):
+        """Writes the tracks of each destination directory.
+
+        Tracks which fail to write are skipped with a warning. Each directory's
+        completions are committed to the journal once all of its tracks have
+        been written, in whichever order the directories finish. At most two
+        directories per thread are planned ahead of being written.
+
+        Args:
+            write_track: three argument function writing a track, as described
+                by Writer.write. Called on the pool threads.
+            directories: iterable of lists of (track, target) tuples, one list
+                per destination directory, as described by Writer.write.
+            total_count: int number of tracks in all the directories.
+            warnings: list to append string warnings to.
+            report_progress: Optional four argument function to report progress,
+                as described by Writer.write.
+            rename_only: Optional function to find tracks which will only be
+                renamed, as described by Writer.write.
+            predict_method: Optional function predicting how each track will
+                be written, as described by Writer.write. Called on the pool
+                threads (after reading the track's tags, if they were not read
+                when it was planned) so only tracks expected to be rewritten
+                are charged to the byte budget. Without it every track which
+                is not only renamed is charged.
+
+        Returns:
+            A dictionary mapping each TagWriter.WriteMethod to the int number
+            of tracks written with it.
+
+        Raises:
+            Any exception other than an Exception raised writing a track (e.g.
+            a KeyboardInterrupt or MemoryError) on a pool thread, once the
+            remaining threads have stopped.
+        """
+        self.method_counts = dict((method, 0) for method in TagWriter.WriteMethod)
+        self._start_time = time.time()
+        self._done_count = 0
+        self._done_bytes = 0
+        # Whole directories are queued, so a directory's tracks are written in
+        # order by the same thread.
+        pending = Queue.Queue()
+        results = Queue.Queue()
+        stopping = threading.Event()
+        budget = threading.Condition()
+        bytes_in_flight = [0]
+
+        def write_job(track, source, target, size, regions):
+            """Writes a track once the byte budget allows it, returning the
+            method used and the number of bytes written"""
+            if size and predict_method is not None:
+                if regions is None:
+                    regions = TagReader.read_tag_regions(source)
+                if predict_method(track, regions) is not TagWriter.WriteMethod.rewritten:
+                    size = 0
+            with budget:
+                while bytes_in_flight[0] > 0 and \
+                      bytes_in_flight[0] + size > self.max_bytes_in_flight:
+                    budget.wait()
+                bytes_in_flight[0] += size
+            try:
+                method = write_track(track, target, regions)
+            finally:
+                with budget:
+                    bytes_in_flight[0] -= size
+                    budget.notify_all()
+            return method, _written_size(method, target or source, regions)
+
+        def worker():
+            """Writes directories from the pending queue until told to stop"""
+            try:
+                while True:
+                    job = pending.get()
+                    if job is None:
+                        return
+                    directory_number, planned = job
+                    for track, source, target, size, regions in planned:
+                        if stopping.is_set():
+                            return
+                        try:
+                            method, written_size = write_job(track, source, target, size,
+                                                             regions)
+                            error = None
+                        except Exception as e: # pylint: disable=broad-except
+                            method = None
+                            written_size = 0
+                            error = e
+                        results.put((directory_number, source, target, written_size,
+                                     method, error))
+            except BaseException:
+                # Hand anything else to the calling thread, which would
+                # otherwise wait forever for this thread's results.
+                results.put((None, sys.exc_info()))
+
+        threads = [threading.Thread(target=worker) for _ in range(self.thread_count)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        # Maps the number of each directory in flight to the number of its
+        # tracks still being written.
+        in_flight = {}
+
+        def collect_result():
+            """Waits for a single track to be written and records it"""
+            result = results.get()
+            if result[0] is None:
+                exc_type, exc_value, exc_traceback = result[1]
+                raise exc_type, exc_value, exc_traceback
+            directory_number, source, target, written_size, method, error = result
+            self._record(source, target, written_size, method, error, warnings)
+            in_flight[directory_number] -= 1
+            if in_flight[directory_number] == 0:
+                del in_flight[directory_number]
+                self._commit()
+            self._report(total_count, report_progress)
+
+        try:
+            for directory_number, jobs in enumerate(directories):
+                planned = self._plan(jobs, warnings, rename_only)
+                self._done_count += len(jobs) - len(planned)
+                if not planned:
+                    self._report(total_count, report_progress)
+                    continue
+                in_flight[directory_number] = len(planned)
+                pending.put((directory_number, planned))
+                while len(in_flight) > 2 * self.thread_count:
+                    collect_result()
+            while in_flight:
+                collect_result()
+        finally:
+            # Abandon any queued or partly written directories, then wait for
+            # the threads to stop.
+            stopping.set()
+            try:
+                while True:
+                    pending.get_nowait()
+            except Queue.Empty:
+                pass
+            for _ in threads:
+                pending.put(None)
+            for thread in threads:
+                thread.join()
+        return self.method_counts
@@ -0,0 +1,283 @@
+#!/usr/bin/python
+
+#-----------------------------------------------------------------------#
+#----------------------------    LICENSE    ----------------------------#
+#-----------------------------------------------------------------------#
+# This file is part of the music_tagger program                         #
+# (https://github.com/jonsim/music_tagger).                             #
+#                                                                       #
+# music_tagger is free software: you can redistribute it and/or modify  #
+# it under the terms of the GNU General Public License as published by  #
+# the Free Software Foundation, either version 3 of the License, or     #
+# (at your option) any later version.                                   #
+#                                                                       #
+# music_tagger is distributed in the hope that it will be useful,       #
+# but WITHOUT ANY WARRANTY; without even the implied warranty of        #
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         #
+# GNU General Public License for more details.                          #
+#                                                                       #
+# You should have received a copy of the GNU General Public License     #
+# along with music_tagger.  If not, see <http://www.gnu.org/licenses/>. #
+#-----------------------------------------------------------------------#
+
+
+#-----------------------------------------------------------------------#
+#----------------------------     ABOUT     ----------------------------#
+#-----------------------------------------------------------------------#
+# Microbenchmarks of the tag parsing code. Each benchmark times the     #
+# current implementation against a baseline on synthetic tags and       #
+# prints the rate of each.                                              #
+# Author: Jonathan Simmonds                                             #
+#-----------------------------------------------------------------------#
+
+
+#-----------------------------------------------------------------------#
+#----------------------------    IMPORTS    ----------------------------#
+#-----------------------------------------------------------------------#
+"""Imports:
+    argparse: parsing command line arguments
+    random: filling binary frames of synthetic tags
+    struct: building synthetic tags
+    timeit: timing each implementation
+    cStringIO: feeding tags to the file handle based baseline parser
+    ID3v2: the tag parser being benchmarked
+"""
+import argparse
+import random
+import struct
+import timeit
+import cStringIO
+import ID3v2
+
+
+
+#-----------------------------------------------------------------------#
+#----------------------------   BASELINES   ----------------------------#
+#-----------------------------------------------------------------------#
+def _baseline_read_32bit_nonsyncsafe(byte_data):
+    """Reads a 32-bit integer as the original frame parser did"""
+    int_bytes = [ord(b) for b in byte_data]
+    return (int_bytes[0] << 24) + (int_bytes[1] << 16) \
+         + (int_bytes[2] << 8) + (int_bytes[3])
+
+
+def _baseline_read_16bit_nonsyncsafe(byte_data):
+    """Reads a 16-bit integer as the original frame parser did"""
+    int_bytes = [ord(b) for b in byte_data]
+    return (int_bytes[0] << 8) + (int_bytes[1])
+
+
+class _BaselineFrameHeader(object):
+    """ID3v2.3 frame header as parsed by the original frame parser, which
+    built one object (and flags dictionary) per frame"""
+    def __init__(self, header_data, offset):
+        self.body_offset = offset
+        self.id = header_data[:4]
+        self.body_size = _baseline_read_32bit_nonsyncsafe(header_data[4:8])
+        flag_int = _baseline_read_16bit_nonsyncsafe(header_data[8:10])
+        self.flags = {}
+        self.flags['tag_alter_preservation'] = flag_int & 0x8000
+        self.flags['file_alter_preservation'] = flag_int & 0x4000
+        self.flags['read_only'] = flag_int & 0x2000
+        self.flags['compression'] = flag_int & 0x0080
+        self.flags['encryption'] = flag_int & 0x0040
+        self.flags['grouping_identity'] = flag_int & 0x0020
+        if not (self.id[0] in ID3v2._EXPERIMENTAL_FRAME_ID_PREFIXS or \
+                self.id in ID3v2._V23_FRAME_IDS):
+            raise Exception("Unknown ID3v2.3 Frame ID '%s'" % (self.id))
+
+
+def _baseline_parse_frames(tag_data):
+    """Walks the frames of an ID3v2.3 tag as the original frame parser did,
+    reading each header from a file handle and seeking past each body.
+
+    Args:
+        tag_data: character array of bytes of the tag.
+
+    Returns:
+        dictionary mapping each frame id to its _BaselineFrameHeader.
+    """
+    file_handle = cStringIO.StringIO(tag_data)
+    header = ID3v2._TagHeader(file_handle.read(10))
+    total_size = header.header_size + header.body_size
+    frames = {}
+    while file_handle.tell() < total_size:
+        fheader_data = file_handle.read(10)
+        if fheader_data[0] == '\0':
+            break
+        frame = _BaselineFrameHeader(fheader_data, file_handle.tell())
+        frames[frame.id] = frame
+        file_handle.seek(frame.body_size, 1)
+    return frames
+
+
+def _baseline_deunsynchronise(data):
+    """Reverses unsynchronisation a byte at a time, as a manual fix would"""
+    output = []
+    previous = None
+    for byte in data:
+        if not (previous == '\xFF' and byte == '\x00'):
+            output.append(byte)
+        previous = byte
+    return ''.join(output)
+
+
+
+#-----------------------------------------------------------------------#
+#----------------------------   SYNTHETIC   ----------------------------#
+#-----------------------------------------------------------------------#
+def _syncsafe_string(size):
+    """Encodes an int as a 32-bit syncsafe integer string"""
+    return ''.join(chr((size >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+
+
+def create_tag(frame_count, padding_size=1000, binary_size=0, unsynchronise=False):
+    """Creates an ID3v2.3 tag with the given number of text frames.
+
+    Args:
+        frame_count: int number of frames to put in the tag.
+        padding_size: Optional int number of bytes of padding after the frames.
+        binary_size: Optional int number of bytes of random binary data (as
+            embedded album art would be) to add in a final PRIV frame, if any.
+        unsynchronise: Optional bool, True to unsynchronise the tag.
+
+    Returns:
+        A string of bytes of the tag.
+    """
+    frame_ids = [frame_id for frame_id in ID3v2._V23_FRAME_IDS if frame_id[0] == 'T']
+    frames = ''
+    for i in range(frame_count):
+        # Repeated ids would collapse together, so make each unique.
+        frame_id = frame_ids[i] if i < len(frame_ids) else 'X%03d' % (i)
+        body = '\0' + ('Frame %d text ' % (i)) * 4
+        frames += frame_id + struct.pack('>IH', len(body), 0) + body
+    if binary_size:
+        generator = random.Random(binary_size)
+        body = 'benchmark\0' + ''.join(chr(generator.randint(0, 255)) \
+                                       for _ in range(binary_size))
+        frames += 'PRIV' + struct.pack('>IH', len(body), 0) + body
+    flags = 0
+    if unsynchronise:
+        # Following every 0xFF with a null byte is a valid (if not minimal)
+        # unsynchronisation.
+        frames = frames.replace('\xFF', '\xFF\x00')
+        flags |= 0x80
+    frames += '\0' * padding_size
+    return 'ID3' + chr(3) + chr(0) + chr(flags) + _syncsafe_string(len(frames)) + frames
+
+
+
+#-----------------------------------------------------------------------#
+#----------------------------  BENCHMARKS   ----------------------------#
+#-----------------------------------------------------------------------#
+def _time(function, repeat, number=1000):
+    """Times a function, returning its best time per call in seconds"""
+    timer = timeit.Timer(function)
+    return min(timer.repeat(repeat, number)) / number
+
+
+def _print_result(name, units, unit_name, seconds, baseline_seconds):
+    """Prints the rate of an implementation and its speedup over a baseline"""
+    print "  %-24s %12.0f %s/s  (%.2fx)" % (name, units / seconds, unit_name,
+                                           baseline_seconds / seconds)
+
+
+def benchmark_frames(args):
+    """Times walking the frame headers of a tag.
+
+    Args:
+        args: parsed command line arguments.
+
+    Returns:
+        None
+    """
+    tag_data = create_tag(args.frames)
+    frame_end = len(tag_data)
+    assert len(_baseline_parse_frames(tag_data)) == args.frames
+    assert len(ID3v2._Tag(tag_data).frames) == args.frames
+
+    def iterate():
+        """Walks the frames without building a tag"""
+        for _ in ID3v2._iter_frames(tag_data, 3, ID3v2.TAG_HEADER_SIZE, frame_end):
+            pass
+
+    print "Frame parsing (ID3v2.3 tag with %d frames):" % (args.frames)
+    baseline_seconds = _time(lambda: _baseline_parse_frames(tag_data), args.repeat)
+    _print_result('baseline _Tag', args.frames, 'frames', baseline_seconds,
+                  baseline_seconds)
+    _print_result('_Tag', args.frames, 'frames',
+                  _time(lambda: ID3v2._Tag(tag_data), args.repeat), baseline_seconds)
+    _print_result('_iter_frames', args.frames, 'frames',
+                  _time(iterate, args.repeat), baseline_seconds)
+
+
+def benchmark_unsync(args):
+    """Times de-unsynchronising tags, and parsing tags with and without it.
+
+    Args:
+        args: parsed command line arguments.
+
+    Returns:
+        None
+    """
+    plain_data = create_tag(args.frames, binary_size=args.binary_size)
+    unsynced_data = create_tag(args.frames, binary_size=args.binary_size,
+                               unsynchronise=True)
+    unsynced_body = unsynced_data[ID3v2.TAG_HEADER_SIZE:]
+    assert ID3v2._deunsynchronise(unsynced_body) == plain_data[ID3v2.TAG_HEADER_SIZE:]
+    assert _baseline_deunsynchronise(unsynced_body) == plain_data[ID3v2.TAG_HEADER_SIZE:]
+    assert ID3v2._Tag(unsynced_data).data[ID3v2.TAG_HEADER_SIZE:] == \
+        plain_data[ID3v2.TAG_HEADER_SIZE:]
+    megabytes = len(unsynced_data) / float(1 << 20)
+
+    print "De-unsynchronisation (ID3v2.3 tag with %d frames and %d binary bytes):" \
+        % (args.frames, args.binary_size)
+    baseline_seconds = _time(lambda: _baseline_deunsynchronise(unsynced_body),
+                             args.repeat, 10)
+    _print_result('baseline byte loop', megabytes, 'MB', baseline_seconds,
+                  baseline_seconds)
+    _print_result('_deunsynchronise', megabytes, 'MB',
+                  _time(lambda: ID3v2._deunsynchronise(unsynced_body), args.repeat),
+                  baseline_seconds)
+    print "Tag parsing with and without unsynchronisation:"
+    plain_seconds = _time(lambda: ID3v2._Tag(plain_data), args.repeat)
+    _print_result('_Tag (not unsynced)', megabytes, 'MB', plain_seconds, plain_seconds)
+    _print_result('_Tag (unsynced)', megabytes, 'MB',
+                  _time(lambda: ID3v2._Tag(unsynced_data), args.repeat),
+                  plain_seconds)
+
+
+BENCHMARKS = {
+    'frames': benchmark_frames,
+    'unsync': benchmark_unsync,
+}
+
+
+
+#-----------------------------------------------------------------------#
+#----------------------------     MAIN      ----------------------------#
+#-----------------------------------------------------------------------#
+def main():
+    """Runs the benchmarks given on the command line"""
+    argparser = argparse.ArgumentParser(description='Benchmarks the tag parsing code.')
+    argparser.add_argument('benchmarks', nargs='*', metavar='BENCHMARK', help=\
+        'benchmarks to run, from: %s. Default is all of them' % \
+        (', '.join(sorted(BENCHMARKS))))
+    argparser.add_argument('--frames', type=int, default=40, metavar='N', help=\
+        'number of frames in each synthetic tag. Default is 40')
+    argparser.add_argument('--binary-size', type=int, default=65536, metavar='N', help=\
+        'number of bytes of binary data (e.g. album art) in synthetic tags '
+        'which have any. Default is 65536')
+    argparser.add_argument('--repeat', type=int, default=5, metavar='N', help=\
+        'number of times to repeat each timing, taking the best. Default is 5')
+    args = argparser.parse_args()
+    for name in args.benchmarks:
+        if name not in BENCHMARKS:
+            argparser.error("unknown benchmark '%s'" % (name))
+    for name in args.benchmarks or sorted(BENCHMARKS):
+        BENCHMARKS[name](args)
+
+
+# Entry point.
+if __name__ == "__main__":
+    main()
@@ -36,20 +36,44 @@
 #-----------------------------------------------------------------------#
 """Imports:
     sys: console output
-    os: walking the directory structure
+    os: building file paths
+    threading: running pipeline stages concurrently
+    time: measuring the rate tracks are streamed through the pipeline
+    Queue: passing work between pipeline stages
     Config: handling program config options from files or command line args
+    Crawler: searching the directory structure
     TrackData: storing data from a single source about a track
     TrackFile: collecting all a track's TrackData together
     TrackCollection: collecting all TrackFiles under in the searched directory
+    Manifest: reusing data indexed by previous runs
+    Journal: recovering from and resuming interrupted writes
+    Plan: exporting and applying plans of the changes to write
+    UndoLog: recording and restoring the original tags of written tracks
+    Indexer: indexing tracks, optionally across a pool of threads or processes
+    Watcher: watching the searched directory for changes
     Progress: formatting progress messages
+    TagWriter: writing tags back to tracks
+    Writer: writing tracks, optionally across a pool of threads
 """
 import sys
 import os
+import threading
+import time
+import Queue
 import Config
+import Crawler
 import TrackData
 import TrackFile
 import TrackCollection
+import Manifest
+import Journal
+import Plan
+import UndoLog
+import Indexer
+import Watcher
 import Progress
+import TagWriter
+import Writer
 # This project makes use of the Levenshtein Python extension for string
 # comparisons (edit distance and the like - used for fixing inconsistently
 # named files). A copy of it is provided with this project, and the most
@@ -67,6 +91,13 @@ INDEXING_STATUS_STRING = '[2/5] Indexing tracks'
 PROCESSING_STATUS_STRING = '[3/5] Processing indexed tracks'
 STANDARDISING_STATUS_STRING = '[4/5] Standardising track data'
 REWRITING_STATUS_STRING = '[5/5] Rewriting tracks'
+STREAMING_STATUS_STRING = '[1-4/5] Searching, indexing and standardising tracks'
+LOADING_PLAN_STATUS_STRING = '[1-4/5] Loading change plan'
+UNDOING_STATUS_STRING = 'Restoring original tracks'
+
+# Maximum number of indexed albums which may be waiting to be standardised when
+# streaming.
+STREAM_MAX_IN_FLIGHT = 16
 
 
 
@@ -156,6 +187,19 @@ def remove_common_words(file_list):
     return file_list
 
 
+def extract_mp3s(file_list):
+    """Extracts all mp3s from a filelist
+
+    Args:
+        file_list: list of strings representing filenames
+
+    Returns:
+        A list of strings representing the mp3 filenames. May be empty if no
+        mp3s were found
+    """
+    return [f for f in file_list if f[-4:].lower() == '.mp3']
+
+
 def extract_mp3s_and_clean(file_list):
     """Extracts all mp3s from a filelist and and removes common words from them
 
@@ -165,13 +209,28 @@ def extract_mp3s_and_clean(file_list):
     Returns:
         A list of mp3 CleanFilenames. May be empty if no mp3s were found
     """
-    file_list = [f for f in file_list if f[-4:].lower() == '.mp3']
+    file_list = extract_mp3s(file_list)
     if not file_list:
         return []
     cleaned_file_list = [(CleanFilename(f)) for f in file_list]
     return remove_common_words(cleaned_file_list)
 
 
+def create_track_files(dirname, filenames):
+    """Creates TrackFiles for all mp3s in a directory
+
+    Args:
+        dirname: string path to the directory.
+        filenames: list of strings representing the names of the files in the
+            directory.
+
+    Returns:
+        A list of unindexed TrackFiles. May be empty if no mp3s were found
+    """
+    return [TrackFile.TrackFile(os.path.join(dirname, f.original), f.cleaned) \
+            for f in extract_mp3s_and_clean(filenames)]
+
+
 # takes the supplied base folder file path and generates a filepath of a new folder in the directory
 # below it
 def generate_new_filepath(target_file_path):
@@ -197,6 +256,9 @@ def generate_new_filepath(target_file_path):
 def print_warnings(warnings):
     """Outputs all warnings and clears the list
 
+    Warnings are removed from the list one at a time as they are printed, so
+    other threads may safely keep appending to it.
+
     Args:
         warnings: list of string warnings to print. This list will be cleared
             once printed.
@@ -204,47 +266,94 @@ def print_warnings(warnings):
     Returns:
         None
     """
-    for warning in warnings:
-        sys.stdout.write("WARNING: %s\n" % (warning))
-    del warnings[:]
+    while warnings:
+        sys.stdout.write("WARNING: %s\n" % (warnings.pop(0)))
 
 
 #-----------------------------------------------------------------------#
-#---------------------------    MAIN CODE    ---------------------------#
+#----------------------    PIPELINE FUNCTIONS    -----------------------#
 #-----------------------------------------------------------------------#
-def main():
-    """Main function"""
-    # Build program config from command line and config file.
-    config = Config.Config()
+def create_crawler(config):
+    """Creates a Crawler over the searched directory which reports progress
 
-    warnings = []
+    Args:
+        config: Config for this run.
 
-    # Recursively tranverse from the provided root directory looking for mp3s:
+    Returns:
+        A Crawler.
+    """
+    def progress_stub0(done_units, elapsed_seconds):
+        """Stub for encapsulating the 'searching' formatter"""
+        Progress.rate(SEARCHING_STATUS_STRING, done_units, elapsed_seconds, 'dirs')
+    return Crawler.Crawler(config.directory, config.search_threads,
+                           config.ordered_search, progress_stub0)
+
+
+def create_indexer(config, manifest):
+    """Creates the kind of Indexer configured for this run
+
+    Args:
+        config: Config for this run.
+        manifest: Manifest to index tracks through, or None.
+
+    Returns:
+        An Indexer.
+    """
+    if config.processes > 1:
+        return Indexer.ProcessIndexer(create_track_files, config.processes)
+    if config.async_io:
+        return Indexer.AsyncIndexer(create_track_files, manifest, config.max_in_flight)
+    if config.jobs > 1:
+        return Indexer.ThreadedIndexer(create_track_files, manifest, config.jobs)
+    if config.batch:
+        return Indexer.BatchIndexer(create_track_files, manifest, config.batch)
+    return Indexer.Indexer(create_track_files, manifest)
+
+
+def build_collection(config, manifest, warnings):
+    """Builds the collection one stage at a time over the whole directory
+
+    Every stage completes over the entire collection before the next starts.
+
+    Args:
+        config: Config for this run.
+        manifest: Manifest to index tracks through, or None.
+        warnings: list to append string warnings to.
+
+    Returns:
+        A processed and standardised TrackCollection.
+    """
+    # Recursively tranverse from the provided root directory looking for mp3s.
+    # Each directory is yielded as soon as it has been listed:
     #  * dirname gives the path to the current directory
-    #  * dirnames gives the list of subdirectories in the folder
     #  * filenames gives the list of files in the folder
-    Progress.state(SEARCHING_STATUS_STRING)
-    track_list = []
-    for dirname, subdirnames, filenames in os.walk(config.directory):
-        # Extract and clean filenames of all mp3s
-        cleaned_mp3_filenames = extract_mp3s_and_clean(filenames)
-        for f in cleaned_mp3_filenames:
-            # Extract all the information possible from the song and add it.
-            file_path = os.path.join(dirname, f.original)
-            new_file = TrackFile.TrackFile(file_path, f.cleaned)
-            track_list.append(new_file)
-    track_count = len(track_list)
+    crawler = create_crawler(config)
+    listings = []
+    for dirname, filenames in crawler:
+        # Extract all mp3s (they are cleaned as they are indexed)
+        mp3_filenames = extract_mp3s(filenames)
+        if mp3_filenames:
+            listings.append((dirname, mp3_filenames))
+    Progress.rate(SEARCHING_STATUS_STRING, crawler.directory_count,
+                  crawler.elapsed_seconds, 'dirs', True)
+    track_count = sum(len(filenames) for _, filenames in listings)
 
     # create storage system
     music_collection = TrackCollection.TrackCollection()
 
     # Add all located files to the collection.
-    for i in range(track_count):
-        track_list[i].load_all_data()
-        #print track_list[i]
-        track_list[i].finalise_data()
-        music_collection.add(track_list[i])
-        Progress.report(INDEXING_STATUS_STRING, track_count, i+1)
+    indexer = create_indexer(config, manifest)
+    done_count = 0
+    for track_files in indexer.index(listings, warnings):
+        for track in track_files:
+            music_collection.add(track)
+        done_count += len(track_files)
+        Progress.report(INDEXING_STATUS_STRING, track_count, done_count)
+    if done_count != track_count:
+        # Some tracks failed to index, but the stage has still finished.
+        Progress.report(INDEXING_STATUS_STRING, done_count, done_count)
+    if manifest is not None:
+        manifest.commit()
     print_warnings(warnings)
 
     # Remove all duplicate files from the collection.
@@ -260,6 +369,323 @@ def main():
         Progress.report(STANDARDISING_STATUS_STRING, total_units, done_units)
     music_collection.standardise_album_tracks(warnings, progress_stub2)
     print_warnings(warnings)
+    return music_collection
+
+
+def prefetch(iterable, max_in_flight):
+    """Consumes an iterable on a background thread, buffering its items
+
+    This lets the stages of a generator pipeline either side of the prefetch
+    run concurrently, with the queue between them bounding how far ahead the
+    producing stage may get. Once the prefetch finishes, or is closed early,
+    the background thread has stopped, so anything the iterable used (e.g. the
+    manifest) may be used again by the caller.
+
+    Args:
+        iterable: iterable to consume.
+        max_in_flight: int maximum number of items to buffer.
+
+    Yields:
+        The items of the iterable, in order. Any exception raised while
+        consuming the iterable is re-raised here.
+    """
+    buffered = Queue.Queue(max_in_flight)
+    stopping = threading.Event()
+    finished = object()
+    def producer():
+        """Moves items from the iterable to the queue"""
+        try:
+            for item in iterable:
+                if stopping.is_set():
+                    break
+                buffered.put((item, None))
+            buffered.put((finished, None))
+        except Exception as e: # pylint: disable=broad-except
+            buffered.put((finished, e))
+        finally:
+            # Close a generator left part way through, letting it clean up.
+            if hasattr(iterable, 'close'):
+                iterable.close()
+    thread = threading.Thread(target=producer)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            item, error = buffered.get()
+            if error is not None:
+                raise error
+            if item is finished:
+                return
+            yield item
+    finally:
+        # Stop the producer, draining the queue so it cannot block on it.
+        stopping.set()
+        while thread.is_alive():
+            try:
+                buffered.get(timeout=0.1)
+            except Queue.Empty:
+                pass
+        thread.join()
+
+
+def standardise_stage(track_batches, warnings):
+    """Pipeline stage processing and standardising each batch of tracks
+
+    Each batch is processed in isolation, so this relies on every album being
+    contained in a single directory (as it is in directory mode).
+
+    Args:
+        track_batches: iterable of lists of indexed TrackFiles.
+        warnings: list to append string warnings to.
+
+    Yields:
+        A processed and standardised TrackCollection for each batch.
+    """
+    for track_files in track_batches:
+        album_collection = TrackCollection.TrackCollection()
+        for track in track_files:
+            album_collection.add(track)
+        album_collection.remove_duplicates(warnings)
+        album_collection.standardise_album_tracks(warnings)
+        yield album_collection
+
+
+def stream_collection(config, manifest, warnings, keep_collection):
+    """Builds the collection with all stages running concurrently per album
+
+    Each directory flows through searching, indexing, processing and
+    standardising as soon as it has been found rather than waiting for the rest
+    of the directory structure, so only the albums in flight are held in memory
+    (unless the collection itself is kept).
+
+    Args:
+        config: Config for this run.
+        manifest: Manifest to index tracks through, or None.
+        warnings: list to append string warnings to.
+        keep_collection: boolean, True to gather all albums into a single
+            collection (needed to print or rewrite it) or False to discard each
+            album once standardised.
+
+    Returns:
+        A processed and standardised TrackCollection. Empty unless
+        keep_collection was True.
+    """
+    music_collection = TrackCollection.TrackCollection()
+    crawler = Crawler.Crawler(config.directory, config.search_threads,
+                              config.ordered_search)
+    indexer = create_indexer(config, manifest)
+    track_batches = prefetch(indexer.index(crawler, warnings), STREAM_MAX_IN_FLIGHT)
+    start_time = time.time()
+    track_count = 0
+    try:
+        for album_collection in standardise_stage(track_batches, warnings):
+            track_count += album_collection.file_count
+            if keep_collection:
+                music_collection.merge(album_collection)
+            print_warnings(warnings)
+            Progress.rate(STREAMING_STATUS_STRING, track_count, time.time() - start_time,
+                          'tracks')
+    finally:
+        # Wait for indexing to stop before the manifest is used again.
+        track_batches.close()
+    Progress.rate(STREAMING_STATUS_STRING, track_count, time.time() - start_time,
+                  'tracks', True)
+    if manifest is not None:
+        manifest.commit()
+    return music_collection
+
+
+def watch_collection(config, music_collection, manifest, warnings):
+    """Keeps a collection up to date with changes to the searched directory
+
+    Runs until interrupted. Whenever the files within a directory change (and
+    have then settled) its tracks are re-indexed and the albums they belong to,
+    both before and after the change, are processed and standardised again.
+
+    Args:
+        config: Config for this run.
+        music_collection: TrackCollection indexed from config.directory.
+        manifest: Manifest to index tracks through, or None.
+        warnings: list to append string warnings to.
+
+    Returns:
+        None
+    """
+    watcher = Watcher.Watcher(config.directory, config.settle_time)
+    sys.stdout.write("Watching %s for changes (using %s)...\n" \
+                     % (config.directory, watcher.method))
+    for dirnames in watcher:
+        affected_albums = set()
+        for dirname in dirnames:
+            affected_albums |= music_collection.remove_directory(dirname)
+            _, filenames = Crawler.list_directory(dirname)
+            for track in create_track_files(dirname, filenames):
+                # Files may be caught mid-copy, so never let one bring down the
+                # watch.
+                try:
+                    Indexer.index_track(track, manifest)
+                except Exception as e: # pylint: disable=broad-except
+                    warnings.append('Failed to index %s: %s' % (track.file_path, e))
+                    continue
+                affected_albums.add(music_collection.add(track))
+        for artist, album in sorted(affected_albums):
+            music_collection.process_album(artist, album, warnings)
+        if manifest is not None:
+            manifest.commit()
+        print_warnings(warnings)
+        sys.stdout.write("Updated %d album(s) in %d changed folder(s).\n" \
+                         % (len(affected_albums), len(dirnames)))
+        if config.verbose:
+            for artist, album in sorted(affected_albums):
+                sys.stdout.write("  [%s][%s]\n" % (artist, album))
+
+
+def create_writer(config, journal, undo_log):
+    """Creates the kind of Writer configured for this run
+
+    Args:
+        config: Config for this run.
+        journal: Journal to write tracks through, or None.
+        undo_log: UndoLog to record the original tags of tracks in, or None.
+
+    Returns:
+        A Writer.
+    """
+    if config.write_jobs > 1:
+        return Writer.ThreadedWriter(journal, undo_log, config.write_jobs,
+                                     config.max_write_bytes)
+    return Writer.Writer(journal, undo_log)
+
+
+def rewrite_collection(config, music_collection, journal, warnings):
+    """Writes the standardised data of every track back to its file's tags
+
+    Tracks are either updated in place or written to a new directory
+    structure, according to the configured output mode.
+
+    Args:
+        config: Config for this run.
+        music_collection: processed and standardised TrackCollection.
+        journal: recovered Journal to write tracks through.
+        warnings: list to append string warnings to.
+
+    Returns:
+        None
+    """
+    def progress_stub(total_units, done_units, done_bytes, elapsed_seconds):
+        """Stub for encapsulating the 'rewriting' formatter"""
+        Progress.throughput(REWRITING_STATUS_STRING, total_units, done_units,
+                            done_bytes, elapsed_seconds)
+    # Only the in-place and move output modes change the original files.
+    if config.output_mode in (Config.OutputMode.in_place, Config.OutputMode.move):
+        undo_log = UndoLog.UndoLog(config.undo_log or \
+            os.path.join(config.directory, UndoLog.UNDO_LOG_FILENAME))
+    else:
+        undo_log = None
+    writer = create_writer(config, journal, undo_log)
+    if config.output_mode is Config.OutputMode.in_place:
+        method_counts = music_collection.write_tags(config.id3v2_padding, writer,
+                                                    warnings, progress_stub)
+    else:
+        if journal.output_path is not None:
+            new_folder = journal.output_path
+            sys.stdout.write("Resuming new directory structure in %s.\n" % (new_folder))
+        else:
+            new_folder = generate_new_filepath(config.directory)
+            journal.set_output_path(new_folder)
+            sys.stdout.write("Creating new directory structure in %s.\n" % (new_folder))
+        method_counts = music_collection.create_new_filesystem(new_folder,
+            config.id3v2_padding,
+            config.output_mode is Config.OutputMode.hardlink,
+            config.output_mode is Config.OutputMode.reflink,
+            config.output_mode is Config.OutputMode.move,
+            writer, warnings, progress_stub)
+    journal.finish()
+    print_warnings(warnings)
+    if undo_log is not None:
+        undo_log.close()
+        sys.stdout.write("Recorded the original tags of %d file(s) in %s.\n" \
+                         % (undo_log.record_count, undo_log.log_path))
+    if journal.skipped_count:
+        sys.stdout.write("Skipped %d file(s) already written by the interrupted run.\n" \
+                         % (journal.skipped_count))
+    sys.stdout.write("Patched %d file(s) in place, rewrote %d file(s).\n" \
+                     % (method_counts[TagWriter.WriteMethod.patched],
+                        method_counts[TagWriter.WriteMethod.rewritten]))
+    if config.output_mode is Config.OutputMode.in_place:
+        sys.stdout.write("Left %d file(s) untouched as their tags were already correct.\n" \
+                         % (method_counts[TagWriter.WriteMethod.unchanged]))
+    if config.output_mode is Config.OutputMode.move:
+        sys.stdout.write("Renamed %d file(s) without re-tagging, re-tagged %d file(s).\n" \
+                         % (method_counts[TagWriter.WriteMethod.renamed],
+                            method_counts[TagWriter.WriteMethod.patched] \
+                            + method_counts[TagWriter.WriteMethod.rewritten]))
+    if config.output_mode in (Config.OutputMode.hardlink, Config.OutputMode.reflink):
+        sys.stdout.write("Hard linked %d file(s), reflinked %d file(s).\n" \
+                         % (method_counts[TagWriter.WriteMethod.linked],
+                            method_counts[TagWriter.WriteMethod.cloned]))
+
+
+#-----------------------------------------------------------------------#
+#---------------------------    MAIN CODE    ---------------------------#
+#-----------------------------------------------------------------------#
+def main():
+    """Main function"""
+    # Build program config from command line and config file.
+    config = Config.Config()
+
+    warnings = []
+
+    # Restore the files recorded in an undo log, if asked to, and do nothing
+    # else.
+    if config.undo:
+        def progress_stub(total_units, done_units):
+            """Stub for encapsulating the 'undoing' formatter"""
+            Progress.report(UNDOING_STATUS_STRING, total_units, done_units)
+        restored_count = UndoLog.undo(config.undo, warnings, progress_stub)
+        print_warnings(warnings)
+        sys.stdout.write("Restored %d file(s) from %s.\n" % (restored_count, config.undo))
+        print "Finished."
+        return
+
+    # Open the journal of the previous run, if writing, undoing any writes it
+    # was interrupted in the middle of before anything is indexed.
+    if config.dry_run:
+        journal = None
+    else:
+        journal = Journal.Journal(os.path.join(config.directory,
+                                               Journal.JOURNAL_FILENAME),
+                                  config.resume)
+        undone_count = journal.recover()
+        if undone_count:
+            sys.stdout.write("Undid %d incomplete write(s) from an interrupted run.\n" \
+                             % (undone_count))
+
+    # Open the manifest of previously indexed files, if running incrementally.
+    if config.incremental:
+        manifest = Manifest.Manifest(os.path.join(config.directory,
+                                                  Manifest.MANIFEST_FILENAME))
+    else:
+        manifest = None
+
+    # Search, index and standardise the directory, or load the plan of a
+    # previous run which did.
+    if config.apply_plan:
+        Progress.state(LOADING_PLAN_STATUS_STRING)
+        output_mode_name, music_collection = Plan.load_plan(config.apply_plan,
+                                                            config.directory,
+                                                            warnings)
+        config.output_mode = Config.OutputMode[output_mode_name]
+        print_warnings(warnings)
+        sys.stdout.write("Loaded %d file(s) to write from %s.\n" \
+                         % (music_collection.file_count, config.apply_plan))
+    elif config.stream:
+        keep_collection = config.verbose or config.watch or not config.dry_run \
+                          or config.export_plan
+        music_collection = stream_collection(config, manifest, warnings,
+                                             keep_collection)
+    else:
+        music_collection = build_collection(config, manifest, warnings)
 
     if config.verbose:
         music_collection.sort_songs_by_track()
@@ -267,12 +693,26 @@ def main():
 
     if config.dry_run:
         Progress.skip(REWRITING_STATUS_STRING)
+        if config.export_plan:
+            track_count = Plan.export_plan(config.export_plan, config.directory,
+                                           config.output_mode.name,
+                                           music_collection, warnings)
+            print_warnings(warnings)
+            sys.stdout.write("Wrote a plan of %d file(s) to %s.\n" \
+                             % (track_count, config.export_plan))
     else:
-        print "TBD"
-        # write the newly corrected data to a new file system with new tags
-        #new_folder = generate_new_filepath(args.directory)
-        #print "Creating new directory structure in %s." % (new_folder)
-        #music_collection.create_new_filesystem(new_folder)
+        rewrite_collection(config, music_collection, journal, warnings)
+
+    # Keep the collection up to date until interrupted, if watching.
+    if config.watch:
+        try:
+            watch_collection(config, music_collection, manifest, warnings)
+        except KeyboardInterrupt:
+            sys.stdout.write("\n")
+    if manifest is not None:
+        manifest.close()
+    if journal is not None:
+        journal.close()
 
     # done
     print "Finished."
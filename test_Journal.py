@@ -0,0 +1,185 @@
+"""Imports:
+    os: creating and checking the files written
+    shutil: removing the files written
+    tempfile: creating a directory to write files in
+    unittest: running the tests
+    TrackFile: loading the tracks written
+    TagWriter: writing the tracks
+    Writer: writing the tracks through the journal
+    Journal: recovering and resuming the writes
+    UndoLog: restoring the tracks rewritten
+    test_TagWriter: creating the tracks
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import TrackFile
+import TagWriter
+import Writer
+import Journal
+import UndoLog
+from test_TagWriter import _create_track_file, _read_file
+
+
+class JournalTest(unittest.TestCase):
+    """Checks writes interrupted part way through are undone, and resumed
+    runs skip the writes which completed."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.directory, Journal.JOURNAL_FILENAME)
+        self.log_path = os.path.join(self.directory, UndoLog.UNDO_LOG_FILENAME)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def create_track(self, name, padding_size=2000):
+        """Creates a track, returning its path and original bytes"""
+        file_path = os.path.join(self.directory, name)
+        _create_track_file(file_path, "Old Title", padding_size)
+        return file_path, _read_file(file_path)
+
+    def load_track(self, file_path, title):
+        """Loads and finalises a track, giving it a new title"""
+        track = TrackFile.TrackFile(file_path)
+        track.load_all_data()
+        track.finalise_data()
+        track.final.title = title
+        return track
+
+    def interrupt(self, write_track, directories):
+        """Writes tracks through a journal and undo log until interrupted,
+        then abandons both as a crash would"""
+        journal = Journal.Journal(self.db_path)
+        self.assertEqual(journal.recover(), 0)
+        undo_log = UndoLog.UndoLog(self.log_path)
+        writer = Writer.Writer(journal, undo_log)
+        self.assertRaises(KeyboardInterrupt, writer.write, write_track, directories,
+                          sum(len(jobs) for jobs in directories), [])
+        # Neither is committed, flushed or closed.
+        journal._db.close()
+        undo_log._file.close()
+
+    def recover(self, resume=False):
+        """Reopens the journal after a crash, returning it and the number of
+        writes undone"""
+        journal = Journal.Journal(self.db_path, resume)
+        return journal, journal.recover()
+
+    def test_interrupted_patch(self):
+        file_path, original = self.create_track('track.mp3')
+        def write_track(track, _, regions):
+            """Writes half of a patch"""
+            with open(track.file_path, 'r+b') as f:
+                f.write('\xff' * (len(regions.head) // 2))
+            raise KeyboardInterrupt()
+        self.interrupt(write_track, [[(self.load_track(file_path, "New Title"), None)]])
+        self.assertNotEqual(_read_file(file_path), original)
+        journal, undone_count = self.recover()
+        journal.close()
+        self.assertEqual(undone_count, 1)
+        self.assertEqual(_read_file(file_path), original)
+
+    def test_interrupted_rewrite(self):
+        file_path, original = self.create_track('track.mp3', padding_size=0)
+        def write_track(track, _, regions):
+            """Rewrites a track, but is interrupted before completing it"""
+            self.assertEqual(TagWriter.write_tags(track, 100, regions),
+                             TagWriter.WriteMethod.rewritten)
+            raise KeyboardInterrupt()
+        self.interrupt(write_track,
+                       [[(self.load_track(file_path, "A New Title Too Long To Fit"), None)]])
+        rewritten = _read_file(file_path)
+        self.assertNotEqual(rewritten, original)
+        # The file is whole, so it is left as written...
+        journal, undone_count = self.recover()
+        journal.close()
+        self.assertEqual(undone_count, 0)
+        self.assertEqual(_read_file(file_path), rewritten)
+        # ...and the undo log restores its original tags.
+        warnings = []
+        self.assertEqual(UndoLog.undo(self.log_path, warnings), 1)
+        self.assertEqual(warnings, [])
+        self.assertEqual(_read_file(file_path), original)
+
+    def test_interrupted_save(self):
+        file_path, original = self.create_track('track.mp3', padding_size=0)
+        def write_track(track, _, regions):
+            """Starts saving a track, leaving a temporary file"""
+            tempfile.mkstemp(suffix='.tmp', prefix='.track.mp3', dir=self.directory)
+            raise KeyboardInterrupt()
+        self.interrupt(write_track, [[(self.load_track(file_path, "New Title"), None)]])
+        journal, undone_count = self.recover()
+        journal.close()
+        self.assertEqual(undone_count, 0)
+        self.assertEqual(_read_file(file_path), original)
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         sorted([Journal.JOURNAL_FILENAME, UndoLog.UNDO_LOG_FILENAME,
+                                 'track.mp3']))
+
+    def test_interrupted_move(self):
+        file_path, original = self.create_track('track.mp3')
+        target = os.path.join(self.directory, 'moved.mp3')
+        def write_track(track, target, regions):
+            """Moves a track, but is interrupted before completing it"""
+            self.assertEqual(TagWriter.move_track(track, target, -1, regions),
+                             TagWriter.WriteMethod.patched)
+            raise KeyboardInterrupt()
+        self.interrupt(write_track, [[(self.load_track(file_path, "New Title"), target)]])
+        self.assertFalse(os.path.exists(file_path))
+        journal, undone_count = self.recover()
+        journal.close()
+        self.assertEqual(undone_count, 1)
+        self.assertFalse(os.path.exists(target))
+        self.assertEqual(_read_file(file_path), original)
+
+    def test_resume(self):
+        file_paths = [self.create_track('%d.mp3' % (i))[0] for i in range(2)]
+        def write_track(track, _, regions):
+            """Writes the first track, and is interrupted writing the second"""
+            if track.file_path == file_paths[1]:
+                raise KeyboardInterrupt()
+            return TagWriter.write_tags(track, -1, regions)
+        def directories():
+            """Lists the tracks to write, one per directory"""
+            return [[(self.load_track(file_path, "New Title"), None)] \
+                    for file_path in file_paths]
+        self.interrupt(write_track, directories())
+        written = _read_file(file_paths[0])
+
+        journal, undone_count = self.recover(resume=True)
+        self.assertEqual(undone_count, 0)
+        method_counts = Writer.Writer(journal).write(
+            lambda track, _, regions: TagWriter.write_tags(track, -1, regions),
+            directories(), 2, [])
+        journal.finish()
+        journal.close()
+        self.assertEqual(journal.skipped_count, 1)
+        self.assertEqual(method_counts[TagWriter.WriteMethod.patched], 1)
+        self.assertEqual(_read_file(file_paths[0]), written)
+        self.assertEqual(_read_file(file_paths[1]), written)
+
+        # With nothing left to resume, a further run writes every track.
+        journal, _ = self.recover(resume=True)
+        self.assertFalse(journal.is_done(file_paths[0]))
+        journal.close()
+
+    def test_restart(self):
+        file_paths = [self.create_track('%d.mp3' % (i))[0] for i in range(2)]
+        def write_track(track, _, regions):
+            """Writes the first track, and is interrupted writing the second"""
+            if track.file_path == file_paths[1]:
+                raise KeyboardInterrupt()
+            return TagWriter.write_tags(track, -1, regions)
+        self.interrupt(write_track, [[(self.load_track(file_path, "New Title"), None)] \
+                                     for file_path in file_paths])
+        # Without resuming, the completed writes are forgotten.
+        journal, undone_count = self.recover()
+        self.assertEqual(undone_count, 0)
+        self.assertFalse(journal.is_done(file_paths[0]))
+        journal.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
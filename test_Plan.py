@@ -0,0 +1,96 @@
+"""Imports:
+    os: creating the files planned
+    json: reading back the plan
+    shutil: removing the files planned
+    tempfile: creating a directory to plan files in
+    unittest: running the tests
+    TrackFile: loading the tracks planned
+    TrackCollection: collecting the tracks planned
+    TagWriter: checking how planned tracks will be written
+    Plan: exporting and loading the plan
+    test_TagWriter: creating the tracks
+"""
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import TrackFile
+import TrackCollection
+import TagWriter
+import Plan
+from test_TagWriter import _create_track_file
+
+
+class PlanTest(unittest.TestCase):
+    """Checks plans record how each track will be written, and load back to
+    be written the same way."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.plan_path = os.path.join(self.directory, 'plan')
+        self.music_path = os.path.join(self.directory, 'Music')
+        os.mkdir(self.music_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def export(self, output_mode_name, titles):
+        """Exports a plan of tracks with the given titles, returning its entries"""
+        music_collection = TrackCollection.TrackCollection()
+        for i, title in enumerate(titles):
+            file_path = os.path.join(self.music_path, '%02d.mp3' % (i + 1))
+            _create_track_file(file_path, title)
+            track = TrackFile.TrackFile(file_path)
+            track.load_all_data()
+            track.finalise_data()
+            music_collection.add(track)
+        warnings = []
+        self.assertEqual(Plan.export_plan(self.plan_path, self.music_path, output_mode_name,
+                                          music_collection, warnings), len(titles))
+        self.assertEqual(warnings, [])
+        with open(self.plan_path) as f:
+            return dict((entry['final']['title'], entry) \
+                        for entry in (json.loads(line) for line in list(f)[1:]))
+
+    def load(self):
+        """Loads the plan, returning its tracks by title"""
+        warnings = []
+        output_mode_name, music_collection = Plan.load_plan(self.plan_path, self.music_path,
+                                                            warnings)
+        self.assertEqual(warnings, [])
+        tracks = {}
+        for artist in music_collection.collection:
+            for album in music_collection.collection[artist]:
+                for song in music_collection.collection[artist][album]:
+                    tracks[song.final.title] = song
+        return output_mode_name, tracks
+
+    def test_move(self):
+        entries = self.export('move', ["Come Together", "come_together again"])
+        self.assertEqual(entries["Come Together"]['strategy'], 'renamed')
+        self.assertEqual(entries["Come Together"]['changes'],
+                         {'id3v1': {}, 'id3v2': {}})
+        self.assertEqual(entries["Come Together Again"]['strategy'], 'patched')
+        self.assertEqual(entries["Come Together Again"]['changes']['id3v2'],
+                         {'title': ["come_together again", "Come Together Again"]})
+        output_mode_name, tracks = self.load()
+        self.assertEqual(output_mode_name, 'move')
+        self.assertTrue(TagWriter.data_matches(tracks["Come Together"]))
+        self.assertFalse(TagWriter.data_matches(tracks["Come Together Again"]))
+
+    def test_in_place(self):
+        entries = self.export('in_place', ["Come Together", "come_together again"])
+        self.assertEqual(entries["Come Together"]['strategy'], 'unchanged')
+        self.assertEqual(entries["Come Together Again"]['strategy'], 'patched')
+        self.assertEqual(entries["Come Together"]['target'], None)
+
+    def test_copy(self):
+        entries = self.export('reflink', ["Come Together"])
+        self.assertEqual(entries["Come Together"]['strategy'], 'cloned')
+        entries = self.export('copy', ["Come Together"])
+        self.assertEqual(entries["Come Together"]['strategy'], 'rewritten')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Imports:
+    random: generating tag headers to decode
+    unittest: running the tests
+    ID3v2: building the tag headers to decode
+    TagBatch: decoding the tag headers
+"""
+import random
+import unittest
+import ID3v2
+import TagBatch
+
+
+def _random_header(rng):
+    """Creates bytes which may (or may not quite) start an ID3v2 tag.
+
+    Args:
+        rng: random.Random to generate the bytes with.
+
+    Returns:
+        string of up to ID3v2.TAG_HEADER_SIZE bytes, usually with the ID3
+        magic and a plausible version, but with arbitrary flags and size.
+    """
+    magic = "ID3" if rng.random() < 0.9 else rng.choice(["ID2", "TAG", "id3", "\0\0\0"])
+    version = rng.choice([2, 3, 4, 4]) if rng.random() < 0.8 else rng.randint(0, 255)
+    revision = 0 if rng.random() < 0.8 else rng.randint(0, 255)
+    flags = rng.choice([0, 0x10, 0x20, 0x40, 0x80, 0xF0]) if rng.random() < 0.5 \
+            else rng.randint(0, 255)
+    if rng.random() < 0.7:
+        size = ''.join(chr(rng.randint(0, 0x7F)) for _ in range(4))
+    else:
+        size = ''.join(chr(rng.randint(0, 0xFF)) for _ in range(4))
+    header = magic + chr(version) + chr(revision) + chr(flags) + size
+    if rng.random() < 0.05:
+        header = header[:rng.randint(0, ID3v2.TAG_HEADER_SIZE - 1)]
+    return header
+
+
+@unittest.skipIf(TagBatch.numpy is None, "NumPy is not installed")
+class PlanHeadReadsTest(unittest.TestCase):
+    """Checks the NumPy decoding of ID3v2 tag headers matches the per-file
+    fallback."""
+
+    def setUp(self):
+        self.numpy = TagBatch.numpy
+
+    def tearDown(self):
+        TagBatch.numpy = self.numpy
+
+    def plan_without_numpy(self, heads):
+        """Plans the head reads with the per-file fallback"""
+        TagBatch.numpy = None
+        try:
+            return TagBatch.plan_head_reads(heads)
+        finally:
+            TagBatch.numpy = self.numpy
+
+    def test_matches_fallback(self):
+        rng = random.Random(0)
+        heads = [_random_header(rng) for _ in range(5000)]
+        self.assertEqual(TagBatch.plan_head_reads(heads), self.plan_without_numpy(heads))
+
+    def test_unknown_flags(self):
+        heads = ['ID3\x02\x00\x10\x12G@d', 'ID3\x03\x00\x10\x00\x00\x01\x00',
+                 'ID3\x04\x00\x08\x00\x00\x01\x00', 'ID3\x02\x00\xC0\x00\x00\x01\x00',
+                 'ID3\x03\x00\xE0\x00\x00\x01\x00', 'ID3\x04\x00\xF0\x00\x00\x01\x00']
+        self.assertEqual(TagBatch.plan_head_reads(heads),
+                         [0, 0, 0, 138, 138, 148])
+        self.assertEqual(TagBatch.plan_head_reads(heads), self.plan_without_numpy(heads))
+
+    def test_short_headers(self):
+        heads = ['', 'ID3', 'ID3\x03\x00\x00\x00\x00\x05', 'ID3\x03\x00\x00\x00\x00\x05\x00']
+        self.assertEqual(TagBatch.plan_head_reads(heads), [0, 0, 0, 650])
+        self.assertEqual(TagBatch.plan_head_reads(heads), self.plan_without_numpy(heads))
+
+
+if __name__ == '__main__':
+    unittest.main()
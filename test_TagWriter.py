@@ -0,0 +1,212 @@
+"""Imports:
+    os: creating and comparing the files written
+    shutil: removing the files written
+    struct: building the tags of the files written
+    tempfile: creating a directory to write files in
+    unittest: running the tests
+    TrackFile: loading the tracks written
+    ID3v2: reading back the tags written
+    TagWriter: writing the tracks
+"""
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import TrackFile
+import ID3v2
+import TagWriter
+
+
+def _create_track_file(file_path, title, padding_size=2000):
+    """Creates a small MP3 file with ID3v2.3 and ID3v1.1 tags.
+
+    Args:
+        file_path: string path to create the file at.
+        title: string title to give the track in both tags.
+        padding_size: Optional int number of bytes of padding to give the
+            ID3v2 tag.
+
+    Returns:
+        None
+    """
+    def frame(frame_id, text):
+        """Creates an ID3v2.3 text frame"""
+        return frame_id + struct.pack('>IH', len(text) + 2, 0) + '\00' + text + '\00'
+
+    body = frame("TIT2", title) + frame("TALB", "Album") + frame("TPE1", "Artist") \
+         + frame("TRCK", "1") + frame("TYER", "2001") + frame("COMM", "eng\00comment") \
+         + '\00' * padding_size
+    size_string = ''.join(chr((len(body) >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+    v1_tag = "TAG" + title.ljust(30, '\00') + "Artist".ljust(30, '\00') \
+           + "Album".ljust(30, '\00') + "2001" + "comment".ljust(28, '\00') \
+           + '\00' + chr(1) + chr(17)
+    with open(file_path, "wb") as f:
+        f.write("ID3\x03\x00\x00" + size_string + body)
+        f.write(''.join(chr(i % 251) for i in range(50000)))
+        f.write(v1_tag)
+
+
+def _copy_file(src_path, dst_path):
+    """Stands in for TagWriter.clone_file on filesystems without reflinks.
+
+    A reflink shares the source's data but is otherwise an exact copy, so the
+    same path is exercised by copying the file byte for byte.
+    """
+    with open(src_path, "rb") as src:
+        dst_fd = os.open(dst_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL,
+                         os.fstat(src.fileno()).st_mode & 0o7777)
+        with os.fdopen(dst_fd, "wb") as dst:
+            dst.write(src.read())
+    return True
+
+
+def _read_file(file_path):
+    """Reads the whole of a file"""
+    with open(file_path, "rb") as f:
+        return f.read()
+
+
+class WriteTrackCopyTest(unittest.TestCase):
+    """Checks that every way write_track_copy may write a file produces the
+    same bytes."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.source_path = os.path.join(self.directory, 'source.mp3')
+        self.clone_file = TagWriter.clone_file
+
+    def tearDown(self):
+        TagWriter.clone_file = self.clone_file
+        shutil.rmtree(self.directory)
+
+    def load_track(self, title):
+        """Loads and finalises the source track, giving it a new title"""
+        track = TrackFile.TrackFile(self.source_path)
+        track.load_all_data()
+        track.finalise_data()
+        track.final.title = title
+        return track
+
+    def write_copy(self, track, name, clone_file, **kwargs):
+        """Writes a copy of a track with the given stand in for clone_file"""
+        output_path = os.path.join(self.directory, name)
+        TagWriter.clone_file = clone_file
+        try:
+            method = TagWriter.write_track_copy(track, output_path, **kwargs)
+        finally:
+            TagWriter.clone_file = self.clone_file
+        return method, _read_file(output_path)
+
+    def test_clone_and_fallback_match(self):
+        _create_track_file(self.source_path, "Old Title")
+        track = self.load_track("New Title")
+        copied = self.write_copy(track, 'copied.mp3', self.clone_file)
+        cloned = self.write_copy(track, 'cloned.mp3', _copy_file, reflink=True)
+        fallback = self.write_copy(track, 'fallback.mp3', lambda src, dst: False,
+                                   reflink=True)
+        self.assertEqual(copied[0], TagWriter.WriteMethod.rewritten)
+        self.assertEqual(cloned[0], TagWriter.WriteMethod.cloned)
+        self.assertEqual(fallback[0], TagWriter.WriteMethod.rewritten)
+        self.assertEqual(cloned[1], copied[1])
+        self.assertEqual(fallback[1], copied[1])
+        self.assertNotEqual(copied[1], _read_file(self.source_path))
+
+    def test_link_and_fallback_match(self):
+        _create_track_file(self.source_path, "Title")
+        # Write the source's tags as they would be written, so they match.
+        TagWriter.write_tags(self.load_track("Title"))
+        track = self.load_track("Title")
+        linked = self.write_copy(track, 'linked.mp3', self.clone_file, hardlink=True)
+        cloned = self.write_copy(track, 'cloned.mp3', _copy_file, reflink=True)
+        copied = self.write_copy(track, 'copied.mp3', self.clone_file)
+        self.assertEqual(linked[0], TagWriter.WriteMethod.linked)
+        self.assertEqual(cloned[0], TagWriter.WriteMethod.cloned)
+        self.assertEqual(copied[0], TagWriter.WriteMethod.rewritten)
+        self.assertEqual(copied[1], linked[1])
+        self.assertEqual(cloned[1], linked[1])
+
+    def test_real_clone_matches_copy(self):
+        # Uses FICLONE where the filesystem supports it, or else the fallback.
+        _create_track_file(self.source_path, "Old Title")
+        track = self.load_track("New Title")
+        copied = self.write_copy(track, 'copied.mp3', self.clone_file)
+        reflinked = self.write_copy(track, 'reflinked.mp3', self.clone_file, reflink=True)
+        self.assertIn(reflinked[0], (TagWriter.WriteMethod.cloned,
+                                     TagWriter.WriteMethod.rewritten))
+        self.assertEqual(reflinked[1], copied[1])
+
+    def test_tag_too_large_to_patch(self):
+        _create_track_file(self.source_path, "Old Title", padding_size=0)
+        track = self.load_track("A New Title Too Long To Fit In The Old Tag")
+        copied = self.write_copy(track, 'copied.mp3', self.clone_file)
+        cloned = self.write_copy(track, 'cloned.mp3', _copy_file, reflink=True)
+        self.assertEqual(copied[0], TagWriter.WriteMethod.rewritten)
+        self.assertEqual(cloned[0], TagWriter.WriteMethod.rewritten)
+        self.assertEqual(cloned[1], copied[1])
+
+
+class WriteTagsTest(unittest.TestCase):
+    """Checks the text written to tags reads back as it was."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'track.mp3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_non_ascii_text(self):
+        _create_track_file(self.file_path, "Old Title")
+        track = TrackFile.TrackFile(self.file_path)
+        track.load_all_data()
+        track.finalise_data()
+        track.final.artist = 'Beyonc\xc3\xa9'
+        track.final.title = 'Plain Title'
+        self.assertEqual(TagWriter.write_tags(track), TagWriter.WriteMethod.patched)
+        data = ID3v2.read_tag_data(self.file_path)
+        self.assertEqual(data.artist, 'Beyonc\xc3\xa9')
+        self.assertEqual(data.title, 'Plain Title')
+        head_data = _read_file(self.file_path)
+        self.assertIn('TPE1\x00\x00\x00\x13\x00\x00\x01' + u'Beyonc\xe9'.encode('utf_16'),
+                      head_data)
+        self.assertIn('TIT2\x00\x00\x00\x0d\x00\x00\x00Plain Title\x00', head_data)
+
+
+class DataMatchesTest(unittest.TestCase):
+    """Checks data_matches only matches tags holding exactly the data which
+    would be written."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.directory, 'track.mp3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load_track(self):
+        """Loads and finalises the track"""
+        track = TrackFile.TrackFile(self.file_path)
+        track.load_all_data()
+        track.finalise_data()
+        return track
+
+    def test_uncleaned_tags(self):
+        _create_track_file(self.file_path, "come_together")
+        track = self.load_track()
+        self.assertEqual(track.v2.title, "Come Together")
+        self.assertEqual(track.final.title, "Come Together")
+        self.assertFalse(TagWriter.data_matches(track))
+        self.assertEqual(TagWriter.write_tags(track), TagWriter.WriteMethod.patched)
+        self.assertTrue(TagWriter.data_matches(self.load_track()))
+
+    def test_indexed_data(self):
+        _create_track_file(self.file_path, "come_together")
+        track = TrackFile.TrackFile(self.file_path)
+        track.set_indexed_data(self.load_track().get_indexed_data())
+        track.finalise_data()
+        self.assertFalse(TagWriter.data_matches(track))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,173 @@
+"""Imports:
+    os: creating and checking the files restored
+    gzip: creating a log in another format
+    shutil: removing the files written
+    tempfile: creating a directory to write files in
+    unittest: running the tests
+    TrackFile: loading the tracks written
+    TagReader: reading the tags recorded in the log
+    TagWriter: writing the tracks
+    Writer: writing the tracks through the log
+    UndoLog: recording and restoring the tracks
+    test_TagWriter: creating the tracks
+"""
+import os
+import gzip
+import shutil
+import tempfile
+import unittest
+import TrackFile
+import TagReader
+import TagWriter
+import Writer
+import UndoLog
+from test_TagWriter import _create_track_file, _read_file
+
+
+class UndoLogTest(unittest.TestCase):
+    """Checks records round trip through the log, whatever happened to the
+    runs which appended them."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, UndoLog.UNDO_LOG_FILENAME)
+        self.file_path = os.path.join(self.directory, 'track.mp3')
+        _create_track_file(self.file_path, "Title")
+        self.regions = TagReader.read_tag_regions(self.file_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def read_sources(self):
+        """Reads the source of each record in the log, and any warnings"""
+        warnings = []
+        records = UndoLog.read_records(self.log_path, warnings)
+        return [record[0] for record in records], warnings
+
+    def test_round_trip(self):
+        log = UndoLog.UndoLog(self.log_path)
+        log.record('/a', '/a', self.regions)
+        log.record('/b', '/c', None)
+        log.close()
+        records = UndoLog.read_records(self.log_path, [])
+        self.assertEqual(records[0][:2], ('/a', '/a'))
+        self.assertEqual(records[0][2], self.regions.head[:len(records[0][2])])
+        self.assertEqual(len(records[0][3]), 128)
+        self.assertEqual(records[1], ('/b', '/c', None, None, []))
+
+    def test_records_after_interrupted_run(self):
+        log = UndoLog.UndoLog(self.log_path)
+        log.record('/a', '/a', self.regions)
+        log.flush()
+        log.record('/torn', '/torn', self.regions)
+        # Simulate a crash part way through appending the second record.
+        log._file.flush()
+        log._file.truncate(log._file.tell() - 20)
+        log._file.close()
+        self.assertEqual(self.read_sources()[0], ['/a'])
+        self.assertEqual(len(self.read_sources()[1]), 1)
+
+        log = UndoLog.UndoLog(self.log_path)
+        log.record('/b', '/b', self.regions)
+        log.close()
+        self.assertEqual(self.read_sources(), (['/a', '/b'], []))
+
+    def test_other_format(self):
+        with gzip.open(self.log_path, 'ab') as f:
+            f.write('not an undo log')
+        self.assertRaises(Exception, UndoLog.UndoLog, self.log_path)
+        self.assertEqual(self.read_sources()[0], [])
+        self.assertEqual(len(self.read_sources()[1]), 1)
+
+
+class UndoTest(unittest.TestCase):
+    """Checks undo restores the original bytes of files written through the
+    log."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.directory, UndoLog.UNDO_LOG_FILENAME)
+        self.file_path = os.path.join(self.directory, 'track.mp3')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load_track(self, title):
+        """Loads and finalises the track, giving it a new title"""
+        track = TrackFile.TrackFile(self.file_path)
+        track.load_all_data()
+        track.finalise_data()
+        track.final.title = title
+        return track
+
+    def write(self, write_track, track, target=None):
+        """Writes a track through an undo log, returning the method used"""
+        log = UndoLog.UndoLog(self.log_path)
+        warnings = []
+        method_counts = Writer.Writer(None, log).write(write_track, [[(track, target)]], 1,
+                                                       warnings)
+        log.close()
+        self.assertEqual(warnings, [])
+        return [method for method in method_counts if method_counts[method]]
+
+    def undo(self):
+        """Undoes the log, returning the number of files restored"""
+        warnings = []
+        restored_count = UndoLog.undo(self.log_path, warnings)
+        self.assertEqual(warnings, [])
+        return restored_count
+
+    def test_patch(self):
+        _create_track_file(self.file_path, "Old Title")
+        original = _read_file(self.file_path)
+        self.assertEqual(self.write(lambda track, _, regions: \
+                                        TagWriter.write_tags(track, -1, regions),
+                                    self.load_track("New Title")),
+                         [TagWriter.WriteMethod.patched])
+        self.assertEqual(self.undo(), 1)
+        self.assertEqual(_read_file(self.file_path), original)
+
+    def test_rewrite(self):
+        _create_track_file(self.file_path, "Old Title", padding_size=0)
+        original = _read_file(self.file_path)
+        self.assertEqual(self.write(lambda track, _, regions: \
+                                        TagWriter.write_tags(track, 100, regions),
+                                    self.load_track("A New Title Too Long To Fit")),
+                         [TagWriter.WriteMethod.rewritten])
+        self.assertEqual(self.undo(), 1)
+        self.assertEqual(_read_file(self.file_path), original)
+
+    def test_move(self):
+        _create_track_file(self.file_path, "Old Title")
+        original = _read_file(self.file_path)
+        target = os.path.join(self.directory, 'moved.mp3')
+        self.assertEqual(self.write(lambda track, target, regions: \
+                                        TagWriter.move_track(track, target, -1, regions),
+                                    self.load_track("New Title"), target),
+                         [TagWriter.WriteMethod.patched])
+        self.assertFalse(os.path.exists(self.file_path))
+        self.assertEqual(self.undo(), 1)
+        self.assertFalse(os.path.exists(target))
+        self.assertEqual(_read_file(self.file_path), original)
+
+    def test_never_written(self):
+        # Records are made before each write, so may be of writes which never
+        # happened (e.g. were interrupted before they started).
+        _create_track_file(self.file_path, "Title")
+        original = _read_file(self.file_path)
+        target = os.path.join(self.directory, 'moved.mp3')
+        def fail(track, target, regions):
+            """Fails to write a track"""
+            raise IOError("interrupted")
+        log = UndoLog.UndoLog(self.log_path)
+        Writer.Writer(None, log).write(fail, [[(self.load_track("New Title"), None)],
+                                              [(self.load_track("New Title"), target)]],
+                                       2, [])
+        log.close()
+        self.assertEqual(len(UndoLog.read_records(self.log_path, [])), 2)
+        self.assertEqual(self.undo(), 0)
+        self.assertEqual(_read_file(self.file_path), original)
+
+
+if __name__ == '__main__':
+    unittest.main()
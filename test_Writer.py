@@ -0,0 +1,105 @@
+"""Imports:
+    os: creating the files written
+    shutil: removing the files written
+    tempfile: creating a directory to write files in
+    threading: watching how many tracks are written at once
+    unittest: running the tests
+    TrackFile: loading the tracks written
+    ID3v1: sizing the tags written
+    ID3v2: sizing the tags written
+    TagWriter: writing the tracks
+    Writer: writing the tracks
+    test_TagWriter: creating the tracks
+"""
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import TrackFile
+import ID3v1
+import ID3v2
+import TagWriter
+import Writer
+from test_TagWriter import _create_track_file, _read_file
+
+
+class WriterTest(unittest.TestCase):
+    """Checks the bytes written are counted, and only copies are budgeted."""
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def load_track(self, name, title, padding_size=2000):
+        """Creates, loads and finalises a track, giving it a new title"""
+        file_path = os.path.join(self.directory, name)
+        _create_track_file(file_path, "Old Title", padding_size)
+        track = TrackFile.TrackFile(file_path)
+        track.load_all_data()
+        track.finalise_data()
+        track.final.title = title
+        return track
+
+    def written_bytes(self, writer, directories, predict_method=None):
+        """Writes the tracks in place, returning the number of bytes reported"""
+        reported = []
+        warnings = []
+        writer.write(lambda track, _, regions: TagWriter.write_tags(track, 0, regions),
+                     directories, sum(len(jobs) for jobs in directories), warnings,
+                     lambda total, done, done_bytes, elapsed: reported.append(done_bytes),
+                     None, predict_method)
+        self.assertEqual(warnings, [])
+        return reported[-1]
+
+    def test_written_bytes(self):
+        for writer in (Writer.Writer(), Writer.ThreadedWriter(thread_count=2)):
+            patched = self.load_track('patched.mp3', "New Title")
+            tag_size = ID3v2.read_tag_size(_read_file(patched.file_path))
+            rewritten = self.load_track('rewritten.mp3', "A New Title Too Long To Fit", 0)
+            written = self.written_bytes(writer, [[(patched, None)], [(rewritten, None)]])
+            self.assertEqual(writer.method_counts[TagWriter.WriteMethod.patched], 1)
+            self.assertEqual(writer.method_counts[TagWriter.WriteMethod.rewritten], 1)
+            self.assertEqual(written, tag_size + ID3v1.TAG_SIZE
+                             + os.path.getsize(rewritten.file_path))
+
+    def test_patches_not_budgeted(self):
+        # With a budget of a single byte only one copied file may be written
+        # at once, while patched files are not held back.
+        writer = Writer.ThreadedWriter(thread_count=2, max_bytes_in_flight=1)
+        condition = threading.Condition()
+        counts = {'writing': 0, 'most': 0}
+
+        def write_track(track, _, regions):
+            """Writes a track, waiting briefly for the other to start too"""
+            with condition:
+                counts['writing'] += 1
+                counts['most'] = max(counts['most'], counts['writing'])
+                condition.notify_all()
+                if counts['writing'] < 2:
+                    condition.wait(1.0)
+            try:
+                return TagWriter.write_tags(track, 0, regions)
+            finally:
+                with condition:
+                    counts['writing'] -= 1
+
+        def predict_method(track, regions):
+            """Predicts how a track will be written"""
+            return TagWriter.predict_write_method(track, regions=regions)
+
+        for predict, most in ((predict_method, 2), (None, 1)):
+            counts['most'] = 0
+            directories = [[(self.load_track('%d.mp3' % (i), "New Title"), None)] \
+                           for i in range(2)]
+            warnings = []
+            writer.write(write_track, directories, 2, warnings, None, None, predict)
+            self.assertEqual(warnings, [])
+            self.assertEqual(writer.method_counts[TagWriter.WriteMethod.patched], 2)
+            self.assertEqual(counts['most'], most)
+
+
+if __name__ == '__main__':
+    unittest.main()